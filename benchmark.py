@@ -0,0 +1,541 @@
+# End-to-end benchmark of pr_reviewer.py against local stand-ins for the Bitbucket 2.0,
+# Gemini and OpenAI APIs, so performance can be measured without using real quota.
+#
+# Usage: python benchmark.py --mode 1 --repos 4 --prs 10 --llm-latency 2 --error-429-rate 0.05
+# Run "python benchmark.py --help" for all options. Pipeline, HTTP and rate limit settings are
+# read from the environment / .configs file as usual.
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+BENCHMARK_WORKSPACE = "benchmark"
+BENCHMARK_USER_UUID = "{benchmark-bot}"
+STREAM_FIRST_TOKEN_FRACTION = 0.2
+STREAM_PIECE_SIZE = 40
+PR_PATH_RE = re.compile(r"src/([^/\s]+)/pr(\d+)/")
+ADDED_LINE_RE = re.compile(r"^\+(?!\+\+ )(.*\S.*)$", re.MULTILINE)
+
+def repo_slug_of(index):
+    return f"repo-{index}"
+
+def commit_of(repo_slug, pr_id):
+    # Stable across runs (hash() of strings is salted per process), so re-runs see the same commits.
+    return hashlib.sha1(f"{repo_slug}#{pr_id}".encode()).hexdigest()[:12]
+
+def iter_fake_diff(repo_slug, pr_id, files, lines_per_file):
+    """Yields a deterministic unified diff for the PR, one file at a time."""
+    for file_index in range(files):
+        path = f"src/{repo_slug}/pr{pr_id}/module_{file_index}.py"
+        lines = [
+            f"diff --git a/{path} b/{path}",
+            "index 1111111..2222222 100644",
+            f"--- a/{path}",
+            f"+++ b/{path}",
+        ]
+        for hunk_start in range(1, lines_per_file + 1, 20):
+            hunk_lines = min(20, lines_per_file - hunk_start + 1)
+            lines.append(f"@@ -{hunk_start},{hunk_lines} +{hunk_start},{hunk_lines} @@")
+            for line_number in range(hunk_start, hunk_start + hunk_lines):
+                if line_number % 4 == 0:
+                    lines.append(f"-    value_{line_number} = legacy_compute({line_number})")
+                    lines.append(f"+    value_{file_index}_{line_number} = compute({line_number}, pr={pr_id})")
+                else:
+                    lines.append(f"     context_{line_number} = {line_number}")
+        yield "\n".join(lines) + "\n"
+
+class FakeApiState:
+    """Request counters shared by the fake servers."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.rng = random.Random(settings["seed"])
+        self.calls = {}  # "provider endpoint status" -> count
+        self.pr_calls = {}  # "repo_slug#pr_id" -> count
+        self.pr_times = {}  # "repo_slug#pr_id" -> [first, last]
+        self.comments = {}  # (repo_slug, pr_id) -> posted inline comments
+        self.approvals = 0
+
+    def record(self, provider, endpoint, status, pr_key=None):
+        now = time.time()
+        with self.lock:
+            key = f"{provider} {endpoint} {status}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if pr_key:
+                self.pr_calls[pr_key] = self.pr_calls.get(pr_key, 0) + 1
+                times = self.pr_times.setdefault(pr_key, [now, now])
+                times[1] = now
+
+    def inject_error(self, error_429_rate, error_503_rate):
+        with self.lock:
+            value = self.rng.random()
+        if value < error_429_rate:
+            return 429
+        if value < error_429_rate + error_503_rate:
+            return 503
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "pr_calls": dict(self.pr_calls),
+                "pr_times": {key: list(times) for key, times in self.pr_times.items()},
+                "comments": sum(len(comments) for comments in self.comments.values()),
+                "approvals": self.approvals,
+            }
+
+def _bitbucket_endpoint(method, rest):
+    """Names the endpoint of a /2.0/repositories/{workspace}/{repo_slug}/... path for the report."""
+    if not rest:
+        return "repository"
+    if rest[0] == "diff":
+        return "interdiff"
+    if rest[0] == "merge-base":
+        return "merge-base"
+    if len(rest) == 1:
+        return rest[0]
+    if len(rest) == 2:
+        return "pullrequest"
+    return "post comment" if method == "POST" and rest[2] == "comments" else rest[2]
+
+def _make_handler(state, provider):
+    settings = state.settings
+
+    class FakeApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json", headers=None):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def _dispatch(self, method):
+            parts = urlsplit(self.path)
+            body = self._read_body() if method == "POST" else b""
+            if parts.path == "/_stats":
+                self._send(200, state.snapshot())
+            elif provider == "bitbucket":
+                self._bitbucket(method, parts, body)
+            else:
+                self._llm(parts, body)
+
+        # --- Bitbucket --- #
+        def _base_url(self):
+            return f"http://{self.headers.get('Host')}/2.0"
+
+        def _pr_data(self, repo_slug, pr_id):
+            url = f"{self._base_url()}/repositories/{BENCHMARK_WORKSPACE}/{repo_slug}/pullrequests/{pr_id}"
+            return {
+                "type": "pullrequest",
+                "id": pr_id,
+                "title": f"Benchmark PR {pr_id} in {repo_slug}",
+                "state": "OPEN",
+                "created_on": "2025-01-01T00:00:00.000000+00:00",
+                "updated_on": f"2025-01-01T00:00:{pr_id % 60:02d}.000000+00:00",
+                "source": {"commit": {"hash": commit_of(repo_slug, pr_id)}, "branch": {"name": f"feature/{pr_id}"}},
+                "destination": {"commit": {"hash": "000000000000"}, "branch": {"name": "main"}},
+                "links": {"self": {"href": url}},
+            }
+
+        def _page(self, values, parts, default_pagelen=10):
+            query = parse_qs(parts.query)
+            pagelen = int(query.get("pagelen", [default_pagelen])[0])
+            page = int(query.get("page", ["1"])[0])
+            start = (page - 1) * pagelen
+            data = {"values": values[start:start + pagelen], "page": page, "pagelen": pagelen, "size": len(values)}
+            if start + pagelen < len(values):
+                next_query = {key: value[0] for key, value in query.items()}
+                next_query.update({"page": str(page + 1), "pagelen": str(pagelen)})
+                data["next"] = f"http://{self.headers.get('Host')}{parts.path}?" + "&".join(f"{k}={v}" for k, v in next_query.items())
+            return data
+
+        def _bitbucket(self, method, parts, body):
+            time.sleep(settings["bitbucket_latency"])
+            segments = [segment for segment in parts.path.split("/") if segment][1:]  # drop "2.0"
+            if segments == ["user"]:
+                state.record("bitbucket", "user", 200)
+                self._send(200, {"uuid": BENCHMARK_USER_UUID, "display_name": "Benchmark Bot"})
+                return
+            if len(segments) < 3 or segments[0] != "repositories":
+                state.record("bitbucket", "unknown", 404)
+                self._send(404, {"error": {"message": "not found"}})
+                return
+
+            repo_slug = segments[2]
+            rest = segments[3:]
+            error = state.inject_error(settings["bitbucket_429_rate"], 0)
+            if error:
+                state.record("bitbucket", _bitbucket_endpoint(method, rest), error)
+                self._send(error, {"error": {"message": "Rate limit for this resource has been exceeded"}}, headers={"Retry-After": str(settings["retry_after"])})
+                return
+
+            if not rest:
+                state.record("bitbucket", "repository", 200)
+                url = f"{self._base_url()}/repositories/{BENCHMARK_WORKSPACE}/{repo_slug}"
+                self._send(200, {"type": "repository", "slug": repo_slug, "full_name": f"{BENCHMARK_WORKSPACE}/{repo_slug}", "links": {"self": {"href": url}}})
+            elif rest == ["pullrequests"]:
+                state.record("bitbucket", "pullrequests", 200)
+                values = [{"type": "pullrequest", "id": pr_id} for pr_id in range(1, settings["prs"] + 1)]
+                self._send(200, self._page(values, parts))
+            elif rest[0] == "diff":
+                # Interdiff between two commits of a PR (incremental re-reviews).
+                state.record("bitbucket", "interdiff", 200)
+                self._send(200, b"", content_type="text/plain")
+            elif rest[0] == "merge-base":
+                # The PR commits are always descendants of the last reviewed one, and of main's fixed commit.
+                state.record("bitbucket", "merge-base", 200)
+                first, _, second = unquote(rest[1]).partition("..")
+                self._send(200, {"type": "commit", "hash": "000000000000" if "main" in (first, second) else first})
+            elif rest[0] == "pullrequests":
+                self._pull_request(method, parts, body, repo_slug, int(rest[1]), rest[2] if len(rest) > 2 else None)
+            else:
+                state.record("bitbucket", rest[0], 404)
+                self._send(404, {"error": {"message": "not found"}})
+
+        def _pull_request(self, method, parts, body, repo_slug, pr_id, endpoint):
+            pr_key = f"{repo_slug}#{pr_id}"
+            if endpoint is None:
+                state.record("bitbucket", "pullrequest", 200, pr_key)
+                self._send(200, self._pr_data(repo_slug, pr_id))
+            elif endpoint == "diff":
+                state.record("bitbucket", "diff", 200, pr_key)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in iter_fake_diff(repo_slug, pr_id, settings["files"], settings["lines"]):
+                    data = chunk.encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+            elif endpoint == "activity":
+                state.record("bitbucket", "activity", 200, pr_key)
+                self._send(200, {"values": []})
+            elif endpoint == "comments" and method == "GET":
+                state.record("bitbucket", "comments", 200, pr_key)
+                existing = [
+                    {"id": i, "content": {"raw": f"Existing comment {i}"}, "inline": {"path": f"src/{repo_slug}/pr{pr_id}/module_0.py", "to": i + 1}}
+                    for i in range(settings["existing_comments"])
+                ]
+                with state.lock:
+                    existing += state.comments.get((repo_slug, pr_id), [])
+                self._send(200, self._page(existing, parts))
+            elif endpoint == "comments":
+                state.record("bitbucket", "post comment", 201, pr_key)
+                comment = json.loads(body or b"{}")
+                with state.lock:
+                    comments = state.comments.setdefault((repo_slug, pr_id), [])
+                    comment["id"] = 100000 + len(comments)
+                    comments.append(comment)
+                self._send(201, comment)
+            elif endpoint == "approve":
+                state.record("bitbucket", "approve", 200, pr_key)
+                with state.lock:
+                    state.approvals += 1
+                self._send(200, {"approved": True, "user": {"uuid": BENCHMARK_USER_UUID}})
+            else:
+                state.record("bitbucket", endpoint, 404, pr_key)
+                self._send(404, {"error": {"message": "not found"}})
+
+        # --- Gemini / OpenAI --- #
+        def _llm(self, parts, body):
+            try:
+                request = json.loads(body)
+                if provider == "gemini":
+                    prompt = request["contents"][0]["parts"][0]["text"]
+                else:
+                    prompt = request["messages"][0]["content"]
+            except (ValueError, KeyError, IndexError):
+                state.record(provider, "generate", 400)
+                self._send(400, {"error": {"message": "invalid request"}})
+                return
+
+            match = PR_PATH_RE.search(prompt)
+            pr_key = f"{match.group(1)}#{match.group(2)}" if match else None
+            streaming = parts.path.endswith(":streamGenerateContent") if provider == "gemini" else bool(request.get("stream"))
+            latency = max(0.0, random.gauss(settings["llm_latency"], settings["llm_latency_jitter"]))
+            if provider == settings["tail_provider"] and random.random() < settings["tail_rate"]:
+                latency = settings["tail_latency"]
+            # A streamed answer starts after a fifth of the latency and arrives piece by piece.
+            time.sleep(latency * STREAM_FIRST_TOKEN_FRACTION if streaming else latency)
+
+            error = state.inject_error(settings["error_429_rate"], settings["error_503_rate"])
+            if error == 429:
+                state.record(provider, "generate", 429, pr_key)
+                retry_info = {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{settings['retry_after']}s"}
+                self._send(429, {"error": {"message": "Resource exhausted", "details": [retry_info]}}, headers={"Retry-After": str(settings["retry_after"])})
+                return
+            if error == 503:
+                state.record(provider, "generate", 503, pr_key)
+                self._send(503, {"error": {"message": "The model is overloaded"}}, headers={"Retry-After": str(settings["retry_after"])})
+                return
+
+            state.record(provider, "generate", 200, pr_key)
+            feedback = self._feedback(prompt, pr_key)
+            prompt_tokens = len(prompt) // 4
+            completion_tokens = len(feedback) // 4
+            if streaming:
+                self._stream(feedback, prompt_tokens, completion_tokens, latency * (1 - STREAM_FIRST_TOKEN_FRACTION))
+            elif provider == "gemini":
+                self._send(200, {
+                    "candidates": [{"content": {"parts": [{"text": feedback}]}}],
+                    "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion_tokens},
+                })
+            else:
+                self._send(200, {
+                    "choices": [{"message": {"role": "assistant", "content": feedback}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+                })
+
+        def _stream(self, feedback, prompt_tokens, completion_tokens, duration):
+            """Sends the answer as server-sent events in pieces spread over the duration."""
+            pieces = [feedback[i:i + STREAM_PIECE_SIZE] for i in range(0, len(feedback), STREAM_PIECE_SIZE)] or [""]
+            if provider == "gemini":
+                events = [{"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]} for piece in pieces]
+                events[-1]["usageMetadata"] = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion_tokens}
+            else:
+                events = [{"choices": [{"index": 0, "delta": {"content": piece}}]} for piece in pieces]
+                events.append({"choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}})
+            data = [f"data: {json.dumps(event)}\n\n" for event in events]
+            if provider == "openai":
+                data.append("data: [DONE]\n\n")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for item in data:
+                time.sleep(duration / len(data))
+                chunk = item.encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _feedback(self, prompt, pr_key):
+            rng = random.Random(f"{settings['seed']}-{pr_key}")
+            diff = prompt.split("Here is the diff:", 1)[-1]
+            added_lines = []  # (file_path, line)
+            for section in re.split(r"^\+\+\+ b/", diff, flags=re.MULTILINE)[1:]:
+                file_path, _, body = section.partition("\n")
+                added_lines += [(file_path.strip(), line) for line in ADDED_LINE_RE.findall(body)]
+            if not added_lines or rng.random() >= settings["comment_rate"]:
+                return "approve"
+            comments = [
+                {"file_path": file_path, "line_content": line.strip(), "comment": "Benchmark finding: please double check this line."}
+                for file_path, line in rng.sample(added_lines, min(settings["comments_per_review"], len(added_lines)))
+            ]
+            return "```json\n" + json.dumps(comments, indent=2) + "\n```"
+
+    return FakeApiHandler
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Keep-alive connections are reset when the benchmarked process exits.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def serve_fake_apis(settings, ready):
+    """Runs the fake Bitbucket, Gemini and OpenAI servers (in a separate process) until terminated."""
+    state = FakeApiState(settings)
+    servers = {}
+    for provider in ("bitbucket", "gemini", "openai"):
+        server = FakeApiServer(("127.0.0.1", 0), _make_handler(state, provider))
+        servers[provider] = server
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.put({provider: server.server_port for provider, server in servers.items()})
+    while True:
+        time.sleep(3600)
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_benchmark(args):
+    settings = {
+        "seed": args.seed,
+        "prs": args.prs,
+        "files": args.files,
+        "lines": args.lines,
+        "existing_comments": args.existing_comments,
+        "comment_rate": args.comment_rate,
+        "comments_per_review": args.comments_per_review,
+        "llm_latency": args.llm_latency,
+        "llm_latency_jitter": args.llm_latency_jitter,
+        "bitbucket_latency": args.bitbucket_latency,
+        "bitbucket_429_rate": args.bitbucket_429_rate,
+        "error_429_rate": args.error_429_rate,
+        "error_503_rate": args.error_503_rate,
+        "retry_after": args.retry_after,
+        "tail_provider": "openai" if args.agent == "codex" else "gemini",
+        "tail_rate": args.tail_rate,
+        "tail_latency": args.tail_latency,
+    }
+    ready = multiprocessing.Queue()
+    server_process = multiprocessing.Process(target=serve_fake_apis, args=(settings, ready), daemon=True)
+    server_process.start()
+    ports = ready.get(timeout=30)
+
+    state_dir = tempfile.mkdtemp(prefix="pr_reviewer_benchmark_")
+    repo_slugs = ",".join(repo_slug_of(i) for i in range(args.repos))
+    os.environ.update({
+        "BITBUCKET_EMAIL": "benchmark@example.com",
+        "BITBUCKET_API_TOKEN": "benchmark",
+        "BITBUCKET_WORKSPACE": BENCHMARK_WORKSPACE,
+        "NON_INTERACTIVE": "yes",
+        "PRINT_PROMPT_WHEN_AI_AGENT_FAIL": "no",
+        "AI_AGENT": args.agent,
+        "AI_HEDGE_AGENT": args.hedge_agent or "",
+        "OPENAI_API_KEY": "benchmark",
+        "MODE": str(args.mode),
+        "MODE_1_REPO_SLUG_LIST": repo_slugs,
+        "MODE_2_REPO_SLUG": repo_slug_of(0),
+        "MODE_2_PR_ID": "1",
+        "MODE_3_REPO_SLUG_LIST": repo_slugs,
+        "MODE_3_START_DATE": "2025-01-01",
+        "MODE_3_END_DATE": "2025-12-31",
+        "REVIEW_CACHE_BYPASS": "yes",
+        "REVIEW_STATE_FILE": os.path.join(state_dir, "review_state.json"),
+        "JOB_STORE_FILE": os.path.join(state_dir, "review_jobs.sqlite3"),
+    })
+
+    import pr_reviewer
+    import http_client
+    import metrics
+    pr_reviewer.BITBUCKET_API_BASE_URL = f"http://127.0.0.1:{ports['bitbucket']}/2.0"
+    pr_reviewer.GEMINI_API_ENDPOINT = f"http://127.0.0.1:{ports['gemini']}/v1beta/models/{{model}}:generateContent"
+    pr_reviewer.OPENAI_API_ENDPOINT = f"http://127.0.0.1:{ports['openai']}/v1/chat/completions"
+    pr_reviewer.get_gemini_credentials = lambda: SimpleNamespace(token="benchmark")
+
+    output = sys.stdout if args.verbose else io.StringIO()
+    error = None
+    started = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(output):
+            pr_reviewer.main()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.monotonic() - started
+
+    stats = http_client.get(f"http://127.0.0.1:{ports['bitbucket']}/_stats").json()
+    server_process.terminate()
+
+    latencies = [last - first for first, last in stats["pr_times"].values()]
+    reviewed = len(stats["pr_times"])
+    http_calls = sum(stats["calls"].values())
+    report = {
+        "mode": args.mode,
+        "agent": args.agent,
+        "repos": args.repos if args.mode != 2 else 1,
+        "prs": reviewed,
+        "elapsed_seconds": round(elapsed, 3),
+        "prs_per_minute": round(reviewed * 60 / elapsed, 2) if elapsed else None,
+        "pr_latency_p50_seconds": round(percentile(latencies, 0.50), 3) if latencies else None,
+        "pr_latency_p95_seconds": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "http_calls": http_calls,
+        "http_calls_per_pr": round(http_calls / reviewed, 2) if reviewed else None,
+        "http_calls_by_endpoint": dict(sorted(stats["calls"].items())),
+        "comments_posted": stats["comments"],
+        "approvals": stats["approvals"],
+        "peak_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+        "error": error,
+        # Spans and counters collected by pr_reviewer itself (only written to the JSON report).
+        "metrics": metrics.get_metrics().snapshot(),
+    }
+    return report
+
+def print_report(report):
+    print("\n--- Benchmark Report ---")
+    for key in ("mode", "agent", "repos", "prs", "elapsed_seconds", "prs_per_minute", "pr_latency_p50_seconds",
+                "pr_latency_p95_seconds", "http_calls", "http_calls_per_pr", "comments_posted", "approvals", "peak_rss_mb"):
+        print(f"{key}: {report[key]}")
+    print("HTTP calls by endpoint:")
+    for endpoint, count in report["http_calls_by_endpoint"].items():
+        print(f"  {endpoint}: {count}")
+    if report["error"]:
+        print(f"Run failed: {report['error']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pr_reviewer.py against local fake Bitbucket, Gemini and OpenAI servers.")
+    parser.add_argument("--mode", type=int, choices=(1, 2, 3), default=1, help="review mode to run (default: 1)")
+    parser.add_argument("--agent", choices=("gemini", "codex"), default="gemini", help="AI agent to use (default: gemini)")
+    parser.add_argument("--repos", type=int, default=2, help="number of repositories (default: 2)")
+    parser.add_argument("--prs", type=int, default=10, help="open PRs per repository (default: 10)")
+    parser.add_argument("--files", type=int, default=5, help="files changed per PR (default: 5)")
+    parser.add_argument("--lines", type=int, default=100, help="diff lines per file (default: 100)")
+    parser.add_argument("--existing-comments", type=int, default=0, help="inline comments already on every PR (default: 0)")
+    parser.add_argument("--comment-rate", type=float, default=0.5, help="fraction of reviews with comments instead of an approval (default: 0.5)")
+    parser.add_argument("--comments-per-review", type=int, default=3, help="comments per review that is not an approval (default: 3)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mean AI agent latency in seconds (default: 1.0)")
+    parser.add_argument("--llm-latency-jitter", type=float, default=0.2, help="standard deviation of the AI agent latency (default: 0.2)")
+    parser.add_argument("--bitbucket-latency", type=float, default=0.02, help="Bitbucket latency in seconds (default: 0.02)")
+    parser.add_argument("--bitbucket-429-rate", type=float, default=0.0, help="fraction of Bitbucket calls answered with 429 (default: 0)")
+    parser.add_argument("--error-429-rate", type=float, default=0.0, help="fraction of AI agent calls answered with 429 (default: 0)")
+    parser.add_argument("--error-503-rate", type=float, default=0.0, help="fraction of AI agent calls answered with 503 (default: 0)")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of calls to the selected AI agent that take --tail-latency seconds (default: 0)")
+    parser.add_argument("--tail-latency", type=float, default=30.0, help="latency of those slow calls in seconds (default: 30)")
+    parser.add_argument("--hedge-agent", choices=("gemini", "codex"), help="also ask this AI agent when the selected one is slow or failing")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry delay in seconds announced with 429/503 (default: 1.0)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed (default: 42)")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the output of pr_reviewer.py")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import os
+from dataclasses import dataclass, fields
+from typing import Optional
+
+CONFIG_FILE = ".configs"
+TRUE_VALUES = ("yes", "true", "1")
+FALSE_VALUES = ("no", "false", "0")
+
+class ConfigError(Exception):
+    """Raised for missing or invalid configuration values when prompting is not allowed."""
+
+@dataclass(frozen=True)
+class Settings:
+    """The integer and yes/no keys, parsed once when the configuration is loaded.
+
+    A field is None when its key is not set (or invalid, if interactive); the callers
+    apply their own defaults. Fields are the lowercased key names.
+    """
+    non_interactive: Optional[bool] = None
+    # HTTP, rate limits and metrics
+    http_pool_size: Optional[int] = None
+    http_connect_timeout: Optional[int] = None
+    http_read_timeout: Optional[int] = None
+    gemini_requests_per_minute: Optional[int] = None
+    gemini_tokens_per_minute: Optional[int] = None
+    gemini_max_concurrency: Optional[int] = None
+    openai_requests_per_minute: Optional[int] = None
+    openai_tokens_per_minute: Optional[int] = None
+    openai_max_concurrency: Optional[int] = None
+    bitbucket_requests_per_minute: Optional[int] = None
+    bitbucket_tokens_per_minute: Optional[int] = None
+    bitbucket_max_concurrency: Optional[int] = None
+    metrics_port: Optional[int] = None
+    # AI agents
+    gemini_token_refresh_margin_seconds: Optional[int] = None
+    print_prompt_when_ai_agent_fail: Optional[bool] = None
+    llm_streaming: Optional[bool] = None
+    llm_chunk_max_tokens: Optional[int] = None
+    llm_chunk_concurrency: Optional[int] = None
+    ai_hedge_initial_delay_seconds: Optional[int] = None
+    ai_hedge_percentile: Optional[int] = None
+    ai_hedge_min_delay_seconds: Optional[int] = None
+    ai_circuit_failures: Optional[int] = None
+    ai_circuit_reset_seconds: Optional[int] = None
+    review_cache_bypass: Optional[bool] = None
+    review_cache_max_mb: Optional[int] = None
+    review_cache_max_age_days: Optional[int] = None
+    # Diffs
+    diff_streaming: Optional[bool] = None
+    diff_max_bytes: Optional[int] = None
+    diff_max_files: Optional[int] = None
+    diff_filter: Optional[bool] = None
+    diff_skip_generated: Optional[bool] = None
+    diff_skip_whitespace_only: Optional[bool] = None
+    diff_context_lines: Optional[int] = None
+    diff_max_lines_per_file: Optional[int] = None
+    incremental_review: Optional[bool] = None
+    # Comments
+    comment_post_concurrency: Optional[int] = None
+    comment_post_retries: Optional[int] = None
+    comment_max_per_pr: Optional[int] = None
+    # Modes
+    pipeline_list_workers: Optional[int] = None
+    pipeline_check_workers: Optional[int] = None
+    pipeline_diff_workers: Optional[int] = None
+    pipeline_llm_workers: Optional[int] = None
+    pipeline_post_workers: Optional[int] = None
+    pipeline_queue_size: Optional[int] = None
+    mode_3_resume: Optional[bool] = None
+    job_store_batch_size: Optional[int] = None
+    job_store_flush_seconds: Optional[int] = None
+    webhook_port: Optional[int] = None
+    webhook_allow_unsigned: Optional[bool] = None
+    webhook_workers: Optional[int] = None
+    webhook_coalesce_seconds: Optional[int] = None
+    watch_interval_seconds: Optional[int] = None
+    watch_jitter_seconds: Optional[int] = None
+
+def _parse_bool(value):
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+PARSERS = {Optional[int]: int, Optional[bool]: _parse_bool}
+
+class Config:
+    """Configuration read once from the environment and the .configs file.
+
+    Environment variables take precedence over the file. Missing values are prompted for,
+    unless NON_INTERACTIVE=yes, in which case a ConfigError is raised instead. The typed
+    keys are parsed right away into settings: with NON_INTERACTIVE=yes an invalid value
+    raises a ConfigError, otherwise it is reported once and its default is used.
+    """
+
+    def __init__(self, file_values=None, environ=None):
+        self._file_values = file_values or {}
+        self._environ = dict(os.environ if environ is None else environ)
+        self.interactive = self._raw("NON_INTERACTIVE", "no").lower() not in TRUE_VALUES
+        self.settings = self._parse_settings()
+
+    def _parse_settings(self):
+        values = {}
+        errors = []
+        for field in fields(Settings):
+            name = field.name.upper()
+            value = self._raw(name)
+            if value is None:
+                continue
+            try:
+                values[field.name] = PARSERS[field.type](value)
+            except ValueError:
+                errors.append(f"Invalid value for {name}: '{value}'.")
+        if errors and not self.interactive:
+            raise ConfigError(" ".join(errors))
+        for error in errors:
+            print(f"{error} Using its default.")
+        return Settings(**values)
+
+    @classmethod
+    def load(cls, path=CONFIG_FILE):
+        """Parses the config file (if any), snapshots the environment and parses the typed keys."""
+        file_values = {}
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    name, separator, value = line.partition("=")
+                    value = value.strip()
+                    # The first non-empty value of a key wins.
+                    if separator and value and name not in file_values:
+                        file_values[name] = value
+        except FileNotFoundError:
+            pass
+        return cls(file_values)
+
+    def _raw(self, name, default=None):
+        value = (self._environ.get(name) or "").strip()
+        if value:
+            return value
+        return self._file_values.get(name, default)
+
+    def get(self, name, prompt="", is_list=False, default=None):
+        """Returns the value of the key, its default, or prompts the user for it."""
+        value = self._raw(name)
+        if value is None:
+            if default is not None:
+                return default
+            if not self.interactive:
+                raise ConfigError(f"{name} is not set (set it in the environment or in {CONFIG_FILE}).")
+            value = input(prompt)
+        if is_list:
+            return [item.strip() for item in value.split(',')]
+        return value
+
+    def _typed(self, name):
+        try:
+            return getattr(self.settings, name.lower())
+        except AttributeError:
+            raise KeyError(f"{name} is not a typed configuration key; add it to Settings.") from None
+
+    def get_int(self, name, default):
+        """Returns the key as an integer, or the default when it is unset or invalid."""
+        value = self._typed(name)
+        return default if value is None else value
+
+    def get_bool(self, name, default=False, prompt=None):
+        """Returns the key as a boolean (yes/no). Prompts for it if it is unset, a prompt is given and prompting is allowed."""
+        value = self._typed(name)
+        if value is not None:
+            return value
+        if prompt is None or not self.interactive or self._raw(name) is not None:
+            return default
+        answer = input(prompt)
+        try:
+            return _parse_bool(answer)
+        except ValueError:
+            return self.invalid(name, answer, default)
+
+    def invalid(self, name, value, default):
+        """Handles an invalid value: raises a ConfigError in non-interactive mode, otherwise returns the default."""
+        if not self.interactive:
+            raise ConfigError(f"Invalid value for {name}: '{value}'.")
+        print(f"Invalid value for {name}: '{value}'. Using {default}.")
+        return default
+
+_config = None
+
+def load_config():
+    """Returns the configuration, reading it on first use."""
+    global _config
+    if _config is None:
+        _config = Config.load()
+    return _config
@@ -0,0 +1,188 @@
+import fnmatch
+import posixpath
+import re
+
+from diff_parser import DiffFile, hunk_section, hunk_start_lines, make_hunk
+
+# Files that are never worth a review: lockfiles, minified bundles and source maps.
+DEFAULT_EXCLUDE_PATTERNS = (
+    "*.lock",
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "pnpm-lock.yaml",
+    "go.sum",
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+)
+# Files where a change of indentation changes the meaning; their whitespace changes are always reviewed.
+INDENTATION_SENSITIVE_PATTERNS = ("*.py", "*.pyi", "*.yaml", "*.yml", "Makefile", "*.mk", "GNUmakefile", "*.coffee", "*.haml", "*.pug", "*.sass", "*.styl")
+GENERATED_MARKERS = ("@generated", "do not edit", "auto-generated", "autogenerated", "code generated by")
+GENERATED_MARKER_LINES = 5  # only the first lines of a file are checked for the markers
+MINIFIED_LINE_LENGTH = 1000  # an added line this long looks minified or generated
+MINIFIED_LINE_SHARE = 0.5  # ... and a file is only treated as generated when at least this share of its added lines are
+SUBMODULE_MODE = "160000"
+WHITESPACE_RE = re.compile(r"\s+")
+
+class FilterReport:
+    """What filter_diff removed from a diff."""
+
+    def __init__(self):
+        self.dropped_files = []  # (path, reason)
+        self.dropped_hunks = 0
+        self.trimmed_lines = 0
+        self.truncated_files = []
+
+    def __bool__(self):
+        return bool(self.dropped_files or self.dropped_hunks or self.trimmed_lines or self.truncated_files)
+
+def is_excluded(path, patterns):
+    """Returns True if the path, or its file name, matches one of the glob patterns."""
+    name = posixpath.basename(path)
+    return any(fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+def is_submodule(diff_file):
+    """Returns True for a submodule pointer update."""
+    if any(line.startswith("index ") and line.endswith(" " + SUBMODULE_MODE) for line in diff_file.header_lines):
+        return True
+    lines = [line for hunk in diff_file.hunks for line in hunk.lines if line.kind in "+-"]
+    return bool(lines) and all(line.content.startswith("Subproject commit ") for line in lines)
+
+def is_generated(diff_file):
+    """Guesses whether a file is generated: a generated-code marker at its top, or mostly minified added lines."""
+    added = [len(line.content) for hunk in diff_file.hunks for line in hunk.lines if line.kind == "+"]
+    if added and sum(1 for length in added if length >= MINIFIED_LINE_LENGTH) >= MINIFIED_LINE_SHARE * len(added):
+        return True
+    if diff_file.hunks and diff_file.hunks[0].new_start <= GENERATED_MARKER_LINES:
+        top = [line.content.lower() for line in diff_file.hunks[0].lines[:GENERATED_MARKER_LINES] if line.kind in "+ "]
+        return any(marker in line for line in top for marker in GENERATED_MARKERS)
+    return False
+
+def is_whitespace_only(hunk):
+    """Returns True if the hunk only changes whitespace or blank lines."""
+    removed = [WHITESPACE_RE.sub("", line.content) for line in hunk.lines if line.kind == "-"]
+    added = [WHITESPACE_RE.sub("", line.content) for line in hunk.lines if line.kind == "+"]
+    return [text for text in removed if text] == [text for text in added if text]
+
+def split_hunk(hunk, keep):
+    """Returns the hunks made of the kept lines (keep is a flag per line) with recomputed headers."""
+    section = hunk_section(hunk)
+    old_line, new_line = hunk_start_lines(hunk)
+    hunks = []
+    current = None
+    for line, kept in zip(hunk.lines, keep):
+        if kept:
+            if current is None:
+                current = (old_line, new_line, [])
+            current[2].append(line)
+        elif current is not None:
+            hunks.append(make_hunk(*current, section))
+            section = ""
+            current = None
+        if line.kind in "- ":
+            old_line += 1
+        if line.kind in "+ ":
+            new_line += 1
+    if current is not None:
+        hunks.append(make_hunk(*current, section))
+    return hunks
+
+def _context_mask(lines, context_lines):
+    """Flags the lines within context_lines of a change ('\\' markers follow the line before them)."""
+    count = len(lines)
+    distance = [count + context_lines + 1] * count
+    last = None
+    for index, line in enumerate(lines):
+        if line.kind in "+-":
+            last = index
+        if last is not None:
+            distance[index] = index - last
+    last = None
+    for index in range(count - 1, -1, -1):
+        if lines[index].kind in "+-":
+            last = index
+        if last is not None:
+            distance[index] = min(distance[index], last - index)
+    keep = [d <= context_lines for d in distance]
+    for index, line in enumerate(lines):
+        if line.kind == "\\":
+            keep[index] = index > 0 and keep[index - 1]
+    return keep
+
+def _copy_file(diff_file, hunks):
+    copy = DiffFile(diff_file.path, diff_file.old_path)
+    copy.status = diff_file.status
+    copy.is_binary = diff_file.is_binary
+    copy.header_lines = diff_file.header_lines
+    copy.hunks = hunks
+    # Comments are still matched against every line of the original diff.
+    copy.line_index = diff_file.line_index
+    return copy
+
+def filter_diff(diff_files, exclude_patterns=DEFAULT_EXCLUDE_PATTERNS, skip_generated=True, skip_whitespace_only=False, context_lines=None, max_lines_per_file=0):
+    """Removes what is not worth reviewing from the parsed diff. Returns the kept DiffFile objects and a FilterReport.
+
+    Files matching exclude_patterns, binary files, submodule updates and (with skip_generated)
+    generated or minified files are dropped. Whitespace-only hunks are dropped with
+    skip_whitespace_only, except in INDENTATION_SENSITIVE_PATTERNS files; unchanged lines further than context_lines from a change are trimmed
+    when context_lines is not None, and files are cut after max_lines_per_file lines (0 means unlimited).
+    The original DiffFile objects are not modified.
+    """
+    kept = []
+    report = FilterReport()
+    for diff_file in diff_files:
+        if is_excluded(diff_file.path, exclude_patterns):
+            reason = "excluded"
+        elif diff_file.is_binary:
+            reason = "binary"
+        elif is_submodule(diff_file):
+            reason = "submodule"
+        elif skip_generated and is_generated(diff_file):
+            reason = "generated"
+        else:
+            reason = None
+        if reason is not None:
+            report.dropped_files.append((diff_file.path, reason))
+            continue
+        if not diff_file.hunks:
+            # Renames and mode changes without content changes.
+            kept.append(diff_file)
+            continue
+
+        hunks = diff_file.hunks
+        if skip_whitespace_only and not is_excluded(diff_file.path, INDENTATION_SENSITIVE_PATTERNS):
+            hunks = [hunk for hunk in hunks if not is_whitespace_only(hunk)]
+            report.dropped_hunks += len(diff_file.hunks) - len(hunks)
+            if not hunks:
+                report.dropped_files.append((diff_file.path, "whitespace"))
+                continue
+
+        if context_lines is not None:
+            trimmed = []
+            for hunk in hunks:
+                keep = _context_mask(hunk.lines, max(0, context_lines))
+                if all(keep):
+                    trimmed.append(hunk)
+                    continue
+                report.trimmed_lines += keep.count(False)
+                trimmed.extend(split_hunk(hunk, keep))
+            hunks = trimmed
+
+        if max_lines_per_file:
+            remaining = max_lines_per_file
+            truncated = []
+            for hunk in hunks:
+                if remaining <= 0:
+                    break
+                if len(hunk.lines) <= remaining:
+                    truncated.append(hunk)
+                else:
+                    truncated.extend(split_hunk(hunk, [index < remaining for index in range(len(hunk.lines))]))
+                remaining -= len(hunk.lines)
+            # A hunk was cut (remaining < 0), or the cut fell on a hunk boundary and the next hunks were dropped.
+            if remaining < 0 or len(truncated) < len(hunks):
+                report.truncated_files.append(diff_file.path)
+            hunks = truncated
+
+        kept.append(diff_file if hunks == diff_file.hunks else _copy_file(diff_file, hunks))
+    return kept, report
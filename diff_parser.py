@@ -0,0 +1,375 @@
+import re
+
+DEV_NULL = "/dev/null"
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+class DiffLine:
+    """A single line of a hunk with its precomputed old/new file line numbers.
+
+    kind is '+', '-', ' ' or '\\' (for "\\ No newline at end of file" markers).
+    anchor_line is the new-file line an inline comment on this line is attached to;
+    for removed lines it is the new-file line that follows the removal.
+    """
+    __slots__ = ("kind", "content", "old_line", "new_line", "anchor_line")
+
+    def __init__(self, kind, content, old_line, new_line, anchor_line):
+        self.kind = kind
+        self.content = content
+        self.old_line = old_line
+        self.new_line = new_line
+        self.anchor_line = anchor_line
+
+    def __repr__(self):
+        return f"DiffLine({self.kind!r}, {self.content!r}, old={self.old_line}, new={self.new_line})"
+
+class DiffHunk:
+    """A hunk of a file diff, starting with its "@@ -a,b +c,d @@" header."""
+    __slots__ = ("header", "old_start", "old_count", "new_start", "new_count", "lines")
+
+    def __init__(self, header, old_start, old_count, new_start, new_count):
+        self.header = header
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.lines = []
+
+    def __repr__(self):
+        return f"DiffHunk({self.header!r}, {len(self.lines)} lines)"
+
+class DiffFile:
+    """The diff of a single file.
+
+    path is the new path of the file, or the old path for deleted files.
+    status is one of 'added', 'deleted', 'renamed' or 'modified'.
+    """
+    __slots__ = ("path", "old_path", "status", "is_binary", "header_lines", "hunks", "line_index")
+
+    def __init__(self, path, old_path):
+        self.path = path
+        self.old_path = old_path
+        self.status = "modified"
+        self.is_binary = False
+        self.header_lines = []
+        self.hunks = []
+        # Normalized line content -> anchor line numbers, in diff order.
+        self.line_index = {}
+
+    def find_line(self, line_content):
+        """Returns the first new-file line number matching the given line content, or None."""
+        candidates = self.line_index.get(normalize_line(line_content))
+        return candidates[0] if candidates else None
+
+    def iter_lines(self):
+        """Yields the diff text of this file line by line."""
+        yield from self.header_lines
+        for hunk in self.hunks:
+            yield hunk.header
+            for line in hunk.lines:
+                yield line.kind + line.content
+
+    def __repr__(self):
+        return f"DiffFile({self.path!r}, status={self.status!r}, {len(self.hunks)} hunks)"
+
+def _format_range(start, count):
+    if count == 1:
+        return str(start)
+    if count == 0:
+        return f"{start - 1},0"
+    return f"{start},{count}"
+
+def make_hunk(old_line, new_line, lines, section=""):
+    """Builds a hunk of the given lines with a recomputed header.
+
+    old_line/new_line are the numbers of the first old/new line of the hunk; a range with
+    a count of 0 is written as the line before the insertion/removal, like git does.
+    """
+    old_count = sum(1 for line in lines if line.kind in "- ")
+    new_count = sum(1 for line in lines if line.kind in "+ ")
+    header = f"@@ -{_format_range(old_line, old_count)} +{_format_range(new_line, new_count)} @@{section}"
+    hunk = DiffHunk(header, old_line, old_count, new_line, new_count)
+    hunk.lines = lines
+    return hunk
+
+def hunk_start_lines(hunk):
+    """Returns the numbers of the first old/new line of the hunk, as make_hunk expects them."""
+    return (hunk.old_start if hunk.old_count else hunk.old_start + 1, hunk.new_start if hunk.new_count else hunk.new_start + 1)
+
+def hunk_section(hunk):
+    """Returns the section heading that follows the "@@ ... @@" of the hunk header."""
+    match = HUNK_HEADER_RE.match(hunk.header)
+    return hunk.header[match.end():] if match else ""
+
+def normalize_line(line_content):
+    """Normalizes line content for matching AI comments against diff lines."""
+    return line_content.strip()
+
+def _unquote_path(path):
+    """Removes the quoting git applies to paths with special characters."""
+    if len(path) >= 2 and path.startswith('"') and path.endswith('"'):
+        return path[1:-1].encode("latin-1", "backslashreplace").decode("unicode_escape").encode("latin-1").decode("utf-8", "replace")
+    return path
+
+def _strip_prefix(path):
+    """Strips the a/ or b/ prefix of a diff path. Returns None for /dev/null."""
+    path = _unquote_path(path.split("\t", 1)[0].rstrip())
+    if path == DEV_NULL:
+        return None
+    if path.startswith(("a/", "b/")):
+        return path[2:]
+    return path
+
+def _paths_from_git_header(line):
+    """Extracts the (old, new) paths from a "diff --git a/... b/..." line."""
+    rest = line[len("diff --git "):]
+    if rest.startswith('"'):
+        end = rest.find('" ', 1)
+        if end != -1:
+            return _strip_prefix(rest[:end + 1]), _strip_prefix(rest[end + 2:])
+    # Unrenamed files have identical halves, which also handles paths containing " b/".
+    half = (len(rest) - 1) // 2
+    if len(rest) % 2 == 1 and rest[half] == " " and rest[2:half] == rest[half + 3:]:
+        return _strip_prefix(rest[:half]), _strip_prefix(rest[half + 1:])
+    old, sep, new = rest.rpartition(" b/")
+    if not sep:
+        return None, None
+    return _strip_prefix(old), new
+
+class DiffParser:
+    """Incremental unified diff parser. Feed it lines and collect finished DiffFile objects."""
+
+    def __init__(self):
+        self.current = None
+        self.hunk = None
+        self.old_line = 0
+        self.new_line = 0
+        self.old_remaining = 0
+        self.new_remaining = 0
+
+    def feed(self, line):
+        """Parses one diff line. Returns the previous DiffFile when a new file starts, otherwise None."""
+        if line.startswith("diff --git ") or line.startswith("diff --cc "):
+            finished = self.finish()
+            old_path, new_path = _paths_from_git_header(line) if line.startswith("diff --git ") else (None, line[len("diff --cc "):])
+            self.current = DiffFile(new_path or old_path, old_path)
+            self.current.header_lines.append(line)
+            return finished
+
+        current = self.current
+        if current is None:
+            return None
+
+        if self.old_remaining > 0 or self.new_remaining > 0:
+            self._add_hunk_line(line)
+            return None
+
+        if line.startswith("@@"):
+            match = HUNK_HEADER_RE.match(line)
+            if match:
+                old_start, old_count, new_start, new_count = match.groups()
+                self.hunk = DiffHunk(
+                    line,
+                    int(old_start),
+                    int(old_count) if old_count is not None else 1,
+                    int(new_start),
+                    int(new_count) if new_count is not None else 1,
+                )
+                current.hunks.append(self.hunk)
+                self.old_line, self.new_line = self.hunk.old_start, self.hunk.new_start
+                self.old_remaining, self.new_remaining = self.hunk.old_count, self.hunk.new_count
+                return None
+
+        if not current.hunks:
+            self._add_header_line(line)
+        elif self.hunk is not None and line[:1] in ("+", "-", " ", "\\"):
+            # Hunk counts were off; keep the line rather than dropping it.
+            self._add_hunk_line(line)
+        return None
+
+    def _add_header_line(self, line):
+        current = self.current
+        current.header_lines.append(line)
+        if line.startswith("new file mode"):
+            current.status = "added"
+        elif line.startswith("deleted file mode"):
+            current.status = "deleted"
+        elif line.startswith("rename from "):
+            current.old_path = _unquote_path(line[len("rename from "):])
+            current.status = "renamed"
+        elif line.startswith("rename to "):
+            current.path = _unquote_path(line[len("rename to "):])
+            current.status = "renamed"
+        elif line.startswith("Binary files ") or line.startswith("GIT binary patch"):
+            current.is_binary = True
+        elif line.startswith("--- "):
+            old_path = _strip_prefix(line[4:])
+            if old_path is None:
+                current.status = "added"
+            else:
+                current.old_path = old_path
+        elif line.startswith("+++ "):
+            new_path = _strip_prefix(line[4:])
+            if new_path is None:
+                current.status = "deleted"
+                current.path = current.old_path or current.path
+            else:
+                current.path = new_path
+
+    def _add_hunk_line(self, line):
+        kind = line[:1] or " "
+        content = line[1:]
+        if kind == "+":
+            diff_line = DiffLine(kind, content, None, self.new_line, self.new_line)
+            self.new_line += 1
+            self.new_remaining -= 1
+        elif kind == "-":
+            diff_line = DiffLine(kind, content, self.old_line, None, self.new_line)
+            self.old_line += 1
+            self.old_remaining -= 1
+        elif kind == "\\":
+            self.hunk.lines.append(DiffLine(kind, content, None, None, None))
+            return
+        else:
+            diff_line = DiffLine(" ", content, self.old_line, self.new_line, self.new_line)
+            self.old_line += 1
+            self.new_line += 1
+            self.old_remaining -= 1
+            self.new_remaining -= 1
+        self.hunk.lines.append(diff_line)
+
+        normalized = normalize_line(content)
+        if normalized:
+            candidates = self.current.line_index.get(normalized)
+            if candidates is None:
+                self.current.line_index[normalized] = [diff_line.anchor_line]
+            else:
+                candidates.append(diff_line.anchor_line)
+
+    def finish(self):
+        """Returns the file being parsed (if any) and resets the parser.
+
+        A hunk cut off before its end gets a header matching the lines it has.
+        """
+        finished = self.current
+        hunk = self.hunk
+        if hunk is not None and (self.old_remaining > 0 or self.new_remaining > 0):
+            if hunk.lines:
+                finished.hunks[-1] = make_hunk(*hunk_start_lines(hunk), hunk.lines, hunk_section(hunk))
+            else:
+                finished.hunks.pop()
+        self.current = None
+        self.hunk = None
+        self.old_remaining = self.new_remaining = 0
+        return finished
+
+def parse_diff(diff_text):
+    """Parses the diff text and returns an ordered map of file paths to DiffFile objects."""
+    files = {}
+    parser = DiffParser()
+    for line in diff_text.splitlines():
+        finished = parser.feed(line)
+        if finished is not None:
+            files[finished.path] = finished
+    finished = parser.finish()
+    if finished is not None:
+        files[finished.path] = finished
+    return files
+
+class DiffLimitError(Exception):
+    """Raised when the diff limits leave nothing of a diff to review."""
+
+class DiffReader:
+    """Incrementally parses an iterable of diff lines into DiffFile objects.
+
+    Reading stops as soon as max_bytes (approximate, counted per line) or max_files is
+    exceeded, and truncated is set. A file cut off by the byte limit is kept up to the
+    last complete line, unless none of its hunk lines were read.
+    A limit of 0 means unlimited.
+    """
+
+    def __init__(self, lines, max_bytes=0, max_files=0):
+        self.lines = lines
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.bytes_read = 0
+        self.files_read = 0
+        self.truncated = False
+
+    def __iter__(self):
+        parser = DiffParser()
+        try:
+            for line in self.lines:
+                self.bytes_read += len(line) + 1
+                if self.max_bytes and self.bytes_read > self.max_bytes:
+                    self.truncated = True
+                    finished = parser.finish()
+                    if finished is not None and finished.hunks:
+                        self.files_read += 1
+                        yield finished
+                    return
+                finished = parser.feed(line)
+                if finished is not None:
+                    self.files_read += 1
+                    yield finished
+                    if self.max_files and self.files_read >= self.max_files:
+                        # A new file has already started, so there is more diff left.
+                        self.truncated = True
+                        return
+            finished = parser.finish()
+            if finished is not None:
+                self.files_read += 1
+                yield finished
+        finally:
+            close = getattr(self.lines, "close", None)
+            if close is not None:
+                close()
+
+def format_diff(diff_files):
+    """Rebuilds the unified diff text of the given DiffFile objects."""
+    return "\n".join(line for diff_file in diff_files for line in diff_file.iter_lines())
+
+def estimate_tokens(text):
+    """Roughly estimates the number of LLM tokens in a text (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+def _pack_pieces(pieces, max_tokens):
+    """Greedily packs (text, tokens) pieces, in order, into chunks under the token budget."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for text, tokens in pieces:
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def chunk_diff(diff_files, max_tokens):
+    """Splits the parsed diff into diff texts of at most max_tokens each (estimated).
+
+    Chunks are split on file boundaries, and files larger than the budget are split on
+    hunk boundaries with their file header repeated in every chunk. A single hunk that is
+    larger than the budget becomes a chunk of its own.
+    """
+    pieces = []
+    for diff_file in diff_files:
+        text = "\n".join(diff_file.iter_lines())
+        tokens = estimate_tokens(text)
+        if tokens <= max_tokens or len(diff_file.hunks) <= 1:
+            pieces.append((text, tokens))
+            continue
+
+        header = "\n".join(diff_file.header_lines)
+        header_tokens = estimate_tokens(header)
+        hunk_pieces = []
+        for hunk in diff_file.hunks:
+            hunk_text = "\n".join([hunk.header] + [line.kind + line.content for line in hunk.lines])
+            hunk_pieces.append((hunk_text, estimate_tokens(hunk_text)))
+        for hunks_text in _pack_pieces(hunk_pieces, max(1, max_tokens - header_tokens)):
+            file_text = header + "\n" + hunks_text if header else hunks_text
+            pieces.append((file_text, estimate_tokens(file_text)))
+    return _pack_pieces(pieces, max_tokens)
@@ -0,0 +1,77 @@
+import json
+import re
+
+CODE_FENCE_RE = re.compile(r"^\s*```[\w-]*[ \t]*\n?(.*?)\n?[ \t]*```\s*$", re.DOTALL)
+
+def strip_code_fence(text):
+    """Returns the content of a markdown code fence (```json ... ```), or the text itself if it is not fenced."""
+    match = CODE_FENCE_RE.match(text)
+    return match.group(1) if match else text.strip()
+
+class JsonArrayStream:
+    """Incrementally extracts the objects of the first top-level JSON array of a text stream.
+
+    feed() can be called with arbitrary pieces of the text and returns the objects completed
+    by that piece, so they can be used before the whole text has arrived. Anything before the
+    array (such as a code fence) or after it is ignored, as are elements that are not objects.
+    The array starts at the first "[" followed by "{" or "]", so prose such as "a [critical]
+    issue" before it is skipped too.
+    """
+
+    def __init__(self):
+        self._depth = 0  # 0: before the array, 1: between elements, >1: inside an element
+        self._done = False
+        self._bracket = False  # a "[" was seen before the array, waiting for the next non-space character
+        self._in_string = False
+        self._escape = False
+        self._element = []
+
+    def feed(self, text):
+        objects = []
+        for char in text:
+            if self._done:
+                break
+            if self._depth == 0:
+                if self._bracket and not char.isspace():
+                    self._bracket = False
+                    if char == "{":
+                        self._depth = 2
+                        self._element = [char]
+                        continue
+                    if char == "]":
+                        self._done = True
+                        continue
+                if char == "[":
+                    self._bracket = True
+                continue
+            if self._depth == 1:
+                if char == "{":
+                    self._depth = 2
+                    self._element = [char]
+                elif char == "]":
+                    self._done = True
+                continue
+
+            self._element.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    try:
+                        value = json.loads("".join(self._element))
+                    except ValueError:
+                        value = None
+                    if isinstance(value, dict):
+                        objects.append(value)
+                    self._element = []
+        return objects
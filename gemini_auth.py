@@ -0,0 +1,168 @@
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from config import ConfigError
+
+DEFAULT_REFRESH_MARGIN = 300  # seconds before expiry
+EXPIRY_SKEW = 30  # seconds; a token this close to expiry is not sent anymore
+REFRESH_RETRY_DELAY = 30  # seconds between failed background refreshes
+
+def _seconds_until(expiry):
+    """Returns the seconds until the (naive UTC) expiry of google-auth credentials, or None if it never expires."""
+    if expiry is None:
+        return None
+    return (expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+
+def save_credentials(creds, token_file):
+    """Writes the authorized user credentials to the token file, readable by the owner only."""
+    directory = os.path.dirname(os.path.abspath(token_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(creds.to_json())
+        os.replace(tmp_path, token_file)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class GeminiTokenManager:
+    """Keeps the Gemini OAuth access token valid for every review worker.
+
+    A background thread refreshes the token refresh_margin seconds before it expires and
+    persists it to the token file, so workers reading .token never wait for a refresh.
+    The margin is capped at half the lifetime of the last refreshed token, so a margin
+    longer than the token lifetime does not refresh it over and over.
+    Refreshes are serialized: when the token expired anyway (e.g. the machine slept),
+    the first worker refreshes it and the others wait for that same refresh.
+    """
+
+    def __init__(self, creds, request, token_file, refresh_margin=DEFAULT_REFRESH_MARGIN):
+        self._creds = creds
+        self._request = request
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._lifetime = None  # seconds the last refreshed token was valid for
+        self._refresh_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    @property
+    def token(self):
+        """Returns a valid access token, refreshing it first only if it is about to expire."""
+        if self._expires_within(EXPIRY_SKEW):
+            self.refresh()
+        return self._creds.token
+
+    def _margin(self):
+        if self._lifetime is None:
+            return self.refresh_margin
+        return min(self.refresh_margin, self._lifetime / 2)
+
+    def _expires_within(self, seconds):
+        remaining = _seconds_until(self._creds.expiry)
+        return self._creds.token is None or (remaining is not None and remaining <= seconds)
+
+    def refresh(self, stale_token=None):
+        """Refreshes and persists the token.
+
+        Without stale_token, nothing happens if the token is still valid for the refresh margin.
+        With stale_token (a token the API rejected), the token is refreshed unless another caller already replaced it.
+        """
+        with self._refresh_lock:
+            if stale_token is not None:
+                if self._creds.token != stale_token:
+                    return
+            elif not self._expires_within(self._margin()):
+                return
+            self._creds.refresh(self._request)
+            self._lifetime = _seconds_until(self._creds.expiry)
+            try:
+                save_credentials(self._creds, self.token_file)
+            except OSError as e:
+                print(f"Warning: could not save the Gemini token to '{self.token_file}': {e}")
+        with self._cond:
+            self._cond.notify_all()
+
+    def start(self):
+        """Starts the background refresh thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="gemini-token-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                remaining = _seconds_until(self._creds.expiry)
+                wait = None if remaining is None else remaining - self._margin()
+                if wait is None or wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Warning: could not refresh the Gemini token: {e}. Retrying in {REFRESH_RETRY_DELAY} seconds.")
+                with self._cond:
+                    self._cond.wait(timeout=REFRESH_RETRY_DELAY)
+                continue
+            if self._expires_within(self._margin()):
+                # The refresh did not extend the token (e.g. it is already expired when it arrives).
+                print(f"Warning: the refreshed Gemini token expires immediately. Refreshing it again in {REFRESH_RETRY_DELAY} seconds.")
+                with self._cond:
+                    self._cond.wait(timeout=REFRESH_RETRY_DELAY)
+
+    def close(self):
+        """Stops the background refresh thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+def load_gemini_credentials(client_secret_file, scopes, token_file, session=None, interactive=True, refresh_margin=DEFAULT_REFRESH_MARGIN):
+    """Returns a started GeminiTokenManager.
+
+    The credentials are read from the token file and refreshed if needed. The browser
+    authorization flow only runs when there is no usable token file. Raises a ConfigError
+    when it would be needed but interactive is False.
+    """
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    request = Request(session=session)
+    creds = None
+    if os.path.exists(token_file):
+        try:
+            creds = Credentials.from_authorized_user_file(token_file, scopes)
+        except ValueError as e:
+            print(f"Warning: ignoring invalid Gemini token file '{token_file}': {e}")
+
+    if creds is not None and not creds.valid and creds.refresh_token:
+        try:
+            creds.refresh(request)
+            save_credentials(creds, token_file)
+        except RefreshError as e:
+            print(f"The stored Gemini authorization could not be refreshed ({e}); authorizing again.")
+            creds = None
+
+    if creds is None or not creds.valid:
+        if not interactive:
+            raise ConfigError(f"No valid Gemini token in '{token_file}', and the browser authorization cannot run non-interactively.")
+        if not os.path.exists(client_secret_file):
+            raise FileNotFoundError(
+                f"Please download your OAuth 2.0 client secret file and save it as '{client_secret_file}'."
+            )
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file(client_secret_file, scopes)
+        creds = flow.run_local_server(port=0)
+        save_credentials(creds, token_file)
+        print(f"Gemini authorization saved to '{token_file}'.")
+
+    return GeminiTokenManager(creds, request, token_file, refresh_margin).start()
@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+from collections import deque
+
+class Cancelled(Exception):
+    """Raised inside an attempt whose result is no longer needed."""
+
+class CancelToken:
+    """A threading.Event that also runs callbacks when it is set, e.g. to abort a blocking request."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Runs callback when the token is set (right away if it already is). Returns a function unregistering it."""
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._unregister(callback_id)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback_id):
+        with self._lock:
+            self._callbacks.pop(callback_id, None)
+
+class LatencyTracker:
+    """Keeps the latencies of the last window successful calls to compute percentiles."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, percent):
+        """Returns the given percentile (0-100) of the recorded latencies, or None without samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, round(percent / 100 * len(samples)) - 1))
+        return samples[index]
+
+class CircuitBreaker:
+    """Stops sending requests to a provider that keeps failing.
+
+    The circuit opens after failure_threshold consecutive failures. After reset_timeout
+    seconds it is half-open: requests are allowed again, a success closes the circuit
+    and a failure opens it again right away.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=120):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """Returns True if requests may be sent to the provider."""
+        return self.state != "open"
+
+    def on_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"{self.name} is answering again; closing its circuit breaker.")
+            self._failures = 0
+            self._opened_at = None
+
+    def on_failure(self):
+        """Records a failure. Returns True if it opened the circuit."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            self._failures += 1
+            if state == "half_open" or (state == "closed" and self._failures >= self.failure_threshold):
+                self._opened_at = now
+                print(f"{self.name} failed {self._failures} times in a row; not using it for {self.reset_timeout} seconds.")
+                return True
+            return False
+
+def hedged_call(attempts, delay, is_valid):
+    """Runs the attempts as a hedged request and returns (index, result) of the winner.
+
+    attempts are functions taking a CancelToken that is set once their result is no
+    longer needed. The first attempt starts right away; the next one starts when the
+    running ones have not produced a valid result within delay seconds, or as soon as
+    one of them fails or returns an invalid result. The first valid result wins and the
+    other attempts are cancelled. If no result is valid, the first result is returned;
+    if every attempt failed, the first error is raised. Attempts run in daemon threads,
+    so a cancelled attempt that is slow to stop never delays the exit of the program.
+    """
+    results = queue.Queue()
+    cancels = []
+    fallback = None
+    errors = []
+
+    def run(index, cancel):
+        try:
+            results.put((index, True, attempts[index](cancel)))
+        except Exception as e:
+            results.put((index, False, e))
+
+    def start_next():
+        cancel = CancelToken()
+        cancels.append(cancel)
+        threading.Thread(target=run, args=(len(cancels) - 1, cancel), name=f"hedge-{len(cancels) - 1}", daemon=True).start()
+        return time.monotonic() + delay
+
+    try:
+        hedge_at = start_next()
+        running = 1
+        while running:
+            timeout = max(0.0, hedge_at - time.monotonic()) if len(cancels) < len(attempts) else None
+            try:
+                index, succeeded, result = results.get(timeout=timeout)
+            except queue.Empty:
+                hedge_at = start_next()
+                running += 1
+                continue
+            running -= 1
+            if not succeeded:
+                errors.append(result)
+            elif is_valid(result):
+                return index, result
+            elif fallback is None:
+                fallback = (index, result)
+            if len(cancels) < len(attempts):
+                hedge_at = start_next()
+                running += 1
+        if fallback is not None:
+            return fallback
+        raise errors[0]
+    finally:
+        for cancel in cancels:
+            cancel.set()
@@ -0,0 +1,189 @@
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ProtocolError
+
+import metrics
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10  # seconds
+DEFAULT_READ_TIMEOUT = 300  # seconds, AI agents can take minutes to answer
+
+# The cancel token of the request being sent by the current thread, see PooledSession.request.
+_cancel = threading.local()
+
+def _abort_connection(connection):
+    """Shuts down the socket of a connection, so that a read blocked on it in another thread returns."""
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class _CancellableMixin:
+    """Aborts the connection of a request when its cancel token is set, until the connection goes back to the pool."""
+
+    def _make_request(self, conn, *args, **kwargs):
+        cancel = getattr(_cancel, "token", None)
+        if cancel is not None:
+            conn.release_cancel = cancel.on_cancel(lambda: _abort_connection(conn))
+            if cancel.is_set():
+                raise ProtocolError("Request cancelled")
+        return super()._make_request(conn, *args, **kwargs)
+
+    def _put_conn(self, conn):
+        release = getattr(conn, "release_cancel", None)
+        if release is not None:
+            conn.release_cancel = None
+            release()
+        super()._put_conn(conn)
+
+class CancellableHTTPConnectionPool(_CancellableMixin, HTTPConnectionPool):
+    pass
+
+class CancellableHTTPSConnectionPool(_CancellableMixin, HTTPSConnectionPool):
+    pass
+
+class PooledSession(requests.Session):
+    """A requests session with a keep-alive connection pool and a default timeout for every request."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        adapter.poolmanager.pool_classes_by_scheme = {"http": CancellableHTTPConnectionPool, "https": CancellableHTTPSConnectionPool}
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.timeout = timeout
+        # Optional rate_limiter.ProviderScheduler every request of this session goes through.
+        self.scheduler = None
+
+    def request(self, method, url, **kwargs):
+        """Sends a request; see requests.Session.request for the arguments.
+
+        rate_limit_tokens is the estimated number of tokens of the request, counted against
+        the scheduler's tokens/minute budget. cancel is an optional token with is_set() and
+        on_cancel(callback) (see hedging.CancelToken): once it is set, the connection of the
+        request is shut down, even while waiting for the response or reading a streamed body,
+        and a requests.exceptions.ConnectionError is raised.
+        """
+        tokens = kwargs.pop("rate_limit_tokens", 0)
+        cancel = kwargs.pop("cancel", None)
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        if cancel is None:
+            return self._schedule(tokens, method, url, **kwargs)
+        _cancel.token = cancel
+        try:
+            return self._schedule(tokens, method, url, **kwargs)
+        finally:
+            _cancel.token = None
+
+    def _schedule(self, tokens, method, url, **kwargs):
+        if self.scheduler is None:
+            return self._send(method, url, **kwargs)
+        waiting_since = time.monotonic()
+        with self.scheduler.slot(tokens):
+            metrics.inc("http_scheduler_wait_seconds", time.monotonic() - waiting_since, provider=self.scheduler.name)
+            response = self._send(method, url, **kwargs)
+        self.scheduler.on_response(response)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        parts = urlsplit(url)
+        labels = {"host": parts.netloc, "method": method.upper(), "endpoint": endpoint_name(parts.path)}
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.inc("http_requests", status="error", **labels)
+            raise
+        metrics.inc("http_requests", status=response.status_code, **labels)
+        return response
+
+_NUMBER_RE = re.compile(r"^\d+$")
+
+def endpoint_name(path):
+    """Returns the path with ids replaced by placeholders, e.g. /2.0/repositories/{workspace}/{repo_slug}/pullrequests/{id}."""
+    segments = path.split("/")
+    for i, segment in enumerate(segments):
+        if _NUMBER_RE.match(segment) or (segment.startswith("{") and segment.endswith("}")):
+            # Numeric ids, and Bitbucket user/commit UUIDs like {1234-...}
+            segments[i] = "{id}"
+        elif i >= 2 and segments[i - 2] == "repositories":
+            segments[i - 1] = "{workspace}"
+            segments[i] = "{repo_slug}"
+        elif i >= 1 and segments[i - 1] in ("diff", "merge-base") and i >= 4 and segments[i - 4] == "repositories":
+            segments[i] = "{spec}"
+    return "/".join(segments)
+
+_settings = {
+    "pool_size": DEFAULT_POOL_SIZE,
+    "timeout": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def configure(pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+    """Sets the pool size and timeouts used by the sessions created from now on."""
+    with _sessions_lock:
+        _settings["pool_size"] = pool_size
+        _settings["timeout"] = (connect_timeout, read_timeout)
+
+def get_timeout():
+    """Returns the configured (connect, read) timeout."""
+    return _settings["timeout"]
+
+def get_session(url):
+    """Returns the shared session of the URL's host, creating it on first use."""
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = PooledSession(_settings["pool_size"], _settings["timeout"])
+            _sessions[host] = session
+        return session
+
+def set_scheduler(url, scheduler):
+    """Routes every request to the URL's host through the given scheduler."""
+    get_session(url).scheduler = scheduler
+
+def get_scheduler(url):
+    """Returns the scheduler of the URL's host, or None."""
+    return get_session(url).scheduler
+
+def get(url, **kwargs):
+    """Sends a GET request through the shared session of the URL's host."""
+    return get_session(url).get(url, **kwargs)
+
+def post(url, **kwargs):
+    """Sends a POST request through the shared session of the URL's host."""
+    return get_session(url).post(url, **kwargs)
+
+def iter_sse_data(response):
+    """Yields the data of each server-sent event of a streamed response."""
+    # Event streams are always UTF-8.
+    response.encoding = "utf-8"
+    data = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            if line.startswith("data:"):
+                data.append(line[5:].removeprefix(" "))
+        elif data:
+            yield "\n".join(data)
+            data = []
+    if data:
+        yield "\n".join(data)
+
+def close_all():
+    """Closes all shared sessions and their pooled connections."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,192 @@
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = ".review_jobs.sqlite3"
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 5.0  # seconds
+# A PR at a source commit with one of these statuses is not reviewed again. Skipped PRs are
+# checked again: the reason may be transient, and REVIEW_STATE_FILE already skips unchanged PRs.
+FINISHED_STATUSES = ("approve", "comment")
+JOB_FIELDS = ("title", "reason", "feedback", "comment_count", "diff_seconds", "llm_seconds", "total_seconds")
+_CLOSE = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    workspace TEXT NOT NULL,
+    repo_slug TEXT NOT NULL,
+    pr_id INTEGER NOT NULL,
+    source_commit TEXT NOT NULL,
+    title TEXT,
+    status TEXT NOT NULL,
+    reason TEXT,
+    feedback TEXT,
+    comment_count INTEGER,
+    diff_seconds REAL,
+    llm_seconds REAL,
+    total_seconds REAL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (workspace, repo_slug, pr_id, source_commit)
+);
+CREATE INDEX IF NOT EXISTS reviews_status ON reviews (status);
+"""
+
+UPSERT = f"""
+INSERT INTO reviews (workspace, repo_slug, pr_id, source_commit, status, {", ".join(JOB_FIELDS)}, updated_at)
+VALUES ({", ".join("?" * (len(JOB_FIELDS) + 6))})
+ON CONFLICT (workspace, repo_slug, pr_id, source_commit) DO UPDATE SET
+    status = excluded.status,
+    {", ".join(f"{field} = excluded.{field}" for field in JOB_FIELDS)},
+    attempts = reviews.attempts + 1,
+    updated_at = excluded.updated_at
+"""
+
+STATS_QUERY = """
+SELECT workspace, repo_slug, status, COUNT(*), SUM(comment_count), AVG(llm_seconds), MAX(llm_seconds), AVG(total_seconds)
+FROM reviews
+WHERE (? IS NULL OR repo_slug = ?)
+GROUP BY workspace, repo_slug, status
+ORDER BY workspace, repo_slug, status
+"""
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+class JobStore:
+    """Records the outcome of every PR review of a sweep in a SQLite database.
+
+    Rows are keyed by (workspace, repo slug, PR id, source commit). Writes are queued and
+    committed by a background thread in batches of batch_size rows, or every flush_interval
+    seconds, so recording an outcome never waits for the disk. The finished keys are
+    loaded when the store is opened, so is_finished() does not query the database.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        connection = _connect(path)
+        try:
+            connection.executescript(SCHEMA)
+            rows = connection.execute(
+                f"SELECT workspace, repo_slug, pr_id, source_commit FROM reviews WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))})",
+                FINISHED_STATUSES,
+            ).fetchall()
+        finally:
+            connection.close()
+        self._finished = set(rows)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="job-store-writer", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        """Returns the number of finished reviews."""
+        with self._lock:
+            return len(self._finished)
+
+    def is_finished(self, workspace, repo_slug, pr_id, source_commit):
+        """Returns True if the PR was already reviewed at this source commit."""
+        with self._lock:
+            return (workspace, repo_slug, int(pr_id), source_commit or "") in self._finished
+
+    def record(self, workspace, repo_slug, pr_id, source_commit, status, **fields):
+        """Queues the outcome of a review. fields are the optional JOB_FIELDS columns."""
+        key = (workspace, repo_slug, int(pr_id), source_commit or "")
+        with self._lock:
+            if status in FINISHED_STATUSES:
+                self._finished.add(key)
+            else:
+                self._finished.discard(key)
+        self._queue.put(key + (status,) + tuple(fields.get(field) for field in JOB_FIELDS) + (time.time(),))
+
+    def _run(self):
+        connection = _connect(self.path)
+        try:
+            closing = False
+            while not closing:
+                # Wait for the first row without a timeout, so an idle store (or a zero flush_interval) does not spin.
+                row = self._queue.get()
+                if row is _CLOSE:
+                    break
+                batch = [row]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if row is _CLOSE:
+                        closing = True
+                        break
+                    batch.append(row)
+                if batch:
+                    try:
+                        with connection:
+                            connection.executemany(UPSERT, batch)
+                    except sqlite3.Error as e:
+                        print(f"Warning: could not save {len(batch)} review records to '{self.path}': {e}")
+        finally:
+            connection.close()
+
+    def close(self):
+        """Writes the queued records and stops the writer thread."""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+def query_stats(path=DEFAULT_PATH, repo_slug=None):
+    """Returns the review counts, comments and timings per workspace, repository and status."""
+    if not os.path.exists(path):
+        return []
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(STATS_QUERY, (repo_slug, repo_slug)).fetchall()
+    finally:
+        connection.close()
+    return [
+        {
+            "workspace": workspace,
+            "repo_slug": slug,
+            "status": status,
+            "prs": count,
+            "comments": comments or 0,
+            "llm_seconds_avg": llm_avg,
+            "llm_seconds_max": llm_max,
+            "total_seconds_avg": total_avg,
+        }
+        for workspace, slug, status, count, comments, llm_avg, llm_max, total_avg in rows
+    ]
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+def main():
+    parser = argparse.ArgumentParser(description="Shows the review statistics recorded by mode 3 sweeps.")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH, help=f"job store file (default: {DEFAULT_PATH})")
+    parser.add_argument("--repo", help="only show this repository")
+    args = parser.parse_args()
+
+    rows = query_stats(args.path, args.repo)
+    if not rows:
+        print("No reviews recorded.")
+        return
+    for row in rows:
+        print(
+            f"{row['workspace']}/{row['repo_slug']} {row['status']}: {row['prs']} PRs, {row['comments']} comments, "
+            f"LLM avg {_format_seconds(row['llm_seconds_avg'])} (max {_format_seconds(row['llm_seconds_max'])}), "
+            f"total avg {_format_seconds(row['total_seconds_avg'])}"
+        )
+    totals = {}
+    for row in rows:
+        totals[row["status"]] = totals.get(row["status"], 0) + row["prs"]
+    print("Total: " + ", ".join(f"{count} {status}" for status, count in sorted(totals.items())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PREFIX = "pr_reviewer"
+
+class Metrics:
+    """Thread-safe timing spans and labelled counters collected during a run.
+
+    A span accumulates the count, total, min and max duration of a named phase; spans
+    may nest (e.g. parse_diff runs inside diff_fetch). Counters are keyed by name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+        self.started_at = time.time()
+
+    def observe(self, name, seconds):
+        """Adds one duration to the named span."""
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                self._spans[name] = {"count": 1, "total": seconds, "min": seconds, "max": seconds}
+            else:
+                span["count"] += 1
+                span["total"] += seconds
+                span["min"] = min(span["min"], seconds)
+                span["max"] = max(span["max"], seconds)
+
+    @contextmanager
+    def span(self, name):
+        """Times the enclosed block, including when it raises."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def inc(self, name, amount=1, **labels):
+        """Increments the counter with the given name and labels."""
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Returns the spans and counters as a JSON serializable dict."""
+        with self._lock:
+            spans = {
+                name: {
+                    "count": span["count"],
+                    "total_seconds": round(span["total"], 6),
+                    "mean_seconds": round(span["total"] / span["count"], 6),
+                    "min_seconds": round(span["min"], 6),
+                    "max_seconds": round(span["max"], 6),
+                }
+                for name, span in sorted(self._spans.items())
+            }
+            counters = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return {
+            "started_at": self.started_at,
+            "elapsed_seconds": round(time.time() - self.started_at, 6),
+            "spans": spans,
+            "counters": counters,
+        }
+
+    def render_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            spans = sorted(self._spans.items())
+            counters = sorted(self._counters.items())
+        if spans:
+            name = f"{METRICS_PREFIX}_span_seconds"
+            lines.append(f"# TYPE {name} summary")
+            for span_name, span in spans:
+                labels = _format_labels((("span", span_name),))
+                lines.append(f"{name}_sum{labels} {span['total']:.6f}")
+                lines.append(f"{name}_count{labels} {span['count']}")
+            lines.append(f"# TYPE {name}_max gauge")
+            for span_name, span in spans:
+                lines.append(f"{name}_max{_format_labels((('span', span_name),))} {span['max']:.6f}")
+        typed = set()
+        for (counter_name, labels), value in counters:
+            name = f"{METRICS_PREFIX}_{counter_name}_total"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value if isinstance(value, int) else f'{value:.6f}'}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{label}="' + value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+        for label, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+_metrics = Metrics()
+
+def get_metrics():
+    """Returns the metrics of the current run."""
+    return _metrics
+
+def observe(name, seconds):
+    _metrics.observe(name, seconds)
+
+def span(name):
+    """Times the enclosed block under the given span name."""
+    return _metrics.span(name)
+
+def timed(name):
+    """Decorator timing every call of the function under the given span name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _metrics.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_iter(name, iterable):
+    """Yields the items of the iterable, timing only the production of each item."""
+    iterator = iter(iterable)
+    while True:
+        started = time.monotonic()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _metrics.observe(name, time.monotonic() - started)
+        yield item
+
+def inc(name, amount=1, **labels):
+    _metrics.inc(name, amount, **labels)
+
+def write_report(path):
+    """Writes the JSON run report to the given path."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_metrics.snapshot(), f, indent=2)
+
+def start_server(host, port):
+    """Serves the metrics in the Prometheus text format on GET /metrics from a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
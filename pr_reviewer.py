@@ -1,14 +1,33 @@
+from config import ConfigError, load_config
 import utils
-utils.install_needed_libraries()
+try:
+    # Invalid settings stop the run here, before anything is installed or reviewed.
+    utils.install_needed_libraries(allow_install=load_config().interactive)
+except ConfigError as e:
+    print(f"Configuration error: {e}")
+    raise SystemExit(2)
 
-import os
+import queue
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
 import json
+import re
 import requests
-from atlassian.bitbucket import Cloud
-from atlassian.errors import ApiError
-from google_auth_oauthlib.flow import InstalledAppFlow
+from urllib.parse import quote
+import http_client
+import metrics
+from hedging import Cancelled, CircuitBreaker, LatencyTracker, hedged_call
+from feedback_parser import JsonArrayStream, strip_code_fence
+from diff_filter import DEFAULT_EXCLUDE_PATTERNS, filter_diff
+from diff_parser import DiffLimitError, DiffReader, chunk_diff, estimate_tokens, format_diff, normalize_line, parse_diff
+from review_cache import ReviewCache
+from rate_limiter import ProviderScheduler, get_retry_delay
+from review_state import ReviewState, same_commit
+from job_store import JobStore
+from webhook_server import CoalescingWorkQueue, make_server
 
 # --- PLEASE CONFIGURE THESE VALUES --- #
 # 1. Go to https://console.cloud.google.com/apis/credentials
@@ -16,70 +35,66 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 # 3. Download the JSON file and save it as 'client_secret.json' in the same directory as this script.
 CLIENT_SECRET_FILE = "client_secret.json"
 SCOPES = ["https://www.googleapis.com/auth/generative-language.retriever"]
+# The OAuth authorization is stored here and its access token refreshed this many seconds before it expires
+GEMINI_TOKEN_DEFAULT_FILE = ".gemini_token.json"
+GEMINI_TOKEN_DEFAULT_REFRESH_MARGIN = 300
+GEMINI_OAUTH_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GEMINI_API_ENDPOINT = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
 GEMINI_DEFAULT_MODEL = "gemini-2.5-pro"
 BITBUCKET_API_BASE_URL = "https://api.bitbucket.org/2.0"
 # Codex (OpenAI) configuration
 OPENAI_API_ENDPOINT = "https://api.openai.com/v1/chat/completions"
 OPENAI_DEFAULT_MODEL = "gpt-4o-mini"
-# --- END OF CONFIGURATION --- #
-
-def get_config(config_name, prompt, is_list=False):
-    """Gets a configuration value from environment variables, a .configs file, or user input."""
-    # Try to get from environment variable
-    value = os.environ.get(config_name)
-    if value:
-        value = value.strip()
-        if value:
-            if is_list:
-                return [item.strip() for item in value.split(',')]
-            return value
-
-    # Try to get from .configs file
-    try:
-        with open(".configs", "r") as f:
-            for line in f:
-                if line.startswith(config_name + "="):
-                    value = line.removeprefix(config_name + "=").strip()
-                    if value:
-                        if is_list:
-                            return [item.strip() for item in value.split(',')]
-                        return value
-    except FileNotFoundError:
-        pass
-
-    # Fallback to user input
-    value = input(prompt)
-    if is_list:
-        return [item.strip() for item in value.split(',')]
-    return value
-
-def get_credentials():
-    """Gets Bitbucket credentials from the user."""
-    email = get_config("BITBUCKET_EMAIL", "Enter your Atlassian account email: ")
-    api_token = get_config("BITBUCKET_API_TOKEN", "Enter your Bitbucket API token: ")
-    return email, api_token
-
-def get_gemini_credentials():
-    """Gets Gemini API credentials using OAuth 2.0."""
-    if not os.path.exists(CLIENT_SECRET_FILE):
-        raise FileNotFoundError(
-            f"Please download your OAuth 2.0 client secret file and save it as '{CLIENT_SECRET_FILE}'."
-        )
-
-    flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET_FILE, SCOPES)
-    creds = flow.run_local_server(port=0)
-    return creds
+OPENAI_TEMPERATURE = 0.2
+# AI agent requests are retried on 429/503 with exponential backoff
+AI_REQUEST_RETRIES = 10
+AI_REQUEST_RETRY_DELAY = 15  # seconds
+AI_REQUEST_BACKOFF_FACTOR = 2
 
-import random
+AI_AGENT_NAMES = {"gemini": "Gemini", "codex": "OpenAI"}
+AI_HEDGE_DEFAULT_PERCENTILE = 95
+AI_HEDGE_DEFAULT_INITIAL_DELAY = 60  # seconds, until AI_HEDGE_MIN_SAMPLES latencies are known
+AI_HEDGE_DEFAULT_MIN_DELAY = 10  # seconds
+AI_HEDGE_MIN_SAMPLES = 10
+AI_CIRCUIT_DEFAULT_FAILURES = 5
+AI_CIRCUIT_DEFAULT_RESET_SECONDS = 120
+# Max concurrent requests per provider (shrinks on 429/503 and grows back on success)
+GEMINI_DEFAULT_MAX_CONCURRENCY = 4
+OPENAI_DEFAULT_MAX_CONCURRENCY = 8
+BITBUCKET_DEFAULT_MAX_CONCURRENCY = 16
+# Diff fetching
+DIFF_STREAM_CHUNK_SIZE = 64 * 1024
+# Diff filter: unchanged lines kept around each change
+DIFF_DEFAULT_CONTEXT_LINES = 3
+# Diffs estimated above this many tokens are split into chunks reviewed in parallel
+LLM_CHUNK_DEFAULT_MAX_TOKENS = 50000
+LLM_CHUNK_DEFAULT_CONCURRENCY = 4
+# Review cache
+REVIEW_CACHE_DEFAULT_DIR = ".review_cache"
+REVIEW_CACHE_DEFAULT_MAX_MB = 256
+REVIEW_CACHE_DEFAULT_MAX_AGE_DAYS = 30
+# Incremental re-reviews
+REVIEW_STATE_DEFAULT_FILE = ".review_state.json"
+# Resumable mode 3 sweeps: the SQLite job store and its write batching
+JOB_STORE_DEFAULT_FILE = ".review_jobs.sqlite3"
+JOB_STORE_DEFAULT_BATCH_SIZE = 50
+JOB_STORE_DEFAULT_FLUSH_SECONDS = 5
+# Prometheus metrics endpoint (enabled by METRICS_PORT)
+METRICS_DEFAULT_HOST = "127.0.0.1"
+# Comment posting: concurrent posts per PR, retries on 429/5xx/network errors, and an optional cap
+# on comments per PR (0 = unlimited) above which the remaining findings go into one summary comment
+COMMENT_POST_DEFAULT_CONCURRENCY = 4
+COMMENT_POST_DEFAULT_RETRIES = 3
+COMMENT_POST_RETRY_DELAY = 2  # seconds, doubled on every retry
+COMMENT_DEFAULT_MAX_PER_PR = 0
+# Posted instead of an approval when the diff limits left part of the PR out of the review
+PARTIAL_REVIEW_COMMENT = (
+    "This pull request is too large to be reviewed in full, so only part of its diff was reviewed "
+    "(see DIFF_MAX_BYTES, DIFF_MAX_FILES and DIFF_MAX_LINES_PER_FILE). It was not approved automatically."
+)
+# --- END OF CONFIGURATION --- #
 
-def get_gemini_feedback(diff, creds):
-    """Gets structured feedback from the Gemini API for the given diff."""
-    headers = {
-        "Authorization": f"Bearer {creds.token}",
-        "Content-Type": "application/json",
-    }
-    prompt = f"""Please review the following code diff and provide your feedback (only critical). ignore submodule changes and don't comment on them. If the changes are good and can be approved, please respond with only the word 'approve'. 
+REVIEW_PROMPT_TEMPLATE = """Please review the following code diff and provide your feedback (only critical). ignore submodule changes and don't comment on them. If the changes are good and can be approved, please respond with only the word 'approve'. 
     Otherwise, provide your comments for changes in a JSON array format, where each object in the array has 'file_path', 'line_content', and 'comment' keys. 
     The line_content should be the exact line from the diff that the comment is about and it should be one line without new line characters.
     Example:
@@ -96,6 +111,234 @@ def get_gemini_feedback(diff, creds):
     Here is the diff:
     {diff}
     """
+
+def get_config(config_name, prompt, is_list=False, default=None):
+    """Gets a configuration value from environment variables, a .configs file, or user input.
+
+    When a default is given, it is returned instead of prompting the user.
+    """
+    return load_config().get(config_name, prompt, is_list=is_list, default=default)
+
+def get_int_config(config_name, default):
+    """Gets an integer configuration value (parsed when the configuration was loaded), or the default when unset."""
+    return load_config().get_int(config_name, default)
+
+def get_bool_config(config_name, default=False, prompt=None):
+    """Gets a yes/no configuration value, prompting for it only when a prompt is given."""
+    return load_config().get_bool(config_name, default, prompt)
+
+def get_credentials():
+    """Gets Bitbucket credentials from the user."""
+    email = get_config("BITBUCKET_EMAIL", "Enter your Atlassian account email: ")
+    api_token = get_config("BITBUCKET_API_TOKEN", "Enter your Bitbucket API token: ")
+    return email, api_token
+
+def get_gemini_credentials():
+    """Gets Gemini API credentials using OAuth 2.0.
+
+    The authorization is stored in GEMINI_TOKEN_FILE and the access token is refreshed in
+    the background before it expires, so the browser flow only runs the first time.
+    """
+    utils.install_needed_libraries(utils.GEMINI_LIBRARIES, allow_install=load_config().interactive)
+    from gemini_auth import load_gemini_credentials
+
+    return load_gemini_credentials(
+        CLIENT_SECRET_FILE,
+        SCOPES,
+        get_config("GEMINI_TOKEN_FILE", "", default=GEMINI_TOKEN_DEFAULT_FILE),
+        session=http_client.get_session(GEMINI_OAUTH_TOKEN_URL),
+        interactive=load_config().interactive,
+        refresh_margin=max(0, get_int_config("GEMINI_TOKEN_REFRESH_MARGIN_SECONDS", GEMINI_TOKEN_DEFAULT_REFRESH_MARGIN)),
+    )
+
+import random
+
+def build_review_prompt(diff):
+    """Builds the review prompt for the given diff."""
+    return REVIEW_PROMPT_TEMPLATE.format(diff=diff)
+
+_review_cache = None
+_review_cache_loaded = False
+_review_cache_lock = threading.Lock()
+
+def get_review_cache():
+    """Returns the shared on-disk review cache, or None when REVIEW_CACHE_BYPASS=yes."""
+    global _review_cache, _review_cache_loaded
+    with _review_cache_lock:
+        if not _review_cache_loaded:
+            _review_cache_loaded = True
+            if not get_bool_config("REVIEW_CACHE_BYPASS"):
+                _review_cache = ReviewCache(
+                    get_config("REVIEW_CACHE_DIR", "", default=REVIEW_CACHE_DEFAULT_DIR),
+                    max_bytes=max(0, get_int_config("REVIEW_CACHE_MAX_MB", REVIEW_CACHE_DEFAULT_MAX_MB)) * 1024 * 1024,
+                    max_age_seconds=max(0, get_int_config("REVIEW_CACHE_MAX_AGE_DAYS", REVIEW_CACHE_DEFAULT_MAX_AGE_DAYS)) * 86400,
+                )
+        return _review_cache
+
+def review_cache_key(diff, provider, model, temperature):
+    """Returns the review cache key of a diff reviewed with the given provider settings."""
+    return ReviewCache.make_key(
+        diff=diff,
+        prompt_template=REVIEW_PROMPT_TEMPLATE,
+        provider=provider,
+        model=model,
+        temperature=temperature,
+    )
+
+_ai_breakers = {}
+_ai_latencies = {}
+_ai_health_lock = threading.Lock()
+
+def get_ai_breaker(agent_name):
+    """Returns the circuit breaker of an AI agent API ("Gemini" or "OpenAI")."""
+    with _ai_health_lock:
+        breaker = _ai_breakers.get(agent_name)
+        if breaker is None:
+            breaker = _ai_breakers[agent_name] = CircuitBreaker(
+                agent_name,
+                failure_threshold=get_int_config("AI_CIRCUIT_FAILURES", AI_CIRCUIT_DEFAULT_FAILURES),
+                reset_timeout=max(0, get_int_config("AI_CIRCUIT_RESET_SECONDS", AI_CIRCUIT_DEFAULT_RESET_SECONDS)),
+            )
+        return breaker
+
+def other_ai_agent_available(agent_name):
+    """Returns True if the circuit breaker of another AI agent API allows requests."""
+    with _ai_health_lock:
+        breakers = [breaker for name, breaker in _ai_breakers.items() if name != agent_name]
+    return any(breaker.allow() for breaker in breakers)
+
+def get_ai_latency(agent_name):
+    """Returns the tracker of the recent answer times of an AI agent API."""
+    with _ai_health_lock:
+        tracker = _ai_latencies.get(agent_name)
+        if tracker is None:
+            tracker = _ai_latencies[agent_name] = LatencyTracker()
+        return tracker
+
+def post_ai_request(agent_name, url, headers, body, tokens, stream=False, cancel=None):
+    """Posts a request to an AI agent API, retrying on 429/503 with the server's retry delay or exponential backoff.
+
+    Requests go through the provider's shared scheduler, so a retry delay learned by one
+    call makes every other caller wait as well. With stream=True, the response body is
+    left unread for the caller to consume. cancel is the hedging.CancelToken of a hedged
+    request: once it is set, the request is aborted and Cancelled is raised. Hedged
+    requests also update the provider's circuit breaker, and stop retrying when it opens
+    while another provider is available.
+    """
+    scheduler = http_client.get_scheduler(url)
+    breaker = get_ai_breaker(agent_name) if cancel is not None else None
+    for i in range(AI_REQUEST_RETRIES):
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+        try:
+            response = http_client.post(url, headers=headers, json=body, rate_limit_tokens=tokens, stream=stream, cancel=cancel)
+            response.raise_for_status()
+            if breaker is not None:
+                breaker.on_success()
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            if breaker is not None:
+                breaker.on_failure()
+            raise
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            if breaker is not None and status_code is not None and (status_code == 429 or status_code >= 500):
+                breaker.on_failure()
+                if not breaker.allow() and other_ai_agent_available(agent_name):
+                    print(f"{agent_name} API keeps failing; leaving the review to the other AI agent.")
+                    raise
+            if status_code in (429, 503) and i < AI_REQUEST_RETRIES - 1:
+                retry_delay = get_retry_delay(e.response)
+                if retry_delay is None:
+                    retry_delay = AI_REQUEST_RETRY_DELAY * (AI_REQUEST_BACKOFF_FACTOR ** i)
+                wait = retry_delay + random.uniform(0, 1)
+                metrics.inc("ai_retries", agent=agent_name, status=status_code)
+                metrics.inc("ai_retry_wait_seconds", wait, agent=agent_name)
+                if status_code == 429:
+                    print(f"{agent_name} rate limit exceeded. Retrying in {wait:.2f} seconds... ({AI_REQUEST_RETRIES - i - 1} retries left)")
+                else:
+                    print(f"{agent_name} API returned 503. Retrying in {wait:.2f} seconds... ({AI_REQUEST_RETRIES - i - 1} retries left)")
+                print(f"Error details: {e.response.text}")
+                if scheduler is not None:
+                    scheduler.pause(wait)
+                if cancel is not None:
+                    if cancel.wait(wait):
+                        raise Cancelled()
+                elif scheduler is None:
+                    time.sleep(wait)
+            elif i == AI_REQUEST_RETRIES - 1:
+                print(f"{agent_name} API is unavailable after multiple retries.")
+                raise
+            else:
+                print(f"Error calling {agent_name} API: {e}")
+                raise
+
+def record_token_usage(provider, prompt_tokens, completion_tokens):
+    """Counts the prompt/completion tokens reported by an AI agent response."""
+    if prompt_tokens:
+        metrics.inc("ai_tokens", prompt_tokens, provider=provider, kind="prompt")
+    if completion_tokens:
+        metrics.inc("ai_tokens", completion_tokens, provider=provider, kind="completion")
+
+def use_llm_streaming(on_delta):
+    """Returns True if the AI agent answer should be streamed to on_delta as it is generated."""
+    return on_delta is not None and get_bool_config("LLM_STREAMING")
+
+def read_streamed_feedback(response, get_text, get_usage, on_delta, cancel=None):
+    """Reads a server-sent event stream of an AI agent answer.
+
+    get_text and get_usage extract the text piece and the token usage of an event.
+    Every text piece is passed to on_delta. Returns the whole text and the last usage seen.
+    The stream is closed and Cancelled raised as soon as the cancel token is set.
+    """
+    pieces = []
+    usage = None
+    with response:
+        try:
+            for data in http_client.iter_sse_data(response):
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                usage = get_usage(event) or usage
+                text = get_text(event)
+                if text:
+                    pieces.append(text)
+                    on_delta(text)
+        except requests.exceptions.RequestException:
+            # The connection of a cancelled request is shut down while it is read.
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            raise
+    return "".join(pieces), usage or {}
+
+def _gemini_stream_text(event):
+    try:
+        return "".join(part.get("text", "") for part in event["candidates"][0]["content"]["parts"])
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+def get_gemini_feedback(diff, creds, on_delta=None, cancel=None):
+    """Gets structured feedback from the Gemini API for the given diff.
+
+    When on_delta is given, it receives the answer text; piece by piece while it is generated if LLM_STREAMING=yes.
+    cancel is the hedging.CancelToken of a hedged request (see post_ai_request).
+    """
+    cache = get_review_cache()
+    cache_key = review_cache_key(diff, "gemini", GEMINI_DEFAULT_MODEL, None)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        metrics.inc("review_cache_lookups", provider="gemini", result="miss" if cached is None else "hit")
+        if cached is not None:
+            print("Using cached Gemini review.")
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    prompt = build_review_prompt(diff)
     data = {
         "contents": [
             {
@@ -108,139 +351,166 @@ def get_gemini_feedback(diff, creds):
         ]
     }
 
-    retries = 10
-    delay = 15  # seconds
-    backoff_factor = 2
-
-    for i in range(retries):
+    streaming = use_llm_streaming(on_delta)
+    url = GEMINI_API_ENDPOINT.format(model=GEMINI_DEFAULT_MODEL)
+    if streaming:
+        url = url.replace(":generateContent", ":streamGenerateContent") + "?alt=sse"
+    started_at = time.monotonic()
+    for attempt in range(2):
+        token = creds.token
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
         try:
-            response = requests.post(GEMINI_API_ENDPOINT.format(model=GEMINI_DEFAULT_MODEL), headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
+            response = post_ai_request("Gemini", url, headers, data, estimate_tokens(prompt), stream=streaming, cancel=cancel)
+            break
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429 and i < retries - 1:
-                try:
-                    error_json = e.response.json()
-                    error_details = error_json.get("error", {}).get("details", [{}])
-                    for detail in error_details:
-                        if detail.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
-                            retry_delay_str = detail.get("retryDelay", "").replace("s", "")
-                    wait = float(retry_delay_str) + random.uniform(0, 1)
-                    try:
-                        print(f"Error details: {error_json.get("error", {}).get("message", "")}")
-                    except:
-                        pass
-                    print(f"Rate limit exceeded. Retrying in {wait:.2f} seconds...")
-                    time.sleep(wait)
-                except (ValueError, IndexError):
-                    wait = delay * (backoff_factor ** i) + random.uniform(0, 1)
-                    print(f"Error details: {e.response.text}")
-                    print(f"Rate limit exceeded. Retrying in {wait:.2f} seconds...")
-                    time.sleep(wait)
-            elif e.response.status_code == 503 and i < retries - 1:
-                wait = delay * (backoff_factor ** i) + random.uniform(0, 1)
-                print(f"Gemini API returned 503. Retrying in {wait:.2f} seconds... ({retries - i - 1} retries left)")
-                print(f"Error details: {e.response.text}")
-                time.sleep(wait)
-            elif i == retries - 1:
-                print("Gemini API is unavailable after multiple retries.")
-                print_prompt_when_ai_agent_fail = get_config("PRINT_PROMPT_WHEN_AI_AGENT_FAIL", "Would you like to get the complete Gemini/Codex prompt to get the feedback on your own? (yes/no): ")
-                if print_prompt_when_ai_agent_fail.lower() == 'yes':
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code == 401 and attempt == 0 and hasattr(creds, "refresh"):
+                # The token was revoked or expired early; every worker waits for the same refresh.
+                print("Gemini rejected the access token. Refreshing it and retrying...")
+                creds.refresh(stale_token=token)
+                continue
+            if status_code in (429, 503) and cancel is None:
+                if get_bool_config("PRINT_PROMPT_WHEN_AI_AGENT_FAIL", prompt="Would you like to get the complete Gemini/Codex prompt to get the feedback on your own? (yes/no): "):
                     print("\n--- Gemini Prompt ---\n")
                     print(prompt)
                     print("\n--- End of Gemini Prompt ---")
-                raise
-            else:
-                print(f"Error calling Gemini API: {e}")
-                raise
+            raise
+    if streaming:
+        feedback, usage = read_streamed_feedback(response, _gemini_stream_text, lambda event: event.get("usageMetadata"), on_delta, cancel)
+        feedback = feedback.strip()
+    else:
+        response_json = response.json()
+        usage = response_json.get("usageMetadata") or {}
+        feedback = response_json["candidates"][0]["content"]["parts"][0]["text"].strip()
+        if on_delta is not None:
+            on_delta(feedback)
+    get_ai_latency("Gemini").observe(time.monotonic() - started_at)
+    record_token_usage("gemini", usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+    # An unparseable answer (e.g. cut off) is not cached, so it is requested again next time.
+    if cache is not None and is_valid_feedback(feedback):
+        cache.put(cache_key, feedback)
+    return feedback
 
+def get_ai_credentials(ai_agent):
+    """Gets the credentials of the given AI agent."""
+    if ai_agent == "codex":
+        return get_codex_credentials()
+    return get_gemini_credentials()
 
 def get_codex_credentials():
     """Gets OpenAI (Codex) API key from the user/environment."""
     api_key = get_config("OPENAI_API_KEY", "Enter your OpenAI API key: ")
     return api_key
 
-def get_codex_feedback(diff, api_key):
-    """Gets structured feedback from OpenAI (Codex) for the given diff."""
+def _openai_stream_text(event):
+    try:
+        return event["choices"][0]["delta"].get("content") or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+def get_codex_feedback(diff, api_key, on_delta=None, cancel=None):
+    """Gets structured feedback from OpenAI (Codex) for the given diff.
+
+    When on_delta is given, it receives the answer text; piece by piece while it is generated if LLM_STREAMING=yes.
+    cancel is the hedging.CancelToken of a hedged request (see post_ai_request).
+    """
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
-    prompt = f"""Please review the following code diff and provide your feedback (only critical). ignore submodule changes and don't comment on them. If the changes are good and can be approved, please respond with only the word 'approve'. 
-    Otherwise, provide your comments for changes in a JSON array format, where each object in the array has 'file_path', 'line_content', and 'comment' keys. 
-    The line_content should be the exact line from the diff that the comment is about and it should be one line without new line characters.
-    Example:
-    ```json
-    [
-        {{
-            "file_path": "path/to/file.py",
-            "line_content": "...",
-            "comment": "This is a comment."
-        }}
-    ]
-    ```
-    
-    Here is the diff:
-    {diff}
-    """
+    cache = get_review_cache()
+    cache_key = review_cache_key(diff, "openai", OPENAI_DEFAULT_MODEL, OPENAI_TEMPERATURE)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        metrics.inc("review_cache_lookups", provider="openai", result="miss" if cached is None else "hit")
+        if cached is not None:
+            print("Using cached Codex review.")
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    prompt = build_review_prompt(diff)
 
     body = {
         "model": OPENAI_DEFAULT_MODEL,
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.2,
+        "temperature": OPENAI_TEMPERATURE,
     }
 
-    retries = 10
-    delay = 15  # seconds
-    backoff_factor = 2
-
-    for i in range(retries):
-        try:
-            response = requests.post(OPENAI_API_ENDPOINT, headers=headers, json=body)
-            response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"].strip()
-        except requests.exceptions.HTTPError as e:
-            if e.response is not None and e.response.status_code == 429 and i < retries - 1:
-                retry_after = e.response.headers.get("Retry-After")
-                if retry_after:
-                    try:
-                        wait = float(retry_after) + random.uniform(0, 1)
-                        print(f"OpenAI rate limit exceeded. Retrying in {wait:.2f} seconds...")
-                        time.sleep(wait)
-                    except ValueError:
-                        wait = delay * (backoff_factor ** i) + random.uniform(0, 1)
-                        print(f"OpenAI rate limit exceeded. Retrying in {wait:.2f} seconds...")
-                        time.sleep(wait)
-                else:
-                    wait = delay * (backoff_factor ** i) + random.uniform(0, 1)
-                    print(f"OpenAI rate limit exceeded. Retrying in {wait:.2f} seconds...")
-                    time.sleep(wait)
-            elif e.response is not None and e.response.status_code == 503 and i < retries - 1:
-                wait = delay * (backoff_factor ** i) + random.uniform(0, 1)
-                print(f"OpenAI API returned 503. Retrying in {wait:.2f} seconds... ({retries - i - 1} retries left)")
-                print(f"Error details: {e.response.text}")
-                time.sleep(wait)
-            elif i == retries - 1:
-                print("OpenAI API is unavailable after multiple retries.")
-                raise
-            else:
-                print(f"Error calling OpenAI API: {e}")
-                raise
+    streaming = use_llm_streaming(on_delta)
+    if streaming:
+        body["stream"] = True
+        body["stream_options"] = {"include_usage": True}
+    started_at = time.monotonic()
+    response = post_ai_request("OpenAI", OPENAI_API_ENDPOINT, headers, body, estimate_tokens(prompt), stream=streaming, cancel=cancel)
+    if streaming:
+        feedback, usage = read_streamed_feedback(response, _openai_stream_text, lambda event: event.get("usage"), on_delta, cancel)
+        feedback = feedback.strip()
+    else:
+        response_json = response.json()
+        usage = response_json.get("usage") or {}
+        feedback = response_json["choices"][0]["message"]["content"].strip()
+        if on_delta is not None:
+            on_delta(feedback)
+    get_ai_latency("OpenAI").observe(time.monotonic() - started_at)
+    record_token_usage("openai", usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    # An unparseable answer (e.g. cut off) is not cached, so it is requested again next time.
+    if cache is not None and is_valid_feedback(feedback):
+        cache.put(cache_key, feedback)
+    return feedback
 
 def parse_ai_feedback(feedback):
     """Parses the feedback from the AI agent API."""
-    if feedback.lower() == "approve":
+    text = strip_code_fence(feedback)
+    if text.strip("'\".` \n").lower() == "approve":
         return "approve", None
-    
+
     try:
-        if feedback.startswith("```json"):
-            feedback = feedback[7:-4]
-        return "comment", json.loads(feedback)
+        return "comment", json.loads(text)
     except json.JSONDecodeError:
-        return "comment", feedback
+        # e.g. a sentence around the JSON array, or an answer cut off in the middle
+        objects = JsonArrayStream().feed(feedback)
+        return "comment", objects if objects else feedback
+
+def merge_ai_feedback(feedbacks):
+    """Merges the feedback of several diff chunks into a single (action, comments) result.
+
+    The PR is approved only if every chunk approves. Comments are concatenated and
+    deduplicated; feedback that is not a JSON list becomes a comment without a file path.
+    """
+    merged = []
+    seen = set()
+    all_approved = True
+    for feedback in feedbacks:
+        action, comments = parse_ai_feedback(feedback)
+        if action == "approve":
+            continue
+        all_approved = False
+        if not isinstance(comments, list):
+            comments = [{"comment": feedback}]
+        for comment in comments:
+            if not isinstance(comment, dict):
+                comment = {"comment": str(comment)}
+            key = (
+                comment.get("file_path"),
+                normalize_line(str(comment.get("line_content") or "")),
+                comment.get("comment"),
+            )
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(comment)
 
+    if all_approved:
+        return "approve", None
+    return "comment", merged
+
+@metrics.timed("comment_post")
 def post_inline_comment(pr, file_path, line_number, comment, email, api_token, workspace, repo_slug):
     """Posts an inline comment to a pull request."""
     url = f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/pullrequests/{pr.id}/comments"
@@ -249,25 +519,27 @@ def post_inline_comment(pr, file_path, line_number, comment, email, api_token, w
         "content": {"raw": comment},
         "inline": {"path": file_path, "to": line_number},
     }
-    response = requests.post(
+    response = http_client.post(
         url, headers=headers, data=json.dumps(payload), auth=(email, api_token)
     )
     response.raise_for_status()
 
+@metrics.timed("comment_post")
 def post_general_comment(pr, comment, email, api_token, workspace, repo_slug):
     """Posts a general comment to a pull request."""
     url = f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/pullrequests/{pr.id}/comments"
     headers = {"Content-Type": "application/json"}
     payload = {"content": {"raw": comment}}
-    response = requests.post(
+    response = http_client.post(
         url, headers=headers, data=json.dumps(payload), auth=(email, api_token)
     )
     response.raise_for_status()
 
+@metrics.timed("interaction_check")
 def has_user_interacted(pr, user_uuid, email, api_token, workspace, repo_slug):
     """Checks if the user has already approved or commented on the PR."""
     activity_url = f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/pullrequests/{pr.id}/activity"
-    response = requests.get(activity_url, auth=(email, api_token))
+    response = http_client.get(activity_url, auth=(email, api_token))
     response.raise_for_status()
     for activity in response.json().get("values", []):
         # Check for approvals
@@ -279,133 +551,1097 @@ def has_user_interacted(pr, user_uuid, email, api_token, workspace, repo_slug):
 
     return False, None
 
-def already_commented_on_line(pr, file_path, line_number, email, api_token, workspace, repo_slug):
-    """Returns True if an identical inline comment already exists on the given file/line."""
+# Invisible markdown line appended to every posted comment, so a retried post can tell whether it went through.
+COMMENT_MARKER_RE = re.compile(r"^\[//\]: # \(ai-review:([0-9a-f]+)\)$", re.MULTILINE)
+
+def comment_marker(file_path, line_number, comment):
+    """Returns the idempotency marker of a comment."""
+    return hashlib.sha1(f"{file_path}\0{line_number}\0{comment.strip()}".encode("utf-8")).hexdigest()[:16]
+
+def add_comment_marker(comment, marker):
+    return f"{comment}\n\n[//]: # (ai-review:{marker})"
+
+class CommentIndex:
+    """In-memory index of the (path, line) of a PR's inline comments, and of the markers of all its comments."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines = set()
+        self._markers = set()
+
+    def add(self, file_path, line_number):
+        with self._lock:
+            self._lines.add((file_path, line_number))
+
+    def add_marker(self, marker):
+        with self._lock:
+            self._markers.add(marker)
+
+    def has_marker(self, marker):
+        return marker in self._markers
+
+    def has_line(self, file_path, line_number):
+        return (file_path, line_number) in self._lines
+
+@metrics.timed("comment_index")
+def fetch_comment_index(pr, email, api_token, workspace, repo_slug):
+    """Fetches all existing inline comments of the PR once and returns them as a CommentIndex."""
     url = f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/pullrequests/{pr.id}/comments"
     next_url = url
+    params = {"pagelen": 100}
+    comment_index = CommentIndex()
 
     while next_url:
-        response = requests.get(next_url, auth=(email, api_token))
+        response = http_client.get(next_url, auth=(email, api_token), params=params)
         response.raise_for_status()
         data = response.json()
+        # The "next" link already carries the query parameters.
+        params = None
 
         for c in data.get("values", []):
+            raw = (c.get("content") or {}).get("raw") or ""
+            for marker in COMMENT_MARKER_RE.findall(raw):
+                comment_index.add_marker(marker)
             inline = c.get("inline") or {}
             path = inline.get("path")
             to_line = inline.get("to")
+            if path and to_line is not None:
+                comment_index.add(path, to_line)
+
+        next_url = data.get("next")
+
+    return comment_index
+
+def already_commented_on_line(comment_index, file_path, line_number):
+    """Returns True if an inline comment already exists on the given file/line."""
+    return comment_index.has_line(file_path, line_number)
+
+def get_diff_settings():
+    """Gets the diff streaming mode and the max bytes/files limits (0 means unlimited)."""
+    streaming = get_bool_config("DIFF_STREAMING")
+    max_bytes = max(0, get_int_config("DIFF_MAX_BYTES", 0))
+    max_files = max(0, get_int_config("DIFF_MAX_FILES", 0))
+    return streaming, max_bytes, max_files
+
+def get_pr_diff_url(pr, workspace, repo_slug, base_commit=None):
+    """Returns the URL of the PR diff, or of the interdiff between base_commit and the PR head."""
+    if base_commit:
+        # Two-dot diff of the current source commit relative to the last reviewed one.
+        return f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/diff/{pr.source_commit}..{base_commit}?topic=false"
+    return f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/pullrequests/{pr.id}/diff"
+
+def stream_pr_diff_lines(pr, email, api_token, workspace, repo_slug, chunk_size=DIFF_STREAM_CHUNK_SIZE, base_commit=None):
+    """Yields the lines of the PR diff while it is being downloaded, without holding the whole text."""
+    url = get_pr_diff_url(pr, workspace, repo_slug, base_commit)
+    with http_client.get(url, auth=(email, api_token), stream=True) as response:
+        response.raise_for_status()
+        pending = b""
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            pending += chunk
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r").decode("utf-8", "replace")
+        if pending:
+            yield pending.rstrip(b"\r").decode("utf-8", "replace")
+
+def get_pr_diff_text(pr, email, api_token, workspace, repo_slug, base_commit=None):
+    """Returns the whole PR diff text, or the interdiff since base_commit."""
+    if not base_commit:
+        return pr.diff()
+    response = http_client.get(get_pr_diff_url(pr, workspace, repo_slug, base_commit), auth=(email, api_token))
+    response.raise_for_status()
+    response.encoding = "utf-8"
+    return response.text
+
+def fetch_pr_diff(pr, email, api_token, workspace, repo_slug, base_commit=None):
+    """Fetches, parses and filters the PR diff. Returns the diff text for the prompt, the parsed diff,
+    and whether the diff limits (or DIFF_MAX_LINES_PER_FILE) left part of it out.
+
+    When base_commit is given, only the changes since that commit are fetched.
+    In streaming mode the diff is parsed while it is downloaded, and the configured
+    max bytes/files limits stop the download early instead of truncating afterwards.
+    Each file is filtered as soon as it is parsed, so only the kept files are held in
+    memory. Raises DiffLimitError when the limits leave nothing to review.
+    """
+    streaming, max_bytes, max_files = get_diff_settings()
+    if not streaming and not max_bytes and not max_files:
+        diff = get_pr_diff_text(pr, email, api_token, workspace, repo_slug, base_commit)
+        with metrics.span("parse_diff"):
+            parsed_diff = parse_diff(diff)
+        return filter_review_diff(diff, parsed_diff)
+
+    if streaming:
+        lines = stream_pr_diff_lines(pr, email, api_token, workspace, repo_slug, base_commit=base_commit)
+    else:
+        lines = get_pr_diff_text(pr, email, api_token, workspace, repo_slug, base_commit).splitlines()
+    reader = DiffReader(lines, max_bytes=max_bytes, max_files=max_files)
+    settings = get_diff_filter_settings()
+    if settings is None:
+        diff_files, report = list(reader), None
+    else:
+        diff_files, report = filter_diff(reader, **settings)
+    if reader.truncated:
+        if not reader.files_read:
+            raise DiffLimitError(f"Diff is larger than the configured limits and nothing of it fits ({reader.bytes_read} bytes read).")
+        print(f"Diff is larger than the configured limits; reviewing only the first {reader.files_read} files ({reader.bytes_read} bytes read).")
+    diff = format_diff(diff_files)
+    if report:
+        report_diff_filter(report, reader.bytes_read, diff)
+    partial = reader.truncated or bool(report is not None and report.truncated_files)
+    return diff, {diff_file.path: diff_file for diff_file in diff_files}, partial
+
+def get_diff_filter_settings():
+    """Gets the filter_diff keyword arguments, or None when DIFF_FILTER=no."""
+    if not get_bool_config("DIFF_FILTER", True):
+        return None
+    extra_patterns = get_config("DIFF_EXCLUDE_PATTERNS", "", is_list=True, default=[])
+    context_lines = get_int_config("DIFF_CONTEXT_LINES", DIFF_DEFAULT_CONTEXT_LINES)
+    return {
+        "exclude_patterns": DEFAULT_EXCLUDE_PATTERNS + tuple(pattern for pattern in extra_patterns if pattern),
+        "skip_generated": get_bool_config("DIFF_SKIP_GENERATED", True),
+        "skip_whitespace_only": get_bool_config("DIFF_SKIP_WHITESPACE_ONLY"),
+        "context_lines": context_lines if context_lines >= 0 else None,
+        "max_lines_per_file": max(0, get_int_config("DIFF_MAX_LINES_PER_FILE", 0)),
+    }
+
+def filter_review_diff(diff, parsed_diff):
+    """Drops the parts of the diff that are not worth reviewing.
+
+    Returns the minimal diff text, the kept files and whether DIFF_MAX_LINES_PER_FILE cut any file.
+    """
+    settings = get_diff_filter_settings()
+    if settings is None or not parsed_diff:
+        return diff, parsed_diff, False
+    with metrics.span("diff_filter"):
+        kept_files, report = filter_diff(parsed_diff.values(), **settings)
+        # filter_diff returns the original DiffFile objects it did not change.
+        if len(kept_files) == len(parsed_diff) and all(kept is original for kept, original in zip(kept_files, parsed_diff.values())):
+            return diff, parsed_diff, False
+        filtered = format_diff(kept_files)
+    report_diff_filter(report, len(diff.encode("utf-8")), filtered)
+    return filtered, {diff_file.path: diff_file for diff_file in kept_files}, bool(report.truncated_files)
+
+def report_diff_filter(report, diff_bytes, filtered):
+    """Prints and counts what the diff filter removed from a diff of diff_bytes bytes."""
+    for path, reason in report.dropped_files:
+        metrics.inc("diff_filter_files", reason=reason)
+    saved_bytes = max(0, diff_bytes - len(filtered.encode("utf-8")))
+    saved_tokens = saved_bytes // 4
+    metrics.inc("diff_filter_saved_bytes", saved_bytes)
+    metrics.inc("diff_filter_saved_tokens", saved_tokens)
+    details = [f"{len(report.dropped_files)} files dropped"]
+    if report.dropped_hunks:
+        details.append(f"{report.dropped_hunks} whitespace-only hunks")
+    if report.trimmed_lines:
+        details.append(f"{report.trimmed_lines} context lines trimmed")
+    if report.truncated_files:
+        details.append(f"{len(report.truncated_files)} files truncated")
+    print(f"Diff filter: {', '.join(details)}; saved {saved_bytes} bytes (~{saved_tokens} tokens).")
+
+def get_merge_base(workspace, repo_slug, first, second, email, api_token):
+    """Returns the hash of the best common ancestor of two commits (or branches)."""
+    revspec = f"{quote(first, safe='')}..{quote(second, safe='')}"
+    response = http_client.get(f"{BITBUCKET_API_BASE_URL}/repositories/{workspace}/{repo_slug}/merge-base/{revspec}", auth=(email, api_token))
+    response.raise_for_status()
+    return response.json().get("hash")
+
+def get_interdiff_problem(pr, base_commit, email, api_token, workspace, repo_slug):
+    """Returns why the interdiff since base_commit would not show just the new commits of the PR, or None if it does.
+
+    That is the case when base_commit is no longer an ancestor of the PR head (rebase or
+    force push), or when the destination branch was merged into the PR branch since then:
+    the interdiff would then also contain the changes that came from the destination.
+    """
+    if not same_commit(get_merge_base(workspace, repo_slug, base_commit, pr.source_commit, email, api_token), base_commit):
+        return f"Commit {base_commit[:12]} is no longer part of the PR branch"
+    destination = pr.destination_branch
+    if destination:
+        old_base = get_merge_base(workspace, repo_slug, base_commit, destination, email, api_token)
+        new_base = get_merge_base(workspace, repo_slug, pr.source_commit, destination, email, api_token)
+        if not same_commit(old_base, new_base):
+            return f"{destination} was merged into the PR branch since commit {base_commit[:12]}"
+    return None
+
+@metrics.timed("diff_fetch")
+def fetch_review_diff(pr, email, api_token, workspace, repo_slug, base_commit=None):
+    """Fetches the filtered diff to review: the interdiff since base_commit if it only holds new PR commits, otherwise the whole PR diff.
+
+    Returns the diff text, the parsed diff and whether only part of the diff is reviewed (see fetch_pr_diff).
+    """
+    if base_commit:
+        try:
+            problem = get_interdiff_problem(pr, base_commit, email, api_token, workspace, repo_slug)
+            if problem is None:
+                print(f"Reviewing only the changes since commit {base_commit[:12]}.")
+                return fetch_pr_diff(pr, email, api_token, workspace, repo_slug, base_commit)
+            print(f"{problem}; reviewing the whole PR.")
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            print(f"Commit {base_commit[:12]} no longer exists; reviewing the whole PR.")
+    return fetch_pr_diff(pr, email, api_token, workspace, repo_slug)
 
-            if path == file_path and to_line == line_number:
+_review_state = None
+_review_state_lock = threading.Lock()
+
+def load_review_state():
+    """Returns the shared review state stored in REVIEW_STATE_FILE."""
+    global _review_state
+    with _review_state_lock:
+        if _review_state is None:
+            _review_state = ReviewState(get_config("REVIEW_STATE_FILE", "", default=REVIEW_STATE_DEFAULT_FILE))
+        return _review_state
+
+def get_review_state():
+    """Returns the shared review state used for incremental reviews, or None when INCREMENTAL_REVIEW=no."""
+    if not get_bool_config("INCREMENTAL_REVIEW", True):
+        return None
+    return load_review_state()
+
+def plan_pr_review(pr, user_uuid, email, api_token, workspace, repo_slug, skip_if_user_interacted):
+    """Decides how to review the PR. Returns (review, base_commit, reason).
+
+    base_commit is the last reviewed commit when only the new commits need a review,
+    or None for a full review. When review is False, reason tells why the PR is skipped.
+    """
+    state = get_review_state()
+    last_commit = state.get_commit(workspace, repo_slug, pr.id) if state is not None else None
+    if skip_if_user_interacted and same_commit(last_commit, pr.source_commit):
+        return False, None, "Already reviewed the latest commit."
+    if not skip_if_user_interacted:
+        return True, None, None
+
+    interacted, reason = has_user_interacted(pr, user_uuid, email, api_token, workspace, repo_slug)
+    if not interacted:
+        return True, None, None
+    if last_commit and pr.source_commit:
+        return True, last_commit, None
+    return False, None, reason
+
+def record_pr_review(pr, workspace, repo_slug):
+    """Records the PR's current source commit as reviewed."""
+    state = get_review_state()
+    if state is not None and pr.source_commit:
+        state.set_commit(workspace, repo_slug, pr.id, pr.source_commit)
+
+def request_ai_feedback(diff, ai_agent, ai_creds, on_delta=None, cancel=None):
+    """Gets the raw feedback text from the given AI agent."""
+    if str(ai_agent).lower() == "codex":
+        return get_codex_feedback(diff, ai_creds, on_delta, cancel)
+    return get_gemini_feedback(diff, ai_creds, on_delta, cancel)
+
+def get_ai_feedback(diff, ai_agent, ai_creds, on_delta=None):
+    """Gets the raw feedback text from the selected AI agent.
+
+    In hedged mode (AI_HEDGE_AGENT), ai_creds maps each AI agent to its credentials, the selected one first.
+    """
+    if isinstance(ai_creds, dict):
+        return get_hedged_feedback(diff, ai_creds, on_delta)
+    return request_ai_feedback(diff, ai_agent, ai_creds, on_delta)
+
+def get_hedge_agent(ai_agent):
+    """Gets the AI agent that is also asked when the selected one is slow or failing, or None when hedging is off."""
+    hedge_agent = get_config("AI_HEDGE_AGENT", "", default="").strip().lower()
+    if not hedge_agent or hedge_agent == ai_agent:
+        return None
+    if hedge_agent not in AI_AGENT_NAMES:
+        return load_config().invalid("AI_HEDGE_AGENT", hedge_agent, None)
+    return hedge_agent
+
+def get_hedge_delay(ai_agent):
+    """Returns how long to wait for the AI agent before also asking the other one.
+
+    This is the configured percentile of its recent answer times (at least AI_HEDGE_MIN_DELAY_SECONDS),
+    or AI_HEDGE_INITIAL_DELAY_SECONDS until enough answers have been timed.
+    """
+    tracker = get_ai_latency(AI_AGENT_NAMES[ai_agent])
+    if len(tracker) < AI_HEDGE_MIN_SAMPLES:
+        return max(0, get_int_config("AI_HEDGE_INITIAL_DELAY_SECONDS", AI_HEDGE_DEFAULT_INITIAL_DELAY))
+    percentile = min(100, max(1, get_int_config("AI_HEDGE_PERCENTILE", AI_HEDGE_DEFAULT_PERCENTILE)))
+    return max(get_int_config("AI_HEDGE_MIN_DELAY_SECONDS", AI_HEDGE_DEFAULT_MIN_DELAY), tracker.percentile(percentile))
+
+def is_valid_feedback(feedback):
+    """Returns True if the feedback is an approval or a parseable list of comments."""
+    action, comments = parse_ai_feedback(feedback)
+    return action == "approve" or isinstance(comments, list)
+
+def get_hedged_feedback(diff, ai_creds, on_delta=None):
+    """Asks the first AI agent of ai_creds for a review, and the next one too if the first is slow or fails.
+
+    The first valid answer wins and the other request is cancelled. Agents whose circuit
+    breaker is open are skipped. Only the agent that starts answering first streams to on_delta.
+    """
+    agents = [agent for agent in ai_creds if get_ai_breaker(AI_AGENT_NAMES[agent]).allow()]
+    for agent in ai_creds:
+        if agent not in agents:
+            metrics.inc("ai_circuit_skips", agent=AI_AGENT_NAMES[agent])
+    if not agents:
+        # Every provider is failing; keep trying the selected one.
+        agents = list(ai_creds)[:1]
+    delay = get_hedge_delay(agents[0])
+
+    streaming_agent = []
+    streaming_lock = threading.Lock()
+
+    def make_attempt(index, agent):
+        def deliver(text):
+            with streaming_lock:
+                if not streaming_agent:
+                    streaming_agent.append(agent)
+            if streaming_agent[0] == agent:
+                on_delta(text)
+
+        def attempt(cancel):
+            if index > 0:
+                print(f"No valid answer from {AI_AGENT_NAMES[agents[0]]} yet; also asking {AI_AGENT_NAMES[agent]}.")
+                metrics.inc("ai_hedges", agent=AI_AGENT_NAMES[agent])
+            return request_ai_feedback(diff, agent, ai_creds[agent], deliver if on_delta is not None else None, cancel)
+        return attempt
+
+    index, feedback = hedged_call([make_attempt(index, agent) for index, agent in enumerate(agents)], delay, is_valid_feedback)
+    metrics.inc("ai_hedge_wins", agent=AI_AGENT_NAMES[agents[index]])
+    if index > 0:
+        print(f"Using the review of {AI_AGENT_NAMES[agents[index]]}.")
+    return feedback
+
+def get_chunk_settings():
+    """Gets the token budget per diff chunk (0 disables chunking) and the number of chunks reviewed in parallel."""
+    max_tokens = max(0, get_int_config("LLM_CHUNK_MAX_TOKENS", LLM_CHUNK_DEFAULT_MAX_TOKENS))
+    concurrency = max(1, get_int_config("LLM_CHUNK_CONCURRENCY", LLM_CHUNK_DEFAULT_CONCURRENCY))
+    return max_tokens, concurrency
+
+@metrics.timed("llm")
+def get_ai_review(diff, parsed_diff, ai_agent, ai_creds, on_comment=None):
+    """Reviews the diff with the AI agent and returns the parsed (action, comments) result.
+
+    Diffs larger than the token budget are split into chunks on file/hunk boundaries,
+    which are reviewed concurrently and merged with merge_ai_feedback. When on_comment
+    is given, it is called with each comment object as soon as it is complete in the answer.
+    """
+    def review(chunk):
+        if on_comment is None:
+            return get_ai_feedback(chunk, ai_agent, ai_creds)
+        stream = JsonArrayStream()
+
+        def on_delta(text):
+            for comment in stream.feed(text):
+                on_comment(comment)
+
+        return get_ai_feedback(chunk, ai_agent, ai_creds, on_delta)
+
+    max_tokens, concurrency = get_chunk_settings()
+    diff_tokens = estimate_tokens(diff)
+    if not max_tokens or diff_tokens <= max_tokens or not parsed_diff:
+        return parse_ai_feedback(review(diff))
+
+    chunks = chunk_diff(parsed_diff.values(), max_tokens)
+    print(f"Diff is ~{diff_tokens} tokens; reviewing it in {len(chunks)} chunks.")
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as executor:
+        feedbacks = list(executor.map(review, chunks))
+    return merge_ai_feedback(feedbacks)
+
+def start_comment_poster(pr, parsed_diff, email, api_token, workspace, repo_slug):
+    """Returns a CommentPoster for the comments streamed by the AI agent, or None when LLM_STREAMING is off."""
+    if not get_bool_config("LLM_STREAMING"):
+        return None
+    return CommentPoster(pr, parsed_diff, email, api_token, workspace, repo_slug, streaming=True)
+
+def get_comment_post_settings():
+    """Gets the concurrent posts per PR, the retries per comment and the max comments per PR (0 means unlimited)."""
+    concurrency = max(1, get_int_config("COMMENT_POST_CONCURRENCY", COMMENT_POST_DEFAULT_CONCURRENCY))
+    retries = max(0, get_int_config("COMMENT_POST_RETRIES", COMMENT_POST_DEFAULT_RETRIES))
+    max_per_pr = max(0, get_int_config("COMMENT_MAX_PER_PR", COMMENT_DEFAULT_MAX_PER_PR))
+    return concurrency, retries, max_per_pr
+
+def fold_comment_posts(overflow):
+    """Folds findings into a single summary comment (general, so its file path and line are None).
+
+    The summary carries the markers of the folded findings, so they are not posted again later.
+    """
+    lines = [f"**{len(overflow)} more review findings:**", ""]
+    for file_path, line_number, comment in overflow:
+        location = f"`{file_path}:{line_number}`" if file_path else "General"
+        lines.append(f"* {location}: {comment}")
+    lines.append("")
+    lines += [add_comment_marker("", comment_marker(*post)).strip() for post in overflow]
+    print(f"Folding {len(overflow)} findings into a summary comment.")
+    return None, None, "\n".join(lines)
+
+def post_comment(pr, file_path, line_number, comment, comment_index, retries, email, api_token, workspace, repo_slug):
+    """Posts a comment with its idempotency marker, retrying on 429, 5xx and network errors.
+
+    Before retrying a request that may have been applied anyway, the PR comments are checked
+    for the marker, so a comment is never posted twice. Returns False if it already existed.
+    """
+    marker = comment_marker(file_path, line_number, comment)
+    if comment_index.has_marker(marker):
+        return False
+    body = add_comment_marker(comment, marker)
+    for attempt in range(retries + 1):
+        try:
+            if file_path:
+                post_inline_comment(pr, file_path, line_number, body, email, api_token, workspace, repo_slug)
+                comment_index.add(file_path, line_number)
+            else:
+                post_general_comment(pr, body, email, api_token, workspace, repo_slug)
+            comment_index.add_marker(marker)
+            return True
+        except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            response = e.response
+            status_code = response.status_code if response is not None else None
+            if attempt == retries or (status_code is not None and status_code != 429 and status_code < 500):
+                raise
+            delay = (get_retry_delay(response) if status_code == 429 else None) or COMMENT_POST_RETRY_DELAY * 2 ** attempt
+            print(f"Posting a comment failed ({status_code or type(e).__name__}). Retrying in {delay:.1f} seconds...")
+            metrics.inc("comment_post_retries", status=status_code or "error")
+            time.sleep(delay)
+            # A 429 was rejected for sure; other failures may have been applied anyway.
+            if status_code != 429 and fetch_comment_index(pr, email, api_token, workspace, repo_slug).has_marker(marker):
+                comment_index.add_marker(marker)
                 return True
 
-        next_url = data.get("next")
+class CommentPoster:
+    """Maps AI comments to diff lines and posts them concurrently.
+
+    With streaming, comments are submitted while the AI agent is still generating its answer,
+    and each one is posted as soon as it is mapped to a line. Otherwise the whole batch is
+    mapped first and posted by finish(). Comments already posted (found by their marker),
+    on lines that already have a comment, or submitted twice are dropped. With max_per_pr,
+    the findings above the cap are held back and folded into one summary comment by finish().
+    """
+
+    def __init__(self, pr, parsed_diff, email, api_token, workspace, repo_slug, streaming=False):
+        self.pr = pr
+        self.streaming = streaming
+        self.parsed_diff = parsed_diff
+        self._credentials = (email, api_token, workspace, repo_slug)
+        concurrency, self.retries, self.max_per_pr = get_comment_post_settings()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="comment-post")
+        self._lock = threading.Lock()
+        self._comment_index = None
+        self._planned_lines = set()
+        self._planned_markers = set()
+        self._ready = []
+        self._futures = []
+        self._overflow = []
+        self._started_at = time.monotonic()
+        self.submitted = 0
+
+    def _get_comment_index(self):
+        if self._comment_index is None:
+            self._comment_index = fetch_comment_index(self.pr, *self._credentials)
+        return self._comment_index
+
+    def _map(self, comment):
+        """Returns the (file_path, line_number, comment) to post for an AI comment, or None if it cannot be placed."""
+        file_path = comment.get("file_path")
+        line_content = str(comment.get("line_content") or "").strip()
+        comment_text = comment.get("comment")
+
+        if not comment_text:
+            return None
+        if not file_path:
+            return None, None, comment_text
+        if not line_content:
+            return None
+
+        with metrics.span("comment_matching"):
+            diff_file = self.parsed_diff.get(file_path)
+            line_number = diff_file.find_line(line_content) if diff_file is not None else None
+        if line_number is None:
+            print(f"Warning: Could not find line with content '{line_content}' in file {file_path} to post a comment.")
+            print(f"Gemini review comment: '{comment_text}'")
+            return None
+        return file_path, line_number, comment_text
 
-    return False
-
-def parse_diff(diff_text):
-    """Parses the diff text and returns a map of file paths to their hunks."""
-    files = {}
-    current_file = None
-    for line in diff_text.splitlines():
-        if line.startswith("diff --git"):
-            current_file = line.split(" b/")[1]
-            files[current_file] = []
-        elif line.startswith("@@") and current_file:
-            parts = line.split(" ")
-            new_start_line = int(parts[2].split(",")[0][1:])
-            files[current_file].append({"new_start_line": new_start_line, "lines": []})
-        elif current_file and files[current_file]:
-            files[current_file][-1]["lines"].append(line)
-    return files
+    def submit(self, comment):
+        """Maps the AI comment (a dict with file_path, line_content and comment) to the diff and plans its post."""
+        if not isinstance(comment, dict):
+            comment = {"comment": str(comment)}
+        with self._lock:
+            post = self._map(comment)
+            if post is None:
+                return
+            file_path, line_number, _ = post
+            marker = comment_marker(*post)
+            if marker in self._planned_markers:
+                # Submitted before, e.g. while it was streamed.
+                return
+            if self._get_comment_index().has_marker(marker):
+                if file_path:
+                    print(f"Skipping already posted comment on {file_path}:{line_number}")
+                return
+            if file_path:
+                if already_commented_on_line(self._get_comment_index(), file_path, line_number) or (file_path, line_number) in self._planned_lines:
+                    print(f"Skipping duplicate comment on {file_path}:{line_number}")
+                    return
+                self._planned_lines.add((file_path, line_number))
+            self._planned_markers.add(marker)
+            self.submitted += 1
+            if self.submitted == 1 and self.streaming:
+                # Time from the start of the AI request to the first comment ready to post.
+                metrics.observe("first_comment", time.monotonic() - self._started_at)
+            if self.max_per_pr and self.submitted >= self.max_per_pr:
+                # The last slot is kept for the summary of the overflow.
+                self._overflow.append(post)
+            elif self.streaming:
+                self._start(post)
+            else:
+                self._ready.append(post)
+
+    def _start(self, post):
+        self._futures.append(self._executor.submit(post_comment, self.pr, *post, self._get_comment_index(), self.retries, *self._credentials))
+
+    def finish(self):
+        """Posts the planned comments and the held back findings, waits for every post and returns the number of comments added.
+
+        Every comment is attempted even if some fail; the first error is raised afterwards.
+        """
+        with self._lock:
+            for post in self._ready:
+                self._start(post)
+            self._ready = []
+            if len(self._overflow) == 1:
+                self._start(self._overflow[0])
+            elif self._overflow:
+                self._start(fold_comment_posts(self._overflow))
+            self._overflow = []
+            futures = self._futures
+            self._futures = []
+        self._executor.shutdown(wait=True)
+        added = 0
+        errors = []
+        for future in futures:
+            try:
+                added += future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            print(f"{len(errors)} of {len(futures)} comments could not be posted.")
+            raise errors[0]
+        return added
+
+    def close(self):
+        """Waits for the comments being posted, dropping the planned and held back ones (used when the review failed)."""
+        with self._lock:
+            self._ready = []
+            self._overflow = []
+        self._executor.shutdown(wait=True)
+
+def apply_ai_feedback(pr, parsed_diff, action, comments, email, api_token, workspace, repo_slug, poster=None, partial=False):
+    """Approves the PR or posts the AI comments on it. Returns the action taken and the number of comments added.
+
+    poster is the CommentPoster that already received the comments streamed by the AI agent, if any.
+    When only part of the diff was reviewed (partial), the PR is never approved; a general
+    comment says that the review was partial instead.
+    """
+    if action == "approve" and not partial and (poster is None or not poster.submitted):
+        if poster is not None:
+            poster.finish()
+        with metrics.span("approve"):
+            pr.approve()
+        print(f"PR approved.")
+        return "approve", 0
+
+    if poster is None:
+        poster = CommentPoster(pr, parsed_diff, email, api_token, workspace, repo_slug)
+    if partial:
+        if action == "approve":
+            print("Only part of the diff was reviewed; not approving the PR.")
+        poster.submit({"comment": PARTIAL_REVIEW_COMMENT})
+    if isinstance(comments, list):
+        # Comments that were already streamed are skipped as duplicates.
+        for comment in comments:
+            poster.submit(comment)
+        added_comments_counter = poster.finish()
+        print(f"{added_comments_counter} comments were added.")
+        return "comment", added_comments_counter
+    elif action == "approve":
+        added_comments_counter = poster.finish()
+        print(f"{added_comments_counter} comments were added.")
+        return "comment", added_comments_counter
+    else:
+        print("Could not parse Gemini's feedback as JSON. Posting as a general comment.")
+        feedback = comments if isinstance(comments, str) else json.dumps(comments)
+        poster.submit({"comment": feedback})
+        added_comments_counter = poster.finish()
+        return "comment", added_comments_counter
 
 def review_pr(pr, user_uuid, email, api_token, workspace, repo_slug, ai_agent, ai_creds, skip_if_user_interacted):
-    """Reviews a single pull request."""
+    """Reviews a single pull request. Returns the outcome: 'skipped', 'approve', 'comment' or 'failed'."""
     print(f"\nChecking PR: {pr.title}")
     print(f"URL: https://bitbucket.org/{workspace}/{repo_slug}/pull-requests/{pr.id}/")
     
-    if skip_if_user_interacted:
-        interacted, reason = has_user_interacted(pr, user_uuid, email, api_token, workspace, repo_slug)
-        if interacted:
-            print(f"Skipping PR: {reason}")
-            return
+    review, base_commit, reason = plan_pr_review(pr, user_uuid, email, api_token, workspace, repo_slug, skip_if_user_interacted)
+    if not review:
+        print(f"Skipping PR: {reason}")
+        return "skipped"
 
     print(f"Reviewing PR: {pr.title}")
-    diff = pr.diff()
-    parsed_diff = parse_diff(diff)
+    try:
+        diff, parsed_diff, partial = fetch_review_diff(pr, email, api_token, workspace, repo_slug, base_commit)
+    except DiffLimitError as e:
+        print(f"Could not review PR: {pr.title}. {e}")
+        return "failed"
+    if not diff.strip():
+        print("No changes to review since the last review, or all of them were filtered out.")
+        record_pr_review(pr, workspace, repo_slug)
+        return "skipped"
 
+    poster = None
     try:
-        if str(ai_agent).lower() == "codex":
-            feedback = get_codex_feedback(diff, ai_creds)
-        else:
-            feedback = get_gemini_feedback(diff, ai_creds)
-        action, comments = parse_ai_feedback(feedback)
+        poster = start_comment_poster(pr, parsed_diff, email, api_token, workspace, repo_slug)
+        action, comments = get_ai_review(diff, parsed_diff, ai_agent, ai_creds, poster.submit if poster else None)
+        action, _ = apply_ai_feedback(pr, parsed_diff, action, comments, email, api_token, workspace, repo_slug, poster, partial)
+        record_pr_review(pr, workspace, repo_slug)
+        return action
+    except Exception as e:
+        if poster is not None:
+            poster.close()
+        print(f"Could not get feedback for PR: {pr.title}. Error: {e}")
+        return "failed"
 
-        if action == "approve":
-            pr.approve()
-            print(f"PR approved.")
-        elif isinstance(comments, list):
-            added_comments_counter = 0
-            for comment in comments:
-                file_path = comment["file_path"]
-                line_content = comment["line_content"].strip()
-                comment_text = comment["comment"]
-                comment_posted = False
-
-                if not line_content:
+# --- Concurrent review pipeline (modes 1 and 3) --- #
+# Each PR flows through: list -> interaction check -> diff fetch -> AI feedback -> post.
+# Stages are connected by bounded queues so diffs for later PRs are prefetched while
+# the AI agent is still working on earlier ones.
+PIPELINE_STAGES = ("list", "check", "diff", "llm", "post")
+PIPELINE_DEFAULT_WORKERS = {"list": 2, "check": 8, "diff": 4, "llm": 2, "post": 4}
+PIPELINE_DEFAULT_QUEUE_SIZE = 16
+_PIPELINE_DONE = object()
+
+def get_pipeline_settings():
+    """Gets the per-stage worker counts and the queue size for the review pipeline."""
+    workers = {
+        stage: max(1, get_int_config(f"PIPELINE_{stage.upper()}_WORKERS", default))
+        for stage, default in PIPELINE_DEFAULT_WORKERS.items()
+    }
+    queue_size = max(1, get_int_config("PIPELINE_QUEUE_SIZE", PIPELINE_DEFAULT_QUEUE_SIZE))
+    return workers, queue_size
+
+class PipelineStats:
+    """Thread-safe per-repository counters and timings for the review pipeline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.repos = {}
+        self.stage_seconds = {stage: 0.0 for stage in PIPELINE_STAGES}
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    def _repo(self, repo_slug):
+        repo = self.repos.get(repo_slug)
+        if repo is None:
+            now = time.monotonic()
+            repo = {"listed": 0, "skipped": 0, "approve": 0, "comment": 0, "failed": 0, "first": now, "last": now, "updated_on": None}
+            self.repos[repo_slug] = repo
+        return repo
+
+    def record(self, repo_slug, key, amount=1):
+        with self._lock:
+            repo = self._repo(repo_slug)
+            repo[key] += amount
+            repo["last"] = time.monotonic()
+
+    def note_updated_on(self, repo_slug, updated_on):
+        """Keeps track of the most recent updated_on of the listed PRs of the repository."""
+        with self._lock:
+            repo = self._repo(repo_slug)
+            if updated_on and (repo["updated_on"] is None or updated_on > repo["updated_on"]):
+                repo["updated_on"] = updated_on
+
+    def add_stage_time(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+
+    def print_summary(self):
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        print("\n--- Pipeline Throughput Summary ---")
+        totals = {"listed": 0, "skipped": 0, "approve": 0, "comment": 0, "failed": 0}
+        for repo_slug, repo in self.repos.items():
+            for key in totals:
+                totals[key] += repo[key]
+            reviewed = repo["approve"] + repo["comment"]
+            repo_elapsed = max(repo["last"] - repo["first"], 1e-6)
+            print(
+                f"{repo_slug}: {repo['listed']} PRs listed, {reviewed} reviewed "
+                f"({repo['approve']} approved, {repo['comment']} commented), {repo['skipped']} skipped, "
+                f"{repo['failed']} failed in {repo_elapsed:.1f}s ({reviewed * 60 / repo_elapsed:.2f} PRs/min)"
+            )
+        reviewed = totals["approve"] + totals["comment"]
+        print(
+            f"Total: {totals['listed']} PRs listed, {reviewed} reviewed, {totals['skipped']} skipped, "
+            f"{totals['failed']} failed in {elapsed:.1f}s ({reviewed * 60 / max(elapsed, 1e-6):.2f} PRs/min)"
+        )
+        print("Busy time per stage: " + ", ".join(f"{stage}={seconds:.1f}s" for stage, seconds in self.stage_seconds.items()))
+
+def _start_pipeline_stage(stage, worker_count, in_queue, out_queue, next_worker_count, handler, stats):
+    """Starts the worker threads of one pipeline stage.
+
+    The handler is called with each queued item and an emit callback that forwards results
+    to the next stage. Once every worker of this stage is done, the next stage is told to stop.
+    """
+    remaining = [worker_count]
+    lock = threading.Lock()
+
+    def emit(item):
+        out_queue.put(item)
+
+    def worker():
+        while True:
+            item = in_queue.get()
+            if item is _PIPELINE_DONE:
+                break
+            started = time.monotonic()
+            try:
+                handler(item, emit)
+            except Exception as e:
+                repo_slug = item if isinstance(item, str) else item[0]
+                print(f"[{repo_slug}] Error in pipeline stage '{stage}': {e}")
+                stats.record(repo_slug, "failed")
+            finally:
+                stats.add_stage_time(stage, time.monotonic() - started)
+        with lock:
+            remaining[0] -= 1
+            last_worker = remaining[0] == 0
+        if last_worker and out_queue is not None:
+            for _ in range(next_worker_count):
+                out_queue.put(_PIPELINE_DONE)
+
+    threads = [
+        threading.Thread(target=worker, name=f"pipeline-{stage}-{i}", daemon=True)
+        for i in range(worker_count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def run_review_pipeline(bitbucket, repo_slugs, pr_query, user_uuid, email, api_token, workspace, ai_agent, ai_creds, skip_if_user_interacted=True, job_store=None):
+    """Reviews the PRs of all given repositories through a staged, concurrent pipeline.
+
+    pr_query is a Bitbucket query used to list the PRs, or a function returning the query of a repository.
+    When a JobStore is given, the outcome of every PR is recorded in it and the PRs it already
+    finished at their current source commit are skipped, so an interrupted sweep can be resumed.
+    """
+    workers, queue_size = get_pipeline_settings()
+    stats = PipelineStats()
+    print("Pipeline workers: " + ", ".join(f"{stage}={count}" for stage, count in workers.items()))
+
+    queues = {stage: queue.Queue(maxsize=0 if stage == "list" else queue_size) for stage in PIPELINE_STAGES}
+
+    # Timings of the PRs in flight, recorded in the job store once they are done.
+    jobs = {}
+    jobs_lock = threading.Lock()
+
+    def note_job(repo_slug, pr, **fields):
+        if job_store is not None:
+            with jobs_lock:
+                jobs.setdefault((repo_slug, pr.id), {"started_at": time.monotonic()}).update(fields)
+
+    def finish_job(repo_slug, pr, status, **fields):
+        if job_store is None:
+            return
+        with jobs_lock:
+            job = jobs.pop((repo_slug, pr.id), {})
+        started_at = job.pop("started_at", None)
+        job.update(fields)
+        if started_at is not None:
+            job["total_seconds"] = time.monotonic() - started_at
+        job_store.record(workspace, repo_slug, pr.id, pr.source_commit, status, title=pr.title, **job)
+
+    def list_prs(repo_slug, emit):
+        print(f"\n--- Processing repository: {repo_slug} ---")
+        stats.record(repo_slug, "listed", 0)
+        repo = bitbucket.repositories.get(workspace, repo_slug)
+        prs = repo.pullrequests.each(pr_query(repo_slug) if callable(pr_query) else pr_query)
+        for pr in metrics.timed_iter("list", prs):
+            stats.record(repo_slug, "listed")
+            stats.note_updated_on(repo_slug, pr.get_data("updated_on"))
+            emit((repo_slug, pr))
+
+    def check_pr(item, emit):
+        repo_slug, pr = item
+        if job_store is not None and job_store.is_finished(workspace, repo_slug, pr.id, pr.source_commit):
+            print(f"[{repo_slug}#{pr.id}] Skipping PR '{pr.title}': already done in an earlier run.")
+            stats.record(repo_slug, "skipped")
+            return
+        note_job(repo_slug, pr)
+        review, base_commit, reason = plan_pr_review(pr, user_uuid, email, api_token, workspace, repo_slug, skip_if_user_interacted)
+        if not review:
+            print(f"[{repo_slug}#{pr.id}] Skipping PR '{pr.title}': {reason}")
+            stats.record(repo_slug, "skipped")
+            finish_job(repo_slug, pr, "skipped", reason=reason)
+            return
+        emit((repo_slug, pr, base_commit))
+
+    def fetch_diff(item, emit):
+        repo_slug, pr, base_commit = item
+        print(f"[{repo_slug}#{pr.id}] Reviewing PR: {pr.title}")
+        started_at = time.monotonic()
+        diff, parsed_diff, partial = fetch_review_diff(pr, email, api_token, workspace, repo_slug, base_commit)
+        note_job(repo_slug, pr, diff_seconds=time.monotonic() - started_at)
+        if not diff.strip():
+            print(f"[{repo_slug}#{pr.id}] No changes to review since the last review, or all of them were filtered out.")
+            record_pr_review(pr, workspace, repo_slug)
+            stats.record(repo_slug, "skipped")
+            finish_job(repo_slug, pr, "skipped", reason="No changes to review.")
+            return
+        emit((repo_slug, pr, diff, parsed_diff, partial))
+
+    def request_feedback(item, emit):
+        repo_slug, pr, diff, parsed_diff, partial = item
+        # With LLM_STREAMING=yes, comments are posted from here while the answer is generated.
+        poster = start_comment_poster(pr, parsed_diff, email, api_token, workspace, repo_slug)
+        started_at = time.monotonic()
+        try:
+            action, comments = get_ai_review(diff, parsed_diff, ai_agent, ai_creds, poster.submit if poster else None)
+        except Exception as e:
+            if poster is not None:
+                poster.close()
+            print(f"[{repo_slug}#{pr.id}] Could not get feedback for PR: {pr.title}. Error: {e}")
+            stats.record(repo_slug, "failed")
+            finish_job(repo_slug, pr, "failed", reason=str(e), llm_seconds=time.monotonic() - started_at)
+            return
+        note_job(repo_slug, pr, llm_seconds=time.monotonic() - started_at)
+        emit((repo_slug, pr, parsed_diff, action, comments, poster, partial))
+
+    def post_feedback(item, emit):
+        repo_slug, pr, parsed_diff, action, comments, poster, partial = item
+        print(f"[{repo_slug}#{pr.id}] Applying feedback for PR: {pr.title}")
+        feedback = None if comments is None else comments if isinstance(comments, str) else json.dumps(comments)
+        action, comment_count = apply_ai_feedback(pr, parsed_diff, action, comments, email, api_token, workspace, repo_slug, poster, partial)
+        record_pr_review(pr, workspace, repo_slug)
+        stats.record(repo_slug, action)
+        finish_job(repo_slug, pr, action, feedback=feedback, comment_count=comment_count)
+
+    def record_failures(handler):
+        # Errors escaping a handler are counted by the stage; the job store also needs the PR.
+        def run(item, emit):
+            try:
+                handler(item, emit)
+            except Exception as e:
+                finish_job(item[0], item[1], "failed", reason=str(e))
+                raise
+        return run
+
+    handlers = {
+        "list": list_prs,
+        "check": record_failures(check_pr),
+        "diff": record_failures(fetch_diff),
+        "llm": request_feedback,
+        "post": record_failures(post_feedback),
+    }
+
+    threads = []
+    for index, stage in enumerate(PIPELINE_STAGES):
+        next_stage = PIPELINE_STAGES[index + 1] if index + 1 < len(PIPELINE_STAGES) else None
+        threads += _start_pipeline_stage(
+            stage,
+            workers[stage],
+            queues[stage],
+            queues[next_stage] if next_stage else None,
+            workers[next_stage] if next_stage else 0,
+            handlers[stage],
+            stats,
+        )
+
+    for repo_slug in repo_slugs:
+        queues["list"].put(repo_slug)
+    for _ in range(workers["list"]):
+        queues["list"].put(_PIPELINE_DONE)
+
+    for thread in threads:
+        thread.join()
+    stats.finished_at = time.monotonic()
+
+    for repo_slug, repo in stats.repos.items():
+        if repo["listed"] == 0:
+            print(f"No pull requests found in {repo_slug}.")
+    stats.print_summary()
+    return stats
+
+def open_job_store():
+    """Opens the job store that makes mode 3 sweeps resumable, or returns None when MODE_3_RESUME=no."""
+    if not get_bool_config("MODE_3_RESUME", True):
+        return None
+    job_store = JobStore(
+        get_config("JOB_STORE_FILE", "", default=JOB_STORE_DEFAULT_FILE),
+        batch_size=get_int_config("JOB_STORE_BATCH_SIZE", JOB_STORE_DEFAULT_BATCH_SIZE),
+        flush_interval=max(0, get_int_config("JOB_STORE_FLUSH_SECONDS", JOB_STORE_DEFAULT_FLUSH_SECONDS)),
+    )
+    if len(job_store):
+        print(f"Resuming: {len(job_store)} PR reviews are already done in '{job_store.path}'.")
+    return job_store
+
+# --- Watch mode (mode 5) --- #
+WATCH_DEFAULT_INTERVAL_SECONDS = 300
+WATCH_DEFAULT_JITTER_SECONDS = 30
+# Margin for clock differences when a repository has no open PRs to take the cursor from
+WATCH_CURSOR_MARGIN_SECONDS = 60
+
+def run_watch_mode(bitbucket, repo_slugs, user_uuid, email, api_token, workspace, ai_agent, ai_creds):
+    """Polls the repositories forever, reviewing only the open PRs updated since the repository's cursor."""
+    interval = max(1, get_int_config("WATCH_INTERVAL_SECONDS", WATCH_DEFAULT_INTERVAL_SECONDS))
+    jitter = max(0, get_int_config("WATCH_JITTER_SECONDS", WATCH_DEFAULT_JITTER_SECONDS))
+    state = load_review_state()
+
+    def pr_query(repo_slug):
+        cursor = state.get_cursor(workspace, repo_slug)
+        if cursor:
+            return f'state = "OPEN" AND updated_on > {cursor}'
+        return 'state = "OPEN"'
+
+    try:
+        while True:
+            cycle_started = datetime.now(timezone.utc) - timedelta(seconds=WATCH_CURSOR_MARGIN_SECONDS)
+            print(f"\n--- Watch cycle started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
+            stats = run_review_pipeline(bitbucket, repo_slugs, pr_query, user_uuid, email, api_token, workspace, ai_agent, ai_creds, True)
+            for repo_slug in repo_slugs:
+                repo = stats.repos.get(repo_slug)
+                if repo is None or repo["failed"]:
+                    # Keep the cursor so the failed PRs are picked up again in the next cycle.
                     continue
+                if repo["updated_on"]:
+                    state.set_cursor(workspace, repo_slug, repo["updated_on"])
+                elif not state.get_cursor(workspace, repo_slug):
+                    state.set_cursor(workspace, repo_slug, cycle_started.isoformat())
 
-                if file_path in parsed_diff:
-                    for hunk in parsed_diff[file_path]:
-                        current_line_in_new_file = hunk["new_start_line"]
-                        for line in hunk["lines"]:
-                            # Strip leading '+' or '-' to match content
-                            stripped_line = line[1:].strip() if line.startswith(('+', '-')) else line.strip()
-                            if stripped_line == line_content:
-                                if already_commented_on_line(pr, file_path, current_line_in_new_file, email, api_token, workspace, repo_slug):
-                                    print(f"Skipping duplicate comment on {file_path}:{current_line_in_new_file}")
-                                    comment_posted = True
-                                    break
-
-                                post_inline_comment(
-                                    pr,
-                                    file_path,
-                                    current_line_in_new_file,
-                                    comment_text,
-                                    email,
-                                    api_token,
-                                    workspace,
-                                    repo_slug,
-                                )
-                                comment_posted = True
-                                added_comments_counter += 1
-                                break
-                            if line.startswith("+") or line.startswith(" "):
-                                current_line_in_new_file += 1
-                        if comment_posted:
-                            break
-                
-                if not comment_posted:
-                    print(f"Warning: Could not find line with content '{line_content}' in file {file_path} to post a comment.")
-                    print(f"Gemini review comment: '{comment_text}'")
-
-            print(f"{added_comments_counter} comments were added.")
-        else:
-            print("Could not parse Gemini's feedback as JSON. Posting as a general comment.")
-            post_general_comment(pr, feedback, email, api_token, workspace, repo_slug)
+            wait = max(1.0, interval + random.uniform(-jitter, jitter))
+            print(f"Next watch cycle in {wait:.0f} seconds.")
+            time.sleep(wait)
+    except KeyboardInterrupt:
+        print("\nStopping watch mode.")
 
-    except Exception as e:
-        print(f"Could not get feedback for PR: {pr.title}. Error: {e}")
+# --- Webhook server (mode 4) --- #
+WEBHOOK_DEFAULT_HOST = "127.0.0.1"
+WEBHOOK_DEFAULT_PORT = 8080
+WEBHOOK_DEFAULT_WORKERS = 2
+WEBHOOK_DEFAULT_COALESCE_SECONDS = 30
+
+def run_webhook_server(bitbucket, user_uuid, email, api_token, workspace, ai_agent, ai_creds):
+    """Serves Bitbucket pull request webhooks and reviews the PRs from a deduplicating work queue."""
+    host = get_config("WEBHOOK_HOST", "", default=WEBHOOK_DEFAULT_HOST)
+    port = get_int_config("WEBHOOK_PORT", WEBHOOK_DEFAULT_PORT)
+    secret = get_config("WEBHOOK_SECRET", "", default="")
+    if not secret and not get_bool_config("WEBHOOK_ALLOW_UNSIGNED"):
+        raise ConfigError("WEBHOOK_SECRET is not set; set it to verify the webhook signatures, or set WEBHOOK_ALLOW_UNSIGNED=yes to accept unsigned events.")
+    repo_slugs = get_config("WEBHOOK_REPO_SLUG_LIST", "", is_list=True, default=[])
+    worker_count = max(1, get_int_config("WEBHOOK_WORKERS", WEBHOOK_DEFAULT_WORKERS))
+    work_queue = CoalescingWorkQueue(max(0, get_int_config("WEBHOOK_COALESCE_SECONDS", WEBHOOK_DEFAULT_COALESCE_SECONDS)))
+
+    def on_event(event_key, event_workspace, repo_slug, pr_id):
+        if event_workspace.lower() != workspace.lower() or (repo_slugs and repo_slug not in repo_slugs):
+            print(f"Ignoring {event_key} for {event_workspace}/{repo_slug}#{pr_id}.")
+            return False
+        print(f"Received {event_key} for {repo_slug}#{pr_id}.")
+        work_queue.put((repo_slug, pr_id), event_key)
+        return True
+
+    def worker():
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            (repo_slug, pr_id), _ = item
+            try:
+                pr = bitbucket.repositories.get(workspace, repo_slug).pullrequests.get(pr_id)
+                if pr.is_open:
+                    review_pr(pr, user_uuid, email, api_token, workspace, repo_slug, ai_agent, ai_creds, True)
+                else:
+                    print(f"Skipping PR #{pr_id} in repository {repo_slug}: it is no longer open.")
+            except Exception as e:
+                print(f"Error processing PR #{pr_id} in repository {repo_slug}: {e}")
+            finally:
+                work_queue.done((repo_slug, pr_id))
+
+    threads = [threading.Thread(target=worker, name=f"webhook-worker-{i}", daemon=True) for i in range(worker_count)]
+    for thread in threads:
+        thread.start()
+
+    if not secret:
+        print("Warning: WEBHOOK_SECRET is not set and WEBHOOK_ALLOW_UNSIGNED=yes; webhook signatures will not be verified.")
+    server = make_server(host, port, secret, on_event)
+    print(f"Listening for Bitbucket webhooks on http://{host}:{server.server_port}/ (press Ctrl+C to stop).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping webhook server...")
+    finally:
+        server.server_close()
+        work_queue.close()
 
 def get_mode():
     """Gets the desired mode of operation from the user."""
     while True:
-        mode = get_config("MODE", "Please select a mode:\n1. Loop over opened PRs.\n2. Review a specific PR.\n3. Loop over all PRs in a specific time periods.\nEnter 1, 2, or 3: ")
-        if mode in ["1", "2", "3"]:
+        mode = get_config("MODE", "Please select a mode:\n1. Loop over opened PRs.\n2. Review a specific PR.\n3. Loop over all PRs in a specific time periods.\n4. Run a webhook server and review PRs when they are created or updated.\n5. Watch opened PRs and review them when they are updated.\nEnter 1, 2, 3, 4, or 5: ")
+        if mode in ["1", "2", "3", "4", "5"]:
             return int(mode)
+        elif not load_config().interactive:
+            raise ConfigError(f"Invalid value for MODE: '{mode}'.")
         else:
             print("Invalid mode selected. Please try again.")
 
+def configure_http_sessions():
+    """Configures the pooled HTTP sessions shared by all Bitbucket and AI agent calls."""
+    http_client.configure(
+        pool_size=max(1, get_int_config("HTTP_POOL_SIZE", http_client.DEFAULT_POOL_SIZE)),
+        connect_timeout=max(1, get_int_config("HTTP_CONNECT_TIMEOUT", http_client.DEFAULT_CONNECT_TIMEOUT)),
+        read_timeout=max(1, get_int_config("HTTP_READ_TIMEOUT", http_client.DEFAULT_READ_TIMEOUT)),
+    )
+
+def configure_rate_limits():
+    """Routes the requests of every provider through a shared rate-limit-aware scheduler."""
+    providers = (
+        ("GEMINI", GEMINI_API_ENDPOINT, GEMINI_DEFAULT_MAX_CONCURRENCY),
+        ("OPENAI", OPENAI_API_ENDPOINT, OPENAI_DEFAULT_MAX_CONCURRENCY),
+        ("BITBUCKET", BITBUCKET_API_BASE_URL, BITBUCKET_DEFAULT_MAX_CONCURRENCY),
+    )
+    for name, url, default_concurrency in providers:
+        http_client.set_scheduler(url, ProviderScheduler(
+            name.lower(),
+            requests_per_minute=max(0, get_int_config(f"{name}_REQUESTS_PER_MINUTE", 0)),
+            tokens_per_minute=max(0, get_int_config(f"{name}_TOKENS_PER_MINUTE", 0)),
+            max_concurrency=max(1, get_int_config(f"{name}_MAX_CONCURRENCY", default_concurrency)),
+        ))
+
+def start_metrics_server():
+    """Serves the Prometheus metrics endpoint when METRICS_PORT is set."""
+    port = get_int_config("METRICS_PORT", 0)
+    if port > 0:
+        server = metrics.start_server(get_config("METRICS_HOST", "", default=METRICS_DEFAULT_HOST), port)
+        print(f"Serving metrics on http://{server.server_address[0]}:{server.server_port}/metrics")
+
+def write_metrics_report():
+    """Writes the JSON run report to METRICS_REPORT_FILE, if set."""
+    path = get_config("METRICS_REPORT_FILE", "", default="")
+    if path:
+        try:
+            metrics.write_report(path)
+            print(f"Run report written to {path}.")
+        except OSError as e:
+            print(f"Could not write the run report to {path}: {e}")
+
 def main():
     """Main function to review and approve pull requests."""
+    configure_http_sessions()
+    configure_rate_limits()
+    start_metrics_server()
+    try:
+        run()
+    except ConfigError as e:
+        print(f"Configuration error: {e}")
+        raise SystemExit(2)
+    finally:
+        write_metrics_report()
+        http_client.close_all()
+
+def run():
+    """Connects to Bitbucket and runs the selected mode."""
+    # Imported here as the Atlassian client takes a noticeable part of the startup time.
+    from atlassian.bitbucket import Cloud
+    from atlassian.errors import ApiError
+
     email, api_token = get_credentials()
     workspace = get_config("BITBUCKET_WORKSPACE", "Enter your Bitbucket workspace:")
 
@@ -413,13 +1649,20 @@ def main():
         print("Connecting to Bitbucket...")
         
         user_info_url = f"{BITBUCKET_API_BASE_URL}/user"
-        response = requests.get(user_info_url, auth=(email, api_token))
+        response = http_client.get(user_info_url, auth=(email, api_token))
         response.raise_for_status()
         user_info = response.json()
         user_uuid = user_info["uuid"]
         print(f"Connected as {user_info['display_name']}.")
 
-        bitbucket = Cloud(username=email, password=api_token)
+        bitbucket = Cloud(
+            # The Cloud client appends the API version ("2.0") itself.
+            url=BITBUCKET_API_BASE_URL.rsplit("/", 1)[0],
+            username=email,
+            password=api_token,
+            session=http_client.get_session(BITBUCKET_API_BASE_URL),
+            timeout=http_client.get_timeout()[1],
+        )
         
         mode = get_mode()
         print(f"Selected mode: {mode}")
@@ -427,54 +1670,29 @@ def main():
         ai_agent = get_config("AI_AGENT", "Select AI agent (Gemini/Codex): ") or "Gemini"
         ai_agent_norm = ai_agent.strip().lower()
         if ai_agent_norm not in ("gemini", "codex"):
+            if not load_config().interactive:
+                raise ConfigError(f"Invalid value for AI_AGENT: '{ai_agent}'.")
             print("Unknown AI agent selected; defaulting to Gemini.")
             ai_agent_norm = "gemini"
 
-        if ai_agent_norm == "codex":
-            ai_creds = get_codex_credentials()
-        else:
-            ai_creds = get_gemini_credentials()
+        ai_creds = get_ai_credentials(ai_agent_norm)
+        hedge_agent = get_hedge_agent(ai_agent_norm)
+        if hedge_agent:
+            print(f"Hedging slow or failing {AI_AGENT_NAMES[ai_agent_norm]} requests with {AI_AGENT_NAMES[hedge_agent]}.")
+            ai_creds = {ai_agent_norm: ai_creds, hedge_agent: get_ai_credentials(hedge_agent)}
         if mode == 1:
             repo_slugs = get_config("MODE_1_REPO_SLUG_LIST", "Enter your Bitbucket repository slug(s) (comma-separated): ", is_list=True)
-            for repo_slug in repo_slugs:
-                print(f"\n--- Processing repository: {repo_slug} ---")
-                try:
-                    repo = bitbucket.repositories.get(workspace, repo_slug)
-                    pull_requests = list(repo.pullrequests.each())
-                    
-                    if not pull_requests:
-                        print("No open pull requests found.")
-                        continue
-
-                    print(f"Found {len(pull_requests)} open pull requests.")
-
-                    print("\n--- Pull Request Review Summary ---")
-
-                    for pr in pull_requests:
-                        review_pr(pr, user_uuid, email, api_token, workspace, repo_slug, ai_agent_norm, ai_creds, True)
-                except Exception as e:
-                    print(f"Error processing repository {repo_slug}: {e}")
+            run_review_pipeline(bitbucket, repo_slugs, None, user_uuid, email, api_token, workspace, ai_agent_norm, ai_creds, True)
         elif mode == 3:
             repo_slugs = get_config("MODE_3_REPO_SLUG_LIST", "Enter your Bitbucket repository slug(s) (comma-separated): ", is_list=True)
             start_date = get_config("MODE_3_START_DATE", "Enter your start date (YYYY-MM-DD): ") + "T00:00:00-00:00"
             end_date = get_config("MODE_3_END_DATE", "Enter your end date (YYYY-MM-DD): ") + "T23:59:59-00:00"
-            for repo_slug in repo_slugs:
-                print(f"\n--- Processing repository: {repo_slug} ---")
-                try:
-                    repo = bitbucket.repositories.get(workspace, repo_slug)
-                    pull_requests = list(repo.pullrequests.each(f"created_on >= {start_date} AND created_on <= {end_date}"))
-                    if not pull_requests:
-                        print("No pull requests found.")
-                        continue
-
-                    print(f"Found {len(pull_requests)} pull requests.")
-
-                    print("\n--- Pull Request Review Summary ---")
-
-                    for pr in pull_requests:
-                        review_pr(pr, user_uuid, email, api_token, workspace, repo_slug, ai_agent_norm, ai_creds, True)
-                except Exception as e:
-                    print(f"Error processing repository {repo_slug}: {e}")
+            job_store = open_job_store()
+            try:
+                run_review_pipeline(bitbucket, repo_slugs, f"created_on >= {start_date} AND created_on <= {end_date}", user_uuid, email, api_token, workspace, ai_agent_norm, ai_creds, True, job_store)
+            finally:
+                if job_store is not None:
+                    job_store.close()
         
         elif mode == 2:
             repo_slug = get_config("MODE_2_REPO_SLUG", "Enter the repository slug for the PR: ")
@@ -485,13 +1703,19 @@ def main():
                 review_pr(pr, user_uuid, email, api_token, workspace, repo_slug, ai_agent_norm, ai_creds, False)
             except Exception as e:
                 print(f"Error processing PR #{pr_id} in repository {repo_slug}: {e}")
-
+        elif mode == 4:
+            run_webhook_server(bitbucket, user_uuid, email, api_token, workspace, ai_agent_norm, ai_creds)
+        elif mode == 5:
+            repo_slugs = get_config("MODE_5_REPO_SLUG_LIST", "Enter your Bitbucket repository slug(s) (comma-separated): ", is_list=True)
+            run_watch_mode(bitbucket, repo_slugs, user_uuid, email, api_token, workspace, ai_agent_norm, ai_creds)
 
     except (ApiError, requests.exceptions.HTTPError) as e:
         print(f"Error connecting to Bitbucket: {e}")
         if hasattr(e, 'response') and e.response is not None and e.response.status_code in [401, 403]:
             print("This is likely due to an invalid or expired Bitbucket API token or insufficient permissions.")
         raise
+    except ConfigError:
+        raise
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         raise
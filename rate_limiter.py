@@ -0,0 +1,151 @@
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+class TokenBucket:
+    """A token bucket refilled continuously at rate_per_minute, holding at most one minute of tokens."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate_per_second = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """Returns how long to wait until amount tokens are available (0 if they are available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+class ProviderScheduler:
+    """Schedules the requests sent to one provider (Gemini, OpenAI or Bitbucket).
+
+    Requests wait for a concurrency slot, for the requests/minute and tokens/minute budgets
+    and for any retry delay announced by the server, which is shared by all callers.
+    The concurrency limit is halved when the provider rate limits us and grows back by one
+    after a window of successful requests (AIMD). A limit of 0 means unlimited.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_concurrency=4):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._cond = threading.Condition()
+        self._active = 0
+        self._successes = 0
+        self._paused_until = 0.0
+
+    @contextmanager
+    def slot(self, tokens=0):
+        """Waits until a request costing the given number of tokens may be sent."""
+        self._acquire(tokens)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _acquire(self, tokens):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._active >= self.concurrency:
+                        wait = None
+                    else:
+                        wait = max(
+                            self._request_bucket.wait_time(1, now) if self._request_bucket else 0.0,
+                            self._token_bucket.wait_time(tokens, now) if self._token_bucket and tokens else 0.0,
+                        )
+                        if wait <= 0:
+                            if self._request_bucket:
+                                self._request_bucket.consume(1)
+                            if self._token_bucket and tokens:
+                                self._token_bucket.consume(tokens)
+                            self._active += 1
+                            return
+                self._cond.wait(timeout=wait)
+
+    def pause(self, seconds):
+        """Makes every caller wait at least the given number of seconds before the next request."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self.concurrency < self.max_concurrency and self._successes >= self.concurrency:
+                self.concurrency += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_rate_limited(self, retry_delay=None):
+        with self._cond:
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+        if retry_delay:
+            self.pause(retry_delay)
+
+    def on_response(self, response):
+        """Updates the scheduler from a provider response."""
+        if response.status_code in (429, 503):
+            self.on_rate_limited(get_retry_delay(response))
+        elif response.status_code < 400:
+            self.on_success()
+
+def _parse_duration(value):
+    """Parses durations like '12', '12.5s' or '1m30s' into seconds."""
+    value = str(value).strip()
+    try:
+        return float(value.removesuffix("s"))
+    except ValueError:
+        pass
+    seconds = 0.0
+    number = ""
+    for char in value:
+        if char.isdigit() or char == ".":
+            number += char
+        elif number:
+            seconds += float(number) * {"h": 3600, "m": 60, "s": 1}.get(char, 0)
+            number = ""
+    return seconds or None
+
+def get_retry_delay(response):
+    """Returns the retry delay in seconds announced by a rate limited response, or None."""
+    if response is None:
+        return None
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        delay = _parse_duration(retry_after)
+        if delay is not None:
+            return delay
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    try:
+        error_json = response.json()
+    except ValueError:
+        return None
+    if not isinstance(error_json, dict):
+        return None
+    error = error_json.get("error")
+    for detail in (error.get("details") or []) if isinstance(error, dict) else []:
+        if isinstance(detail, dict) and detail.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
+            return _parse_duration(detail.get("retryDelay", ""))
+    return None
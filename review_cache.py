@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+class ReviewCache:
+    """Content-addressed on-disk cache of the raw feedback returned by the AI agents.
+
+    Entries older than max_age_seconds are dropped, and once the cache grows beyond
+    max_bytes the least recently used entries are evicted. A limit of 0 means unlimited.
+    """
+
+    def __init__(self, directory, max_bytes=0, max_age_seconds=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = self.evict()
+
+    @staticmethod
+    def make_key(**parts):
+        """Returns the cache key of the given parts (e.g. diff, prompt template, provider, model, temperature)."""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """Returns the cached feedback for the key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if self.max_age_seconds and time.time() - entry.get("created_at", 0) > self.max_age_seconds:
+            self._remove(path)
+            return None
+        try:
+            # The modification time tracks the last use for the size-based eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("feedback")
+
+    def put(self, key, feedback):
+        """Stores the feedback under the key, evicting old entries if the cache is too large."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created_at": time.time(), "feedback": feedback}, ensure_ascii=False).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._size += len(data)
+            over_limit = self.max_bytes and self._size > self.max_bytes
+        if over_limit:
+            size = self.evict()
+            with self._lock:
+                self._size = size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Removes expired entries and, if needed, the least recently used ones. Returns the remaining size."""
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if not name.endswith(".json"):
+                    # Leftover temporary file of an interrupted write.
+                    if now - stat.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+                # Entries that expire while still in use are dropped by get().
+                if self.max_age_seconds and now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes and total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+        return total
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+class ReviewState:
+    """Persists the source commit that was last reviewed for each PR, and the polling cursor of each repository, in a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._prs = data.get("prs", {})
+            self._cursors = data.get("cursors", {})
+        except FileNotFoundError:
+            self._prs = {}
+            self._cursors = {}
+        except ValueError:
+            print(f"Warning: could not read review state file '{path}'; starting with an empty state.")
+            self._prs = {}
+            self._cursors = {}
+
+    @staticmethod
+    def _key(workspace, repo_slug, pr_id):
+        return f"{workspace}/{repo_slug}/{pr_id}"
+
+    def get_commit(self, workspace, repo_slug, pr_id):
+        """Returns the source commit last reviewed for the PR, or None."""
+        with self._lock:
+            entry = self._prs.get(self._key(workspace, repo_slug, pr_id))
+        return entry["commit"] if entry else None
+
+    def set_commit(self, workspace, repo_slug, pr_id, commit):
+        """Records the source commit that was just reviewed for the PR and saves the state."""
+        with self._lock:
+            self._prs[self._key(workspace, repo_slug, pr_id)] = {"commit": commit, "reviewed_at": time.time()}
+            self._save()
+
+    def get_cursor(self, workspace, repo_slug):
+        """Returns the updated_on cursor of the repository, or None."""
+        with self._lock:
+            return self._cursors.get(f"{workspace}/{repo_slug}")
+
+    def set_cursor(self, workspace, repo_slug, cursor):
+        """Stores the updated_on cursor of the repository and saves the state."""
+        with self._lock:
+            self._cursors[f"{workspace}/{repo_slug}"] = cursor
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"prs": self._prs, "cursors": self._cursors}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+def same_commit(commit_a, commit_b):
+    """Compares commit hashes, allowing one of them to be abbreviated."""
+    if not commit_a or not commit_b:
+        return False
+    length = min(len(commit_a), len(commit_b))
+    return commit_a[:length] == commit_b[:length]
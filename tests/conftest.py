@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pr_reviewer loads the configuration on import; never prompt or install packages from the tests.
+os.environ.setdefault("NON_INTERACTIVE", "yes")
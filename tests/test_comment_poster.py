@@ -0,0 +1,107 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import config
+import http_client
+import pr_reviewer
+from diff_parser import parse_diff
+
+DIFF = """diff --git a/app.py b/app.py
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,4 @@
+ import os
++import json
++import re
++print("hi")"""
+
+class FakeBitbucket:
+    """Stores the posted comments and serves them back, like the PR comments endpoint."""
+
+    def __init__(self, fail_posts=0):
+        self.comments = []
+        self.posts = 0
+        self.fail_posts = fail_posts
+
+    def post(self, url, data=None, **kwargs):
+        self.posts += 1
+        self.comments.append(json.loads(data))
+        if self.fail_posts:
+            # The comment was stored, but the response was lost.
+            self.fail_posts -= 1
+            raise requests.exceptions.ConnectionError("connection reset")
+        return SimpleNamespace(raise_for_status=lambda: None)
+
+    def get(self, url, **kwargs):
+        values = list(self.comments)
+        return SimpleNamespace(raise_for_status=lambda: None, json=lambda: {"values": values})
+
+@pytest.fixture
+def bitbucket(monkeypatch):
+    fake = FakeBitbucket()
+    monkeypatch.setattr(http_client, "get_session", lambda url: fake)
+    monkeypatch.setattr(pr_reviewer, "COMMENT_POST_RETRY_DELAY", 0)
+    return fake
+
+def use_config(monkeypatch, **values):
+    monkeypatch.setattr(config, "_config", config.Config(values, {"NON_INTERACTIVE": "yes"}))
+
+def make_poster(streaming=False):
+    return pr_reviewer.CommentPoster(SimpleNamespace(id=1), parse_diff(DIFF), "me", "token", "team", "app", streaming)
+
+def comment(line_content, text, file_path="app.py"):
+    return {"file_path": file_path, "line_content": line_content, "comment": text}
+
+def test_post_is_not_repeated_when_the_failed_request_was_applied(monkeypatch, bitbucket):
+    use_config(monkeypatch)
+    bitbucket.fail_posts = 1
+    index = pr_reviewer.CommentIndex()
+    assert pr_reviewer.post_comment(SimpleNamespace(id=1), "app.py", 2, "Unused import.", index, 2, "me", "token", "team", "app")
+    assert bitbucket.posts == 1
+    assert len(bitbucket.comments) == 1
+    # The marker is known now, so posting it again is a no-op.
+    assert not pr_reviewer.post_comment(SimpleNamespace(id=1), "app.py", 2, "Unused import.", index, 2, "me", "token", "team", "app")
+    assert bitbucket.posts == 1
+
+def test_poster_skips_comments_already_posted(monkeypatch, bitbucket):
+    use_config(monkeypatch)
+    poster = make_poster()
+    poster.submit(comment("import json", "Unused import."))
+    assert poster.finish() == 1
+    poster = make_poster()
+    poster.submit(comment("import json", "Unused import."))
+    assert poster.finish() == 0
+    assert bitbucket.posts == 1
+
+def test_poster_dedups_planned_lines_and_comments(monkeypatch, bitbucket):
+    use_config(monkeypatch)
+    poster = make_poster(streaming=True)
+    poster.submit(comment("import json", "Unused import."))
+    poster.submit(comment("import json", "Unused import."))
+    poster.submit(comment("import json", "Another finding on the same line."))
+    poster.submit(comment("import re", "Unused too."))
+    assert poster.submitted == 2
+    assert poster.finish() == 2
+    assert sorted(c["inline"]["to"] for c in bitbucket.comments) == [2, 3]
+
+def test_findings_over_the_cap_are_folded_into_a_summary(monkeypatch, bitbucket):
+    use_config(monkeypatch, COMMENT_MAX_PER_PR="2")
+    poster = make_poster()
+    poster.submit(comment("import json", "Unused import."))
+    poster.submit(comment("import re", "Unused too."))
+    poster.submit(comment("print(\"hi\")", "Use logging."))
+    poster.submit({"comment": "Add tests."})
+    assert poster.finish() == 2
+    inline = [c for c in bitbucket.comments if "inline" in c]
+    summaries = [c["content"]["raw"] for c in bitbucket.comments if "inline" not in c]
+    assert len(inline) == 1
+    assert len(summaries) == 1
+    assert summaries[0].startswith("**3 more review findings:**")
+    assert "`app.py:3`: Unused too." in summaries[0] and "General: Add tests." in summaries[0]
+    # The folded findings carry their markers, so they are not posted again inline.
+    poster = make_poster()
+    poster.submit(comment("import re", "Unused too."))
+    assert poster.finish() == 0
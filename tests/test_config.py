@@ -0,0 +1,73 @@
+import builtins
+import os
+import subprocess
+import sys
+
+import pytest
+
+import utils
+from config import Config, ConfigError
+
+@pytest.fixture
+def no_input(monkeypatch):
+    def fail(prompt=""):
+        raise AssertionError(f"unexpected prompt: {prompt}")
+    monkeypatch.setattr(builtins, "input", fail)
+
+def test_typed_values_are_parsed_once():
+    config = Config({"HTTP_POOL_SIZE": "8", "LLM_STREAMING": "no"}, {"LLM_STREAMING": "Yes", "NON_INTERACTIVE": "yes"})
+    assert config.settings.http_pool_size == 8
+    assert config.get_int("HTTP_POOL_SIZE", 4) == 8
+    assert config.get_int("HTTP_READ_TIMEOUT", 120) == 120
+    # The environment takes precedence over the file.
+    assert config.get_bool("LLM_STREAMING") is True
+    with pytest.raises(KeyError):
+        config.get_int("NOT_A_TYPED_KEY", 1)
+
+def test_invalid_values_raise_when_non_interactive():
+    with pytest.raises(ConfigError) as error:
+        Config({"HTTP_POOL_SIZE": "eight", "LLM_STREAMING": "maybe"}, {"NON_INTERACTIVE": "yes"})
+    assert "HTTP_POOL_SIZE: 'eight'" in str(error.value)
+    assert "LLM_STREAMING: 'maybe'" in str(error.value)
+
+def test_invalid_values_fall_back_to_the_default_when_interactive(capsys):
+    config = Config({"HTTP_POOL_SIZE": "4.5", "LLM_STREAMING": "maybe"}, {})
+    assert config.get_int("HTTP_POOL_SIZE", 4) == 4
+    assert config.get_bool("LLM_STREAMING", default=True) is True
+    output = capsys.readouterr().out
+    assert output.count("Invalid value for HTTP_POOL_SIZE: '4.5'. Using its default.") == 1
+    assert "Invalid value for LLM_STREAMING: 'maybe'." in output
+
+def test_non_interactive_raises_instead_of_prompting(no_input):
+    config = Config({}, {"NON_INTERACTIVE": "yes"})
+    assert not config.interactive
+    with pytest.raises(ConfigError, match="BITBUCKET_EMAIL is not set"):
+        config.get("BITBUCKET_EMAIL", "Enter your Atlassian account email: ")
+    assert config.get("WEBHOOK_HOST", "", default="127.0.0.1") == "127.0.0.1"
+    assert config.get_bool("LLM_STREAMING", False, "Stream the answer? (yes/no): ") is False
+    with pytest.raises(ConfigError):
+        config.invalid("MODE", "7", "1")
+
+def test_interactive_prompts_for_missing_values(monkeypatch):
+    answers = iter(["me@example.com", "a, b", "yes"])
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(answers))
+    config = Config({}, {})
+    assert config.get("BITBUCKET_EMAIL", "Email: ") == "me@example.com"
+    assert config.get("REPO_SLUG_LIST", "Repositories: ", is_list=True) == ["a", "b"]
+    assert config.get_bool("LLM_STREAMING", False, "Stream? ") is True
+
+def test_missing_libraries_are_not_installed_when_non_interactive(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("pip should not run")
+    monkeypatch.setattr(utils.subprocess, "check_call", fail)
+    libraries = (("requests", "requests"), ("no_such_module_for_tests", "no-such-package"))
+    with pytest.raises(ImportError, match="pip install no-such-package"):
+        utils.install_needed_libraries(libraries, allow_install=False)
+    utils.install_needed_libraries(libraries[:1], allow_install=False)
+
+def test_invalid_config_stops_the_script_before_installing(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environ = dict(os.environ, NON_INTERACTIVE="yes", HTTP_POOL_SIZE="many", PYTHONPATH=root)
+    result = subprocess.run([sys.executable, "-c", "import pr_reviewer"], cwd=tmp_path, env=environ, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2
+    assert result.stdout.strip() == "Configuration error: Invalid value for HTTP_POOL_SIZE: 'many'."
@@ -0,0 +1,79 @@
+from diff_filter import MINIFIED_LINE_LENGTH, filter_diff, is_generated
+from diff_parser import format_diff, parse_diff
+
+def make_diff(path, old_lines, new_lines, old_start=1, new_start=1):
+    lines = [f"diff --git a/{path} b/{path}", f"--- a/{path}", f"+++ b/{path}"]
+    body = old_lines + new_lines
+    old_count = sum(1 for line in body if line[0] in "- ")
+    new_count = sum(1 for line in body if line[0] in "+ ")
+    lines.append(f"@@ -{old_start},{old_count} +{new_start},{new_count} @@")
+    return "\n".join(lines + body)
+
+def parse(*diffs):
+    return list(parse_diff("\n".join(diffs)).values())
+
+def kept_paths(files, **settings):
+    kept, report = filter_diff(files, **settings)
+    return [diff_file.path for diff_file in kept], report
+
+def test_drops_lockfiles_and_extra_patterns():
+    files = parse(
+        make_diff("package-lock.json", ["-a"], ["+b"]),
+        make_diff("src/app.js", ["-a"], ["+b"]),
+        make_diff("docs/out.txt", ["-a"], ["+b"]),
+    )
+    kept, report = kept_paths(files, exclude_patterns=("package-lock.json", "docs/*"))
+    assert kept == ["src/app.js"]
+    assert report.dropped_files == [("package-lock.json", "excluded"), ("docs/out.txt", "excluded")]
+
+def test_a_single_long_line_does_not_make_a_file_generated():
+    long_line = "+" + "x" * MINIFIED_LINE_LENGTH
+    assert not is_generated(parse(make_diff("app.js", [], [long_line, "+a", "+b"]))[0])
+    assert is_generated(parse(make_diff("app.js", [], [long_line, long_line, "+a"]))[0])
+
+def test_generated_marker_at_the_top():
+    files = parse(make_diff("api_pb2.py", [], ["+# Generated by the protocol buffer compiler.  DO NOT EDIT!", "+x = 1"]))
+    assert kept_paths(files)[0] == []
+    assert kept_paths(files, skip_generated=False)[0] == ["api_pb2.py"]
+
+def test_whitespace_only_hunks_are_kept_by_default():
+    files = parse(make_diff("app.js", [" if (x)", "-    y();"], ["+  y();"]))
+    assert kept_paths(files)[0] == ["app.js"]
+    assert kept_paths(files, skip_whitespace_only=True)[0] == []
+
+def test_indentation_changes_are_kept_in_indentation_sensitive_files():
+    files = parse(
+        make_diff("app.py", [" if x:", "-    y()"], ["+y()"]),
+        make_diff("deploy.yaml", ["-  key: value"], ["+key: value"]),
+        make_diff("Makefile", ["-\tbuild"], ["+    build"]),
+    )
+    assert kept_paths(files, skip_whitespace_only=True)[0] == ["app.py", "deploy.yaml", "Makefile"]
+
+def test_context_lines_are_trimmed_with_recomputed_headers():
+    context = [f" line {i}" for i in range(1, 11)]
+    files = parse(make_diff("a.txt", context[:5] + ["-old"], ["+new"] + context[5:]))
+    kept, report = filter_diff(files, context_lines=1)
+    assert report.trimmed_lines == 8
+    assert format_diff(kept).splitlines()[3:] == ["@@ -5,3 +5,3 @@", " line 5", "-old", "+new", " line 6"]
+    # Comments can still be matched against the lines that were trimmed.
+    assert kept[0].find_line("line 1") == 1
+
+def test_max_lines_per_file():
+    files = parse(make_diff("a.txt", [], [f"+{i}" for i in range(10)], old_start=0))
+    kept, report = filter_diff(files, max_lines_per_file=4)
+    assert report.truncated_files == ["a.txt"]
+    assert [line.content for line in kept[0].hunks[0].lines] == ["0", "1", "2", "3"]
+    assert kept[0].hunks[0].header == "@@ -0,0 +1,4 @@"
+
+def test_max_lines_per_file_cut_on_a_hunk_boundary():
+    diff = make_diff("a.txt", [], [f"+{i}" for i in range(4)], old_start=0) + "\n@@ -10,0 +15,3 @@\n+x\n+y\n+z"
+    kept, report = filter_diff(parse(diff), max_lines_per_file=4)
+    assert report.truncated_files == ["a.txt"]
+    assert report
+    assert len(kept[0].hunks) == 1
+
+def test_original_files_are_not_modified():
+    files = parse(make_diff("app.js", [" a", " b", " c", " d", " e", "-old"], ["+new"]))
+    before = format_diff(files)
+    filter_diff(files, context_lines=0)
+    assert format_diff(files) == before
@@ -0,0 +1,76 @@
+from diff_parser import DiffReader, chunk_diff, format_diff, parse_diff
+
+DIFF = """diff --git a/app.py b/app.py
+index 1111111..2222222 100644
+--- a/app.py
++++ b/app.py
+@@ -1,4 +1,5 @@ def main():
+ import os
+-import sys
++import json
++import re
+
+ print("hi")
+diff --git a/README.md b/README.md
+--- a/README.md
++++ b/README.md
+@@ -10,2 +10,2 @@
+-old
++new
+ end"""
+
+def read(max_bytes=0, max_files=0):
+    reader = DiffReader(DIFF.splitlines(), max_bytes=max_bytes, max_files=max_files)
+    return reader, list(reader)
+
+def test_parse_diff_line_numbers():
+    files = parse_diff(DIFF)
+    assert list(files) == ["app.py", "README.md"]
+    app = files["app.py"]
+    assert [(line.kind, line.old_line, line.new_line) for line in app.hunks[0].lines] == [
+        (" ", 1, 1), ("-", 2, None), ("+", None, 2), ("+", None, 3), (" ", 3, 4), (" ", 4, 5),
+    ]
+    assert app.find_line("import re") == 3
+    # A removed line is anchored to the new line that follows it.
+    assert app.find_line("import sys") == 2
+    assert files["README.md"].find_line("new") == 10
+
+def test_reader_without_limits_matches_parse_diff():
+    reader, files = read()
+    assert not reader.truncated
+    assert format_diff(files) == format_diff(parse_diff(DIFF).values())
+
+def test_reader_max_files():
+    reader, files = read(max_files=1)
+    assert reader.truncated
+    assert [diff_file.path for diff_file in files] == ["app.py"]
+
+def test_reader_keeps_the_part_of_a_file_cut_by_max_bytes():
+    # Stop right after "+import json", in the middle of the first hunk.
+    limit = DIFF.index("+import re")
+    reader, files = read(max_bytes=limit)
+    assert reader.truncated
+    assert [diff_file.path for diff_file in files] == ["app.py"]
+    hunk = files[0].hunks[0]
+    assert hunk.header == "@@ -1,2 +1,2 @@ def main():"
+    assert [line.kind + line.content for line in hunk.lines] == [" import os", "-import sys", "+import json"]
+
+def test_reader_recomputes_header_of_a_pure_insertion():
+    diff = "diff --git a/a.txt b/a.txt\n--- a/a.txt\n+++ b/a.txt\n@@ -3,0 +4,3 @@\n+a\n+b\n+c"
+    reader = DiffReader(diff.splitlines(), max_bytes=diff.index("+c"))
+    files = list(reader)
+    assert files[0].hunks[0].header == "@@ -3,0 +4,2 @@"
+
+def test_reader_drops_a_file_cut_before_its_first_hunk_line():
+    limit = DIFF.index(" import os")
+    reader, files = read(max_bytes=limit)
+    assert reader.truncated
+    assert files == []
+    assert reader.files_read == 0
+
+def test_chunk_diff_splits_on_hunks_and_repeats_the_header():
+    diff_file = parse_diff(DIFF)["app.py"]
+    diff_file.hunks.append(diff_file.hunks[0])
+    chunks = chunk_diff([diff_file], max_tokens=40)
+    assert len(chunks) == 2
+    assert all(chunk.startswith("diff --git a/app.py b/app.py") for chunk in chunks)
@@ -0,0 +1,47 @@
+import json
+
+from feedback_parser import JsonArrayStream, strip_code_fence
+from pr_reviewer import parse_ai_feedback
+
+COMMENTS = [
+    {"file": "app.py", "line": "print(\"[x]\")", "comment": "Use logging, not \"print\" [style]."},
+    {"file": "lib/a\\b.py", "line": "x = {}", "comment": "Escaped backslash \\\" and a } brace."},
+]
+ARRAY = json.dumps(COMMENTS)
+
+def test_strip_code_fence():
+    assert strip_code_fence(f"```json\n{ARRAY}\n```") == ARRAY
+    assert strip_code_fence(f"  ```\n{ARRAY}```  ") == ARRAY
+    assert strip_code_fence(f"  {ARRAY}\n") == ARRAY
+
+def test_parse_fenced_feedback():
+    assert parse_ai_feedback(f"```json\n{ARRAY}\n```") == ("comment", COMMENTS)
+    assert parse_ai_feedback("```\napprove\n```") == ("approve", None)
+
+def test_parse_feedback_wrapped_in_prose():
+    feedback = f"Found a [critical] issue and [1] more: {ARRAY}\nSee [the docs]."
+    assert parse_ai_feedback(feedback) == ("comment", COMMENTS)
+
+def test_prose_without_an_array_is_kept_as_text():
+    feedback = "Found a [critical] issue in [app.py]."
+    assert parse_ai_feedback(feedback) == ("comment", feedback)
+
+def test_stream_split_across_deltas():
+    text = f"Here you go [see below]:\n```json\n{ARRAY}\n```"
+    for size in (1, 2, 7):
+        stream = JsonArrayStream()
+        objects = []
+        for start in range(0, len(text), size):
+            objects += stream.feed(text[start:start + size])
+        assert objects == COMMENTS
+
+def test_stream_returns_each_object_once_it_is_complete():
+    stream = JsonArrayStream()
+    first = json.dumps(COMMENTS[0])
+    assert stream.feed("[" + first[:-1]) == []
+    assert stream.feed(first[-1] + ", ") == [COMMENTS[0]]
+    assert stream.feed(json.dumps(COMMENTS[1]) + "] [{\"file\": \"ignored\"}]") == [COMMENTS[1]]
+
+def test_stream_empty_array_and_non_object_elements():
+    assert JsonArrayStream().feed("[ ] [{\"file\": \"ignored\"}]") == []
+    assert JsonArrayStream().feed("[{\"a\": 1}, 2, \"s\", {\"b\": [1, 2]}]") == [{"a": 1}, {"b": [1, 2]}]
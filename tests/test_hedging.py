@@ -0,0 +1,125 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client
+from hedging import CancelToken, CircuitBreaker, LatencyTracker, hedged_call
+
+def answer(value, seconds=0.0):
+    """An attempt returning value after seconds, or None early when cancelled."""
+    def attempt(cancel):
+        if cancel.wait(seconds):
+            return None
+        return value
+    return attempt
+
+def fail(error):
+    def attempt(cancel):
+        raise error
+    return attempt
+
+def is_valid(result):
+    return result is not None and result != "invalid"
+
+def test_fast_first_attempt_wins_without_hedging():
+    started = []
+    def hedge(cancel):
+        started.append(True)
+        return "second"
+    assert hedged_call([answer("first"), hedge], 1.0, is_valid) == (0, "first")
+    assert started == []
+
+def test_slow_first_attempt_is_hedged_and_cancelled():
+    tokens = []
+    def slow(cancel):
+        tokens.append(cancel)
+        cancel.wait(5)
+        return "first"
+    started_at = time.monotonic()
+    assert hedged_call([slow, answer("second", 0.05)], 0.1, is_valid) == (1, "second")
+    assert time.monotonic() - started_at < 1
+    assert tokens[0].is_set()
+
+def test_failure_starts_the_hedge_right_away():
+    started_at = time.monotonic()
+    assert hedged_call([fail(ValueError("down")), answer("second")], 5.0, is_valid) == (1, "second")
+    assert time.monotonic() - started_at < 1
+
+def test_invalid_results_fall_back_to_the_first_one():
+    assert hedged_call([answer("invalid"), fail(ValueError("down"))], 5.0, is_valid) == (0, "invalid")
+
+def test_all_failures_raise_the_first_error():
+    with pytest.raises(ValueError, match="first"):
+        hedged_call([fail(ValueError("first")), fail(KeyError("second"))], 5.0, is_valid)
+
+def test_cancel_token_callbacks():
+    token = CancelToken()
+    calls = []
+    unregister = token.on_cancel(lambda: calls.append("removed"))
+    token.on_cancel(lambda: calls.append("kept"))
+    unregister()
+    token.set()
+    token.set()
+    assert calls == ["kept"]
+    token.on_cancel(lambda: calls.append("late"))
+    assert calls == ["kept", "late"]
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker("Test", failure_threshold=2, reset_timeout=0.1)
+    assert not breaker.on_failure()
+    assert breaker.on_failure()
+    assert not breaker.allow()
+    time.sleep(0.15)
+    assert breaker.state == "half_open"
+    assert breaker.on_failure()
+    assert breaker.state == "open"
+    time.sleep(0.15)
+    breaker.on_success()
+    assert breaker.state == "closed"
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(window=10)
+    assert tracker.percentile(95) is None
+    for seconds in range(1, 21):
+        tracker.observe(seconds)
+    assert len(tracker) == 10
+    assert tracker.percentile(50) == 15
+    assert tracker.percentile(100) == 20
+
+@pytest.fixture
+def slow_server():
+    release = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            release.wait(10)
+            try:
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+            except OSError:
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+def test_cancel_aborts_a_pending_request(slow_server):
+    cancel = CancelToken()
+    threading.Timer(0.2, cancel.set).start()
+    started_at = time.monotonic()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        http_client.post(slow_server, json={}, cancel=cancel)
+    assert time.monotonic() - started_at < 5
@@ -0,0 +1,42 @@
+from job_store import JobStore, query_stats
+
+def test_resume_skips_only_finished_reviews(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    # A long flush interval: the rows are only written by close().
+    store = JobStore(path, batch_size=100, flush_interval=3600)
+    store.record("team", "app", 1, "c1", "approve", title="one", llm_seconds=2.0)
+    store.record("team", "app", 2, "c2", "comment", comment_count=3)
+    store.record("team", "app", 3, "c3", "skipped", reason="draft")
+    store.record("team", "app", 4, "c4", "failed", reason="timeout")
+    store.record("team", "app", 5, "c5", "comment", comment_count=1)
+    # Reviewed again and failed this time: it is not finished anymore.
+    store.record("team", "app", 5, "c5", "failed", reason="HTTP 500")
+    assert store.is_finished("team", "app", 1, "c1")
+    store.close()
+
+    store = JobStore(path)
+    try:
+        assert len(store) == 2
+        assert store.is_finished("team", "app", "1", "c1")
+        assert store.is_finished("team", "app", 2, "c2")
+        assert not store.is_finished("team", "app", 3, "c3")
+        assert not store.is_finished("team", "app", 4, "c4")
+        assert not store.is_finished("team", "app", 5, "c5")
+        # A new commit is reviewed again, and so is another repository.
+        assert not store.is_finished("team", "app", 1, "c9")
+        assert not store.is_finished("team", "api", 1, "c1")
+    finally:
+        store.close()
+
+    stats = {row["status"]: row for row in query_stats(path)}
+    assert {status: row["prs"] for status, row in stats.items()} == {"approve": 1, "comment": 1, "skipped": 1, "failed": 2}
+    assert stats["comment"]["comments"] == 3
+    assert query_stats(path, "api") == []
+
+def test_rows_are_written_without_a_flush_interval(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(path, batch_size=1, flush_interval=0)
+    for pr_id in range(5):
+        store.record("team", "app", pr_id, "c", "approve")
+    store.close()
+    assert [row["prs"] for row in query_stats(path)] == [5]
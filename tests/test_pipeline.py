@@ -0,0 +1,124 @@
+import queue
+import threading
+
+import pytest
+
+import config
+import pr_reviewer
+from job_store import JobStore
+
+class FakePR:
+    def __init__(self, pr_id, updated_on="2026-01-01T00:00:00+00:00"):
+        self.id = pr_id
+        self.title = f"PR {pr_id}"
+        self.source_commit = f"c{pr_id}"
+        self.updated_on = updated_on
+
+    def get_data(self, key):
+        return {"updated_on": self.updated_on}[key]
+
+class FakeBitbucket:
+    """Lists the given PRs of each repository; a repository mapped to an exception fails to list."""
+
+    def __init__(self, prs):
+        self.prs = prs
+        self.repositories = self
+
+    def get(self, workspace, repo_slug):
+        prs = self.prs[repo_slug]
+        if isinstance(prs, Exception):
+            raise prs
+        return type("Repo", (), {"pullrequests": type("PullRequests", (), {"each": lambda _, query: iter(prs)})()})()
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Replaces the Bitbucket and AI calls of the stages; fail maps (stage, PR id) to an error."""
+    monkeypatch.setattr(config, "_config", config.Config({"PIPELINE_QUEUE_SIZE": "1", "PIPELINE_DIFF_WORKERS": "2"}, {"NON_INTERACTIVE": "yes"}))
+    fail = {}
+    applied = []
+
+    def check(stage, pr):
+        if (stage, pr.id) in fail:
+            raise fail[(stage, pr.id)]
+
+    def plan_pr_review(pr, *args):
+        check("check", pr)
+        return True, None, None
+
+    def fetch_review_diff(pr, *args):
+        check("diff", pr)
+        return f"diff of {pr.id}", {}, False
+
+    def get_ai_review(diff, *args):
+        check("llm", FakePR(int(diff.rsplit(" ", 1)[1])))
+        return "approve", None
+
+    def apply_ai_feedback(pr, *args):
+        check("post", pr)
+        applied.append(pr.id)
+        return "approve", 0
+
+    monkeypatch.setattr(pr_reviewer, "plan_pr_review", plan_pr_review)
+    monkeypatch.setattr(pr_reviewer, "fetch_review_diff", fetch_review_diff)
+    monkeypatch.setattr(pr_reviewer, "get_ai_review", get_ai_review)
+    monkeypatch.setattr(pr_reviewer, "apply_ai_feedback", apply_ai_feedback)
+    monkeypatch.setattr(pr_reviewer, "record_pr_review", lambda *args: None)
+    monkeypatch.setattr(pr_reviewer, "start_comment_poster", lambda *args: None)
+    return fail, applied
+
+def run(bitbucket, repo_slugs, job_store=None):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pr_reviewer.run_review_pipeline(
+        bitbucket, repo_slugs, 'state = "OPEN"', "{me}", "me", "token", "team", "gemini", {}, True, job_store)))
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "the pipeline did not shut down"
+    assert not [t for t in threading.enumerate() if t.name.startswith("pipeline-")]
+    return result[0]
+
+def test_every_pr_goes_through_all_stages(pipeline):
+    _, applied = pipeline
+    stats = run(FakeBitbucket({"app": [FakePR(i) for i in range(1, 9)], "api": []}), ["app", "api"])
+    assert sorted(applied) == list(range(1, 9))
+    assert stats.repos["app"]["listed"] == 8
+    assert stats.repos["app"]["approve"] == 8
+    assert stats.repos["api"]["listed"] == 0
+
+def test_errors_stop_the_pr_but_not_the_pipeline(pipeline, tmp_path):
+    fail, applied = pipeline
+    fail[("check", 1)] = RuntimeError("activity unavailable")
+    fail[("diff", 2)] = RuntimeError("diff unavailable")
+    fail[("llm", 3)] = RuntimeError("model overloaded")
+    fail[("post", 4)] = RuntimeError("comment rejected")
+    job_store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    try:
+        stats = run(FakeBitbucket({"app": [FakePR(i) for i in range(1, 7)], "api": RuntimeError("no access")}), ["api", "app"], job_store)
+    finally:
+        job_store.close()
+    # A failed PR is not handed to the next stages.
+    assert sorted(applied) == [5, 6]
+    assert stats.repos["app"]["failed"] == 4
+    assert stats.repos["app"]["approve"] == 2
+    assert stats.repos["api"]["failed"] == 1
+    # The failed PRs are recorded as such and reviewed again in the next sweep.
+    job_store = JobStore(job_store.path)
+    try:
+        assert [job_store.is_finished("team", "app", i, f"c{i}") for i in range(1, 7)] == [False] * 4 + [True] * 2
+    finally:
+        job_store.close()
+
+def test_stage_workers_stop_the_next_stage_once_done():
+    in_queue, out_queue = queue.Queue(), queue.Queue()
+    stats = pr_reviewer.PipelineStats()
+    threads = pr_reviewer._start_pipeline_stage("check", 3, in_queue, out_queue, 2, lambda item, emit: emit(item * 2), stats)
+    for item in range(5):
+        in_queue.put(item)
+    for _ in threads:
+        in_queue.put(pr_reviewer._PIPELINE_DONE)
+    for thread in threads:
+        thread.join(5)
+    items = [out_queue.get_nowait() for _ in range(out_queue.qsize())]
+    assert sorted(item for item in items if item is not pr_reviewer._PIPELINE_DONE) == [0, 2, 4, 6, 8]
+    # One stop marker per worker of the next stage, after every item.
+    assert items[-2:] == [pr_reviewer._PIPELINE_DONE] * 2
+    assert items.count(pr_reviewer._PIPELINE_DONE) == 2
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from email.utils import formatdate
+
+from rate_limiter import ProviderScheduler, TokenBucket, get_retry_delay
+
+class FakeResponse:
+    def __init__(self, status_code=429, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("no JSON")
+        return json.loads(self._body)
+
+def test_token_bucket_refills_continuously():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1, now) == 1.0
+    assert bucket.wait_time(1, now + 0.5) == 0.5
+    # Never more than a minute of tokens, and a larger request only waits for a full bucket.
+    assert bucket.wait_time(120, now + 600) == 0
+    bucket.consume(120)
+    assert bucket.tokens == 0
+
+def test_scheduler_waits_for_the_request_budget():
+    scheduler = ProviderScheduler("test", requests_per_minute=600)
+    started = time.monotonic()
+    for _ in range(601):
+        with scheduler.slot():
+            pass
+    # The 601st request waits for a token, refilled every 0.1 seconds.
+    assert time.monotonic() - started >= 0.05
+
+def test_scheduler_waits_for_the_token_budget():
+    scheduler = ProviderScheduler("test", tokens_per_minute=6000)
+    with scheduler.slot(tokens=6000):
+        pass
+    started = time.monotonic()
+    with scheduler.slot(tokens=10):
+        pass
+    assert time.monotonic() - started >= 0.05
+
+def test_pause_after_a_429_is_shared_by_all_callers():
+    scheduler = ProviderScheduler("test", max_concurrency=4)
+    scheduler.on_response(FakeResponse(429, {"Retry-After": "0.3"}))
+    waits = []
+
+    def request():
+        started = time.monotonic()
+        with scheduler.slot():
+            waits.append(time.monotonic() - started)
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(waits) == 3
+    assert min(waits) >= 0.25
+
+def test_concurrency_is_halved_on_429_and_grows_back_by_one():
+    scheduler = ProviderScheduler("test", max_concurrency=8)
+    scheduler.on_rate_limited()
+    assert scheduler.concurrency == 4
+    scheduler.on_response(FakeResponse(503))
+    assert scheduler.concurrency == 2
+    scheduler.on_rate_limited()
+    scheduler.on_rate_limited()
+    assert scheduler.concurrency == 1
+    scheduler.on_response(FakeResponse(200))
+    assert scheduler.concurrency == 2
+    # A window of `concurrency` successes is needed for the next increase.
+    scheduler.on_success()
+    assert scheduler.concurrency == 2
+    scheduler.on_success()
+    assert scheduler.concurrency == 3
+    for _ in range(100):
+        scheduler.on_success()
+    assert scheduler.concurrency == 8
+    # Other errors do not change the limit.
+    scheduler.on_response(FakeResponse(500))
+    assert scheduler.concurrency == 8
+
+def test_concurrency_limit_blocks_extra_requests():
+    scheduler = ProviderScheduler("test", max_concurrency=1)
+    entered = threading.Event()
+
+    def request():
+        with scheduler.slot():
+            entered.set()
+
+    with scheduler.slot():
+        thread = threading.Thread(target=request)
+        thread.start()
+        assert not entered.wait(0.1)
+    assert entered.wait(5)
+    thread.join(5)
+
+def test_retry_after_in_seconds():
+    assert get_retry_delay(FakeResponse(headers={"Retry-After": "12"})) == 12
+    assert get_retry_delay(FakeResponse(headers={"Retry-After": "1.5"})) == 1.5
+
+def test_retry_after_as_an_http_date():
+    delay = get_retry_delay(FakeResponse(headers={"Retry-After": formatdate(time.time() + 30, usegmt=True)}))
+    assert 25 <= delay <= 31
+    assert get_retry_delay(FakeResponse(headers={"Retry-After": formatdate(time.time() - 30, usegmt=True)})) == 0
+
+def test_missing_retry_after():
+    assert get_retry_delay(None) is None
+    assert get_retry_delay(FakeResponse()) is None
+    assert get_retry_delay(FakeResponse(body='{"error": {"message": "quota"}}')) is None
+    assert get_retry_delay(FakeResponse(body="[]")) is None
+
+def test_gemini_retry_info():
+    body = json.dumps({"error": {"code": 429, "details": [
+        {"@type": "type.googleapis.com/google.rpc.QuotaFailure"},
+        {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1m30s"},
+    ]}})
+    assert get_retry_delay(FakeResponse(body=body)) == 90
+    body = json.dumps({"error": {"details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "17s"}]}})
+    assert get_retry_delay(FakeResponse(body=body)) == 17
@@ -0,0 +1,42 @@
+import os
+import time
+
+from review_cache import ReviewCache
+
+def entry_paths(cache):
+    return sorted(os.path.join(root, name) for root, _, files in os.walk(cache.directory) for name in files)
+
+def test_hit_and_miss(tmp_path):
+    cache = ReviewCache(str(tmp_path))
+    key = ReviewCache.make_key(diff="d", provider="gemini", model="m", temperature=0.2)
+    assert cache.get(key) is None
+    cache.put(key, "approve")
+    assert cache.get(key) == "approve"
+    # A new instance reads the entries written before.
+    assert ReviewCache(str(tmp_path)).get(key) == "approve"
+    assert key != ReviewCache.make_key(diff="d", provider="gemini", model="m", temperature=0.3)
+
+def test_expired_entries_are_dropped(tmp_path, monkeypatch):
+    cache = ReviewCache(str(tmp_path), max_age_seconds=60)
+    key = ReviewCache.make_key(diff="d")
+    cache.put(key, "approve")
+    assert cache.get(key) == "approve"
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert cache.get(key) is None
+    assert entry_paths(cache) == []
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ReviewCache(str(tmp_path))
+    keys = [ReviewCache.make_key(diff=str(i)) for i in range(3)]
+    for age, key in zip((30, 20, 10), keys):
+        cache.put(key, "x" * 100)
+        os.utime(cache._path(key), (time.time() - age, time.time() - age))
+    entry_size = os.path.getsize(cache._path(keys[0]))
+    # Reading the oldest entry makes it the most recently used.
+    assert cache.get(keys[0]) is not None
+    # Room for three entries and a half (their sizes differ by a few bytes of timestamp).
+    cache = ReviewCache(str(tmp_path), max_bytes=int(3.5 * entry_size))
+    cache.put(ReviewCache.make_key(diff="new"), "x" * 100)
+    assert [cache.get(key) is not None for key in keys] == [True, False, True]
+    assert len(entry_paths(cache)) == 3
@@ -0,0 +1,86 @@
+import re
+
+import config
+import pr_reviewer
+from review_state import ReviewState
+
+T1, T2, T3 = "2026-01-01T10:00:00+00:00", "2026-01-01T11:00:00+00:00", "2026-01-01T12:00:00+00:00"
+
+class FakePR:
+    def __init__(self, pr_id, updated_on):
+        self.id = pr_id
+        self.title = f"PR {pr_id}"
+        self.source_commit = f"c{pr_id}"
+        self.updated_on = updated_on
+
+    def get_data(self, key):
+        return {"updated_on": self.updated_on}[key]
+
+class FakeBitbucket:
+    """Lists the open PRs of a repository matching the updated_on cursor of the query."""
+
+    def __init__(self, prs):
+        self.prs = prs
+        self.queries = []
+        self.repositories = self
+
+    def get(self, workspace, repo_slug):
+        return type("Repo", (), {"pullrequests": type("PullRequests", (), {"each": lambda _, query: self.each(repo_slug, query)})()})()
+
+    def each(self, repo_slug, query):
+        self.queries.append((repo_slug, query))
+        match = re.search(r"updated_on > (\S+)", query)
+        return iter([pr for pr in self.prs[repo_slug] if match is None or pr.updated_on > match.group(1)])
+
+def test_cursor_only_moves_forward_after_a_successful_cycle(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "_config", config.Config({}, {"NON_INTERACTIVE": "yes"}))
+    state = ReviewState(str(tmp_path / "state.json"))
+    monkeypatch.setattr(pr_reviewer, "load_review_state", lambda: state)
+    failing = set()
+    reviewed = []
+
+    def get_ai_review(diff, *args):
+        if diff in failing:
+            raise RuntimeError("model overloaded")
+        return "approve", None
+
+    def apply_ai_feedback(pr, *args):
+        reviewed.append(pr.id)
+        return "approve", 0
+
+    monkeypatch.setattr(pr_reviewer, "plan_pr_review", lambda *args: (True, None, None))
+    monkeypatch.setattr(pr_reviewer, "fetch_review_diff", lambda pr, *args: (f"diff of {pr.id}", {}, False))
+    monkeypatch.setattr(pr_reviewer, "get_ai_review", get_ai_review)
+    monkeypatch.setattr(pr_reviewer, "apply_ai_feedback", apply_ai_feedback)
+    monkeypatch.setattr(pr_reviewer, "record_pr_review", lambda *args: None)
+    monkeypatch.setattr(pr_reviewer, "start_comment_poster", lambda *args: None)
+
+    bitbucket = FakeBitbucket({"app": [FakePR(1, T1), FakePR(2, T2)], "empty": []})
+    cursors = []
+
+    def next_cycle(seconds):
+        # Called between cycles instead of sleeping: check the cursors and set up the next cycle.
+        cursors.append((state.get_cursor("team", "app"), state.get_cursor("team", "empty")))
+        if len(cursors) == 1:
+            bitbucket.prs["app"].append(FakePR(3, T3))
+            failing.add("diff of 3")
+        elif len(cursors) == 2:
+            failing.clear()
+        elif len(cursors) == 4:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(pr_reviewer.time, "sleep", next_cycle)
+    pr_reviewer.run_watch_mode(bitbucket, ["app", "empty"], "{me}", "me", "token", "team", "gemini", {})
+
+    assert [cursor for cursor, _ in cursors] == [
+        T2,  # both PRs reviewed
+        T2,  # PR 3 failed: it is listed again in the next cycle
+        T3,  # PR 3 reviewed
+        T3,  # nothing new: the cursor stays
+    ]
+    assert sorted(reviewed) == [1, 2, 3]
+    # A repository without PRs starts from the time of its first cycle, and keeps that cursor.
+    assert cursors[0][1] is not None
+    assert len({empty for _, empty in cursors}) == 1
+    app_queries = [query for slug, query in bitbucket.queries if slug == "app"]
+    assert app_queries == ['state = "OPEN"'] + [f'state = "OPEN" AND updated_on > {T2}'] * 2 + [f'state = "OPEN" AND updated_on > {T3}']
@@ -0,0 +1,112 @@
+import hashlib
+import hmac
+import http.client
+import json
+import threading
+
+import pytest
+
+from webhook_server import MAX_BODY_BYTES, CoalescingWorkQueue, make_server, verify_signature
+
+SECRET = "s3cret"
+PAYLOAD = json.dumps({"repository": {"full_name": "team/app"}, "pullrequest": {"id": 7}}).encode("utf-8")
+
+def sign(body, secret=SECRET):
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+def test_verify_signature():
+    assert verify_signature(SECRET, PAYLOAD, sign(PAYLOAD))
+    assert not verify_signature(SECRET, PAYLOAD, sign(PAYLOAD, "other"))
+    assert not verify_signature(SECRET, PAYLOAD + b" ", sign(PAYLOAD))
+    assert not verify_signature(SECRET, PAYLOAD, sign(PAYLOAD)[len("sha256="):])
+    assert not verify_signature(SECRET, PAYLOAD, None)
+
+@pytest.fixture
+def server():
+    events = []
+    httpd = make_server("127.0.0.1", 0, SECRET, lambda *event: events.append(event) or True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1], events
+    httpd.shutdown()
+    httpd.server_close()
+
+def post(port, headers, body=b""):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        connection.putrequest("POST", "/")
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())["status"]
+    finally:
+        connection.close()
+
+def event_headers(body, signature=None):
+    headers = {"X-Event-Key": "pullrequest:updated", "Content-Length": str(len(body))}
+    if signature is not None:
+        headers["X-Hub-Signature"] = signature
+    return headers
+
+def test_signed_event_is_queued(server):
+    port, events = server
+    assert post(port, event_headers(PAYLOAD, sign(PAYLOAD)), PAYLOAD) == (202, "queued")
+    assert events == [("pullrequest:updated", "team", "app", 7)]
+
+def test_invalid_or_missing_signature_is_rejected(server):
+    port, events = server
+    assert post(port, event_headers(PAYLOAD, sign(PAYLOAD, "other")), PAYLOAD) == (401, "invalid signature")
+    assert post(port, event_headers(PAYLOAD), PAYLOAD) == (401, "invalid signature")
+    assert events == []
+
+def test_oversized_body_is_rejected_unread(server):
+    port, events = server
+    headers = event_headers(b"", sign(PAYLOAD))
+    headers["Content-Length"] = str(MAX_BODY_BYTES + 1)
+    assert post(port, headers) == (413, "payload too large")
+    assert events == []
+
+def test_invalid_length_or_payload_is_a_bad_request(server):
+    port, events = server
+    headers = event_headers(b"", sign(b""))
+    headers["Content-Length"] = "abc"
+    assert post(port, headers) == (400, "invalid content length")
+    body = json.dumps({"repository": {"full_name": "app"}, "pullrequest": {"id": 7}}).encode("utf-8")
+    assert post(port, event_headers(body, sign(body)), body) == (400, "invalid payload")
+    assert post(port, event_headers(b"{", sign(b"{")), b"{") == (400, "invalid payload")
+    assert events == []
+
+def test_work_queue_coalesces_pending_items():
+    work_queue = CoalescingWorkQueue()
+    work_queue.put("a", 1)
+    work_queue.put("b", 1)
+    work_queue.put("a", 2)
+    assert len(work_queue) == 2
+    assert sorted([work_queue.get(), work_queue.get()]) == [("a", 2), ("b", 1)]
+    assert len(work_queue) == 0
+
+def test_work_queue_waits_for_events_to_settle():
+    work_queue = CoalescingWorkQueue(coalesce_seconds=60)
+    work_queue.put("a", 1)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(work_queue.get()))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    work_queue.close()
+    thread.join(5)
+    assert result == [None]
+
+def test_work_queue_reruns_an_item_updated_while_running():
+    work_queue = CoalescingWorkQueue()
+    work_queue.put("a", 1)
+    assert work_queue.get() == ("a", 1)
+    work_queue.put("a", 2)
+    work_queue.put("a", 3)
+    # Not handed out again while it is still running.
+    assert len(work_queue) == 0
+    work_queue.done("a")
+    assert work_queue.get() == ("a", 3)
+    work_queue.done("a")
+    assert len(work_queue) == 0
@@ -1,22 +1,35 @@
+import importlib.util
 import subprocess
 import sys
 
-def install_needed_libraries():
-    """Checks for required libraries and installs them if they are missing."""
-    try:
-        import requests
-    except ImportError:
-        print("requests is not installed. Installing...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "requests"])
-    try:
-        from atlassian.bitbucket import Cloud
-        from atlassian.errors import ApiError
-    except ImportError:
-        print("atlassian-python-api is not installed. Installing...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "atlassian-python-api"])
+# (module to import, pip package) of the libraries every mode needs
+REQUIRED_LIBRARIES = (
+    ("requests", "requests"),
+    ("atlassian", "atlassian-python-api"),
+)
+# Only needed when Gemini is the selected AI agent
+GEMINI_LIBRARIES = (
+    ("google.auth", "google-auth"),
+    ("google_auth_oauthlib", "google-auth-oauthlib"),
+)
+
+def _is_installed(module):
     try:
-        import google.auth
-        from google_auth_oauthlib.flow import InstalledAppFlow
+        return importlib.util.find_spec(module) is not None
     except ImportError:
-        print("google-auth and google-auth-oauthlib are not installed. Installing...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "google-auth", "google-auth-oauthlib"])
+        # The parent package of a dotted module name is missing.
+        return False
+
+def install_needed_libraries(libraries=REQUIRED_LIBRARIES, allow_install=True):
+    """Checks for the given libraries, without importing them, and installs the missing ones.
+
+    When allow_install is False, an ImportError naming the missing packages is raised instead.
+    """
+    missing = [package for module, package in libraries if not _is_installed(module)]
+    if not missing:
+        return
+    if not allow_install:
+        raise ImportError(f"Missing libraries: {', '.join(missing)}. Install them with: pip install {' '.join(missing)}")
+    print(f"{', '.join(missing)} {'is' if len(missing) == 1 else 'are'} not installed. Installing...")
+    subprocess.check_call([sys.executable, "-m", "pip", "install", *missing])
+    importlib.invalidate_caches()
@@ -0,0 +1,146 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PULL_REQUEST_EVENTS = ("pullrequest:created", "pullrequest:updated")
+MAX_BODY_BYTES = 1024 * 1024  # Bitbucket pull request payloads are a few KB
+
+class CoalescingWorkQueue:
+    """A work queue that deduplicates items by key.
+
+    An item only becomes ready once no new event arrived for it during coalesce_seconds,
+    so rapid pushes to the same PR result in a single review. An item that is queued
+    again while it is being processed runs once more after the current run finishes.
+    """
+
+    def __init__(self, coalesce_seconds=0):
+        self.coalesce_seconds = coalesce_seconds
+        self._cond = threading.Condition()
+        self._pending = {}  # key -> (due time, value)
+        self._running = set()
+        self._rerun = {}
+        self._closed = False
+
+    def put(self, key, value):
+        """Queues the value under the key, replacing a pending value with the same key."""
+        with self._cond:
+            if key in self._running:
+                self._rerun[key] = value
+                return
+            self._pending[key] = (time.monotonic() + self.coalesce_seconds, value)
+            self._cond.notify_all()
+
+    def get(self):
+        """Waits for the next ready item. Returns (key, value), or None once the queue is closed."""
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                now = time.monotonic()
+                wait = None
+                for key, (due, value) in self._pending.items():
+                    if due <= now:
+                        del self._pending[key]
+                        self._running.add(key)
+                        return key, value
+                    wait = due - now if wait is None else min(wait, due - now)
+                self._cond.wait(timeout=wait)
+
+    def done(self, key):
+        """Marks the item as processed, queueing it again if it was updated in the meantime."""
+        with self._cond:
+            self._running.discard(key)
+            if key in self._rerun:
+                self._pending[key] = (time.monotonic() + self.coalesce_seconds, self._rerun.pop(key))
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+def verify_signature(secret, body, signature_header):
+    """Checks the X-Hub-Signature header ("sha256=<hex>") Bitbucket sends when a webhook secret is set."""
+    if not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256="):].strip())
+
+def parse_pull_request_event(payload):
+    """Returns (workspace, repo_slug, pr_id) of a pull request webhook payload, or None."""
+    try:
+        full_name = payload["repository"]["full_name"]
+        pr_id = int(payload["pullrequest"]["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    workspace, _, repo_slug = full_name.partition("/")
+    if not repo_slug:
+        return None
+    return workspace, repo_slug, pr_id
+
+def make_server(host, port, secret, on_event):
+    """Creates an HTTP server accepting Bitbucket pull request webhooks on any path.
+
+    on_event is called with (event_key, workspace, repo_slug, pr_id) for every verified
+    pullrequest:created/updated event. Without a secret, events are not verified. Bodies
+    over MAX_BODY_BYTES are rejected unread. GET requests answer with a health check.
+    """
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def _respond(self, status, message):
+            body = json.dumps({"status": message}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._respond(200, "ok")
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0 or length > MAX_BODY_BYTES:
+                # The body is not read, so the connection cannot be reused.
+                self.close_connection = True
+                if length > MAX_BODY_BYTES:
+                    self._respond(413, "payload too large")
+                else:
+                    self._respond(400, "invalid content length")
+                return
+            body = self.rfile.read(length)
+            if secret and not verify_signature(secret, body, self.headers.get("X-Hub-Signature")):
+                self._respond(401, "invalid signature")
+                return
+
+            event_key = self.headers.get("X-Event-Key", "")
+            if event_key not in PULL_REQUEST_EVENTS:
+                self._respond(200, "ignored")
+                return
+            try:
+                event = parse_pull_request_event(json.loads(body))
+            except ValueError:
+                event = None
+            if event is None:
+                self._respond(400, "invalid payload")
+                return
+
+            if on_event(event_key, *event):
+                self._respond(202, "queued")
+            else:
+                self._respond(200, "ignored")
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), WebhookHandler)